@@ -0,0 +1,124 @@
+import atexit
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, models, transaction
+from django.db.models import Case, F, Value, When
+from django.utils import timezone
+
+from .models import ShareableLink
+from .rollups import update_share_stats
+
+logger = logging.getLogger(__name__)
+
+class AccessBuffer:
+    """
+    Buffers share-link accesses per process and writes them back in bulk,
+    so hits on a popular link don't each UPDATE (and lock) its row.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.flusher = None
+
+    def record(self, token, user_id=None):
+        now = timezone.now()
+        with self.lock:
+            count, _, accessed_by_id = self.pending.get(token, (0, None, None))
+            self.pending[token] = (count + 1, now, user_id or accessed_by_id)
+            size = len(self.pending)
+
+        interval = settings.SHARE_ACCESS_FLUSH_INTERVAL
+        if not interval:
+            self.flush()
+            return
+        if size >= settings.SHARE_ACCESS_MAX_PENDING:
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush share-link accesses")
+        self.start_flusher(interval)
+
+    def flush(self):
+        """Write all buffered accesses; returns the number of links updated"""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        items = list(pending.items())
+        batch_size = settings.SHARE_ACCESS_FLUSH_BATCH_SIZE
+        for i in range(0, len(items), batch_size):
+            try:
+                self.write_batch(items[i:i + batch_size])
+            except Exception:
+                # Put unwritten accesses back so the next flush retries them
+                self.merge(items[i:])
+                raise
+        return len(items)
+
+    def merge(self, items):
+        with self.lock:
+            for token, (count, at, user_id) in items:
+                newer_count, newer_at, newer_user_id = self.pending.get(token, (0, at, None))
+                self.pending[token] = (count + newer_count, newer_at, newer_user_id or user_id)
+
+    def write_batch(self, items):
+        # One UPDATE for the whole batch, each row incremented by its own count
+        counts = [When(token=token, then=Value(count)) for token, (count, _, _) in items]
+        accessed_at = [When(token=token, then=Value(at)) for token, (_, at, _) in items]
+        accessed_by = [
+            When(token=token, then=Value(user_id))
+            for token, (_, _, user_id) in items if user_id
+        ]
+        updates = {
+            'access_count': F('access_count') + Case(
+                *counts, default=Value(0), output_field=models.PositiveIntegerField()
+            ),
+            'last_accessed_at': Case(
+                *accessed_at, default=F('last_accessed_at'), output_field=models.DateTimeField()
+            ),
+        }
+        if accessed_by:
+            updates['accessed_by_id'] = Case(
+                *accessed_by, default=F('accessed_by_id'), output_field=models.BigIntegerField()
+            )
+        tokens = [token for token, _ in items]
+        # Rolled back together so a retried batch is never counted twice
+        with transaction.atomic():
+            owners = ShareableLink.objects.filter(token__in=tokens).values_list('token', 'file_id', 'file__owner_id')
+            ShareableLink.objects.filter(token__in=tokens).update(**updates)
+            pending = dict(items)
+            update_share_stats(
+                (file_id, owner_id, 0, pending[token][0], pending[token][1])
+                for token, file_id, owner_id in owners
+            )
+
+    def start_flusher(self, interval):
+        if self.flusher is not None and self.flusher.is_alive():
+            return
+        with self.lock:
+            if self.flusher is not None and self.flusher.is_alive():
+                return
+            self.flusher = threading.Thread(
+                target=self.run_flusher, args=(interval,), name='share-access-flusher', daemon=True
+            )
+            self.flusher.start()
+
+    def run_flusher(self, interval):
+        while True:
+            time.sleep(interval)
+            close_old_connections()
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Failed to flush share-link accesses")
+            finally:
+                close_old_connections()
+
+access_buffer = AccessBuffer()
+atexit.register(access_buffer.flush)
+
+def record_access(token, user=None):
+    user_id = user.id if user is not None and user.is_authenticated else None
+    access_buffer.record(token, user_id)
@@ -4,3 +4,6 @@ class FilesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'files'
     verbose_name = 'Files'
+
+    def ready(self):
+        from . import metrics, query_budget, signals  # noqa: F401
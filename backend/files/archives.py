@@ -0,0 +1,102 @@
+import json
+import os
+import zipfile
+
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import content_disposition_header
+
+from .downloads import EXPOSED_HEADERS, get_encryption_key_header
+from .storage import get_storage
+
+MANIFEST_NAME = 'manifest.json'
+
+class ArchiveBuffer:
+    """
+    Write-only, unseekable file for ZipFile: whatever is written is held
+    only until the next drain(), so an archive is streamed as it is built.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self.chunks = self.chunks, []
+        return chunks
+
+def archive_names(files):
+    """Unique, flat entry names for the files (duplicates get ' (n)' added)"""
+    seen = {MANIFEST_NAME}
+    names = []
+    for file in files:
+        name = file.filename.replace('\\', '/').rsplit('/', 1)[-1] or str(file.id)
+        base, ext = os.path.splitext(name)
+        n = 1
+        while name in seen:
+            name = f'{base} ({n}){ext}'
+            n += 1
+        seen.add(name)
+        names.append(name)
+    return names
+
+def build_manifest(files, names):
+    return json.dumps({
+        'files': [
+            {
+                'name': name,
+                'id': str(file.id),
+                'filename': file.filename,
+                'size': file.size,
+                'mime_type': file.mime_type,
+                'encryption_key': get_encryption_key_header(file),
+            }
+            for file, name in zip(files, names)
+        ],
+    }, indent=2).encode()
+
+def entry_info(name, size, modified):
+    info = zipfile.ZipInfo(name, date_time=timezone.localtime(modified).timetuple()[:6])
+    info.compress_type = zipfile.ZIP_STORED
+    # Decides up front whether the entry needs ZIP64 sizes
+    info.file_size = size
+    return info
+
+def stream_archive(files):
+    """
+    Yield a stored (uncompressed) ZIP of the files' ciphertext, preceded by
+    a manifest with each entry's key. Each file is read in chunks as it is
+    added, so memory use doesn't grow with the archive.
+    """
+    storage = get_storage()
+    names = archive_names(files)
+    buffer = ArchiveBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        manifest = build_manifest(files, names)
+        archive.writestr(entry_info(MANIFEST_NAME, len(manifest), timezone.now()), manifest)
+        yield from buffer.drain()
+        for file, name in zip(files, names):
+            with archive.open(entry_info(name, file.size, file.updated_at), 'w') as entry:
+                yield from buffer.drain()
+                for chunk in storage.read(file.file.name):
+                    entry.write(chunk)
+                    yield from buffer.drain()
+            yield from buffer.drain()
+    yield from buffer.drain()
+
+def build_archive_response(files, filename='files.zip'):
+    response = StreamingHttpResponse(stream_archive(files), content_type='application/zip')
+    response['Content-Disposition'] = content_disposition_header(True, filename)
+    response['Access-Control-Expose-Headers'] = EXPOSED_HEADERS
+    return response
@@ -0,0 +1,118 @@
+"""
+Async versions of the download endpoints, routed in place of the
+FileViewSet actions when ASYNC_DOWNLOADS is on (the ASGI default). A
+download then holds no thread while its body streams to the client; only
+the authorization lookups and each chunk read run in worker threads.
+"""
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.utils import timezone
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import APIException, AuthenticationFailed, NotAuthenticated, Throttled
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from .access import record_access
+from .downloads import build_file_response
+from .link_cache import load_encryption_keys, record_to_file, resolve_share_token
+from .models import File, ShareableLink
+from .share_tokens import reject_share_token
+from .storage import get_storage
+from .throttling import SHARE_THROTTLES, throttle_wait
+
+def error_response(status, error, message):
+    return JsonResponse({'error': error, 'message': message}, status=status)
+
+def authentication_error(request, exc, authenticator):
+    """The response DRF's exception handler would give exc"""
+    data = exc.detail if isinstance(exc.detail, dict) else {'detail': exc.detail}
+    response = JsonResponse(data, status=exc.status_code)
+    if isinstance(exc, (NotAuthenticated, AuthenticationFailed)):
+        header = authenticator.authenticate_header(request)
+        if header:
+            response['WWW-Authenticate'] = header
+        else:
+            response.status_code = 403
+    return response
+
+def throttled_response(wait):
+    """The response DRF gives a throttled request"""
+    exc = Throttled(wait)
+    response = JsonResponse({'detail': exc.detail}, status=exc.status_code)
+    response['Retry-After'] = '%d' % exc.wait
+    return response
+
+async def authenticate(request):
+    """
+    Authenticate with the API's authentication classes, as the viewset
+    would. Returns (user, None) or (None, error response).
+    """
+    authenticators = [auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES]
+    api_request = Request(request, authenticators=authenticators)
+    try:
+        user = await sync_to_async(lambda: api_request.user)()
+        if not user.is_authenticated:
+            raise NotAuthenticated()
+    except APIException as exc:
+        return None, authentication_error(request, exc, authenticators[0])
+    return user, None
+
+async def file_exists(file):
+    return await sync_to_async(get_storage().exists, thread_sensitive=False)(file.file.name)
+
+@require_GET
+async def download(request, pk):
+    user, error = await authenticate(request)
+    if error:
+        return error
+
+    try:
+        file = await File.objects.aget(pk=pk, owner=user)
+    except File.DoesNotExist:
+        return JsonResponse({'error': 'File not found'}, status=404)
+
+    if not await file_exists(file):
+        return JsonResponse({'error': 'File not found'}, status=404)
+
+    return build_file_response(request, file, asynchronous=True)
+
+@require_GET
+async def download_shared_file(request):
+    """Download a shared file with token validation"""
+    user, error = await authenticate(request)
+    if error:
+        return error
+
+    wait = await sync_to_async(throttle_wait)(request, SHARE_THROTTLES)
+    if wait is not None:
+        return throttled_response(wait)
+
+    token = request.GET.get('token')
+    if not token:
+        return error_response(400, 'Access Denied', 'No token provided')
+
+    # Signed tokens that can't be valid are refused without a lookup
+    rejection = reject_share_token(token, user)
+    if rejection:
+        status, message = rejection
+        return error_response(status, 'Access Denied', message)
+
+    try:
+        share_link = await sync_to_async(resolve_share_token)(token)
+    except ShareableLink.DoesNotExist:
+        return error_response(404, 'Access Denied', 'This link is invalid')
+
+    if share_link.expires_at < timezone.now():
+        return error_response(403, 'Access Denied', 'This link has expired')
+
+    if share_link.guest_id is not None and user.id != share_link.guest_id:
+        return error_response(403, 'Access Denied', 'This link is not shared with you')
+
+    file = record_to_file(share_link)
+    try:
+        if not await sync_to_async(load_encryption_keys)([file]) or not await file_exists(file):
+            return error_response(404, 'File Not Found', 'The file no longer exists')
+        await sync_to_async(record_access)(token, user)
+        return build_file_response(request, file, asynchronous=True)
+    except Exception as e:
+        return error_response(500, 'Server Error', str(e))
@@ -0,0 +1,71 @@
+"""
+Moves committed chunked uploads into the content-addressed blob store
+(CONTENT_ADDRESSED_STORAGE). Hashing a large upload means reading it back
+from storage, so it is done after the commit's request and transaction, on
+one background thread per process. Until then the File is served from its
+upload path. `python manage.py dedupe_files` catches up on files a process
+did not get to (e.g. it was restarted).
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import close_old_connections, transaction
+
+from .models import Blob, File, compute_sha256
+from .storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+def dedupe_file(file_id):
+    """
+    Hash a file that is not blob-backed yet and point it at the blob with
+    that hash. Returns False if the file is gone or already hashed.
+    """
+    file = File.objects.filter(pk=file_id, sha256='').only('file', 'size').first()
+    if file is None:
+        return False
+    source = file.file.name
+    storage = get_storage()
+    # The long part, outside any transaction
+    sha256 = compute_sha256(storage.read(source))
+    # The reference is taken together with the File update, so
+    # collect_garbage never counts it without the File that holds it
+    with transaction.atomic():
+        if not File.objects.select_for_update().filter(pk=file_id, sha256='', file=source).exists():
+            # Deleted, or deduplicated by someone else, in the meantime
+            return False
+        # A new blob is moved into place (a rename, or a server-side copy)
+        path = Blob.objects.acquire(sha256, file.size, lambda path: storage.move(source, path))
+        File.objects.filter(pk=file_id).update(file=path, sha256=sha256)
+    # A duplicate's bytes are no longer needed
+    storage.delete(source)
+    return True
+
+class DedupeQueue:
+    """Runs dedupe_file one file at a time on a per-process thread"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pid = None
+
+    def submit(self, file_id):
+        with self.lock:
+            # Created in each (forked) worker on first use
+            if self.executor is None or self.pid != os.getpid():
+                self.executor = ThreadPoolExecutor(1, thread_name_prefix='dedupe')
+                self.pid = os.getpid()
+            return self.executor.submit(self.run, file_id)
+
+    def run(self, file_id):
+        close_old_connections()
+        try:
+            dedupe_file(file_id)
+        except Exception:
+            logger.exception("Failed to deduplicate file %s", file_id)
+        finally:
+            close_old_connections()
+
+dedupe_queue = DedupeQueue()
@@ -0,0 +1,173 @@
+import base64
+import mimetypes
+import secrets
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+from .storage import get_storage
+
+# Headers the browser client needs to read from download responses
+EXPOSED_HEADERS = 'x-encryption-key, Content-Range, Accept-Ranges, ETag, Last-Modified'
+
+def get_content_type(file):
+    content_type, _ = mimetypes.guess_type(file.filename)
+    return content_type or 'application/octet-stream'
+
+def get_encryption_key_header(file):
+    try:
+        # Try to decode the key to check if it's valid base64
+        base64.b64decode(file.encryption_key)
+        # If it's valid base64, use it as is
+        return file.encryption_key
+    except Exception:
+        # If it's not valid base64, encode it
+        return base64.b64encode(file.encryption_key.encode()).decode()
+
+def get_etag(file):
+    """Strong validator that changes whenever the stored bytes can have changed"""
+    return f'"{file.id.hex}-{file.size:x}-{int(file.updated_at.timestamp() * 1000000):x}"'
+
+def parse_range_header(header, size):
+    """
+    Parse a bytes Range header into a list of inclusive (start, end) pairs.
+    Returns None when the header should be ignored and [] when no range
+    can be satisfied.
+    """
+    units, _, spec = header.partition('=')
+    if units.strip().lower() != 'bytes' or not spec:
+        return None
+
+    ranges = []
+    for part in spec.split(','):
+        start, sep, end = part.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if start:
+                start = int(start)
+                if end and int(end) < start:
+                    return None
+                end = int(end) if end else size - 1
+            elif end:
+                # Suffix range: the last N bytes
+                start = max(size - int(end), 0)
+                end = size - 1
+            else:
+                return None
+        except ValueError:
+            return None
+        if start >= size or end < start:
+            continue
+        ranges.append((start, min(end, size - 1)))
+
+    if len(ranges) > settings.MAX_DOWNLOAD_RANGES:
+        return None
+    return ranges
+
+def if_range_matches(request, etag, last_modified):
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        # Only a strong, exact ETag match allows a partial response
+        return if_range == etag
+    # A date validator matches only if it is exactly the Last-Modified date
+    date = parse_http_date_safe(if_range)
+    return date is not None and int(last_modified) == date
+
+def read_multipart_ranges(storage, name, ranges, boundary, content_type, size):
+    for start, end in ranges:
+        yield (
+            f'\r\n--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        ).encode()
+        yield from storage.read(name, start, end)
+    yield f'\r\n--{boundary}--\r\n'.encode()
+
+async def aread_multipart_ranges(storage, name, ranges, boundary, content_type, size):
+    for start, end in ranges:
+        yield (
+            f'\r\n--{boundary}\r\n'
+            f'Content-Type: {content_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n'
+        ).encode()
+        async for chunk in storage.aread(name, start, end):
+            yield chunk
+    yield f'\r\n--{boundary}--\r\n'.encode()
+
+def build_offload_response(file, content_type):
+    """
+    Hand the body off to the reverse proxy: the view has already done the
+    authorization, the proxy streams the bytes (and handles Range itself).
+    """
+    backend = settings.FILE_DELIVERY_BACKEND
+    response = HttpResponse(content_type=content_type)
+    if backend == 'nginx':
+        location = settings.FILE_DELIVERY_INTERNAL_URL.rstrip('/')
+        response['X-Accel-Redirect'] = f"{location}/{quote(file.file.name)}"
+    elif backend == 'sendfile':
+        response['X-Sendfile'] = get_storage().path(file.file.name)
+    else:
+        raise ImproperlyConfigured(f"Unknown FILE_DELIVERY_BACKEND '{backend}'")
+    return response
+
+def build_file_response(request, file, asynchronous=False):
+    """
+    Build the download response for a stored file, honouring conditional
+    (If-None-Match, If-Modified-Since) and Range/If-Range request headers.
+    With asynchronous=True the body is an async iterator, for ASGI views.
+    """
+    size = file.size
+    etag = get_etag(file)
+    last_modified = file.updated_at.timestamp()
+    content_type = get_content_type(file)
+
+    response = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if response is None and settings.FILE_DELIVERY_BACKEND != 'python':
+        response = build_offload_response(file, content_type)
+        response['Content-Disposition'] = content_disposition_header(True, file.filename)
+        response['x-encryption-key'] = get_encryption_key_header(file)
+    elif response is None:
+        storage = get_storage()
+        name = file.file.name
+        read = storage.aread if asynchronous else storage.read
+        read_multipart = aread_multipart_ranges if asynchronous else read_multipart_ranges
+        ranges = None
+        range_header = request.META.get('HTTP_RANGE')
+        if range_header and request.method in ('GET', 'HEAD') and if_range_matches(request, etag, last_modified):
+            ranges = parse_range_header(range_header, size)
+
+        if ranges is None:
+            response = StreamingHttpResponse(read(name, 0, size - 1), content_type=content_type)
+            response['Content-Length'] = str(size)
+        elif not ranges:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            response = StreamingHttpResponse(read(name, start, end), status=206, content_type=content_type)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+            response['Content-Length'] = str(end - start + 1)
+        else:
+            boundary = secrets.token_hex(16)
+            response = StreamingHttpResponse(
+                read_multipart(storage, name, ranges, boundary, content_type, size),
+                status=206,
+                content_type=f'multipart/byteranges; boundary={boundary}'
+            )
+        if ranges != []:
+            response['Content-Disposition'] = content_disposition_header(True, file.filename)
+            response['x-encryption-key'] = get_encryption_key_header(file)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    # Ensure CORS headers are set
+    response['Access-Control-Expose-Headers'] = EXPOSED_HEADERS
+    return response
@@ -0,0 +1,200 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .metrics import metrics
+from .models import File, ShareableLink
+from .token_index import share_token_index
+
+# Everything shared_file and download_shared_file need to answer a request.
+# Cached copies have encryption_key=None: the cache may be shared (Redis), so
+# the key is loaded from the database when a download is served.
+ShareRecord = namedtuple('ShareRecord', [
+    'token', 'file_id', 'path', 'filename', 'mime_type', 'size', 'encryption_key',
+    'uploaded_at', 'updated_at', 'owner_email', 'guest_id', 'permissions', 'expires_at',
+])
+
+def build_record(share_link):
+    file = share_link.file
+    return ShareRecord(
+        token=share_link.token,
+        file_id=file.id,
+        path=file.file.name,
+        filename=file.filename,
+        mime_type=file.mime_type,
+        size=file.size,
+        encryption_key=file.encryption_key,
+        uploaded_at=file.uploaded_at,
+        updated_at=file.updated_at,
+        owner_email=file.owner.email,
+        guest_id=share_link.guest_user_id,
+        permissions=share_link.permissions,
+        expires_at=share_link.expires_at,
+    )
+
+def record_to_file(record):
+    """Unsaved File carrying just enough to build a download response"""
+    file = File(
+        id=record.file_id,
+        filename=record.filename,
+        mime_type=record.mime_type,
+        size=record.size,
+        encryption_key=record.encryption_key,
+        uploaded_at=record.uploaded_at,
+        updated_at=record.updated_at,
+    )
+    file.file.name = record.path
+    return file
+
+def cacheable(record):
+    return record._replace(encryption_key=None)
+
+def load_encryption_keys(files):
+    """
+    Fill in the keys of files built from cached records, in one query.
+    Returns False if one of the files no longer exists.
+    """
+    missing = {file.id: file for file in files if file.encryption_key is None}
+    if not missing:
+        return True
+    keys = dict(File.objects.filter(pk__in=list(missing)).values_list('id', 'encryption_key'))
+    for file_id, file in missing.items():
+        if file_id not in keys:
+            return False
+        file.encryption_key = keys[file_id]
+    return True
+
+class LRUTokenCache:
+    """Per-process LRU; invalidations are only seen by the process that made them"""
+
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, token):
+        with self.lock:
+            entry = self.entries.get(token)
+            if entry is None:
+                return None
+            record, deadline = entry
+            if deadline <= time.monotonic():
+                del self.entries[token]
+                return None
+            self.entries.move_to_end(token)
+            return record
+
+    def set(self, token, record, timeout):
+        with self.lock:
+            self.entries[token] = (record, time.monotonic() + timeout)
+            self.entries.move_to_end(token)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete_many(self, tokens):
+        with self.lock:
+            for token in tokens:
+                self.entries.pop(token, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class DjangoTokenCache:
+    """Shared between processes through a Django cache (e.g. Redis)"""
+
+    def __init__(self, alias='default', key_prefix='share-link:'):
+        self.alias = alias
+        self.key_prefix = key_prefix
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, token):
+        return self.cache.get(self.key_prefix + token)
+
+    def set(self, token, record, timeout):
+        self.cache.set(self.key_prefix + token, record, timeout)
+
+    def delete_many(self, tokens):
+        self.cache.delete_many([self.key_prefix + token for token in tokens])
+
+    def clear(self):
+        self.cache.clear()
+
+@lru_cache(maxsize=None)
+def get_link_cache():
+    config = settings.SHARE_LINK_CACHE
+    return import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+
+def resolve_share_token(token):
+    """
+    Return the ShareRecord for a token, from cache when possible.
+    Raises ShareableLink.DoesNotExist for unknown tokens.
+    """
+    timeout = settings.SHARE_LINK_CACHE['TIMEOUT']
+    if timeout:
+        record = get_link_cache().get(token)
+        metrics.inc('share_link_cache_requests_total', (('result', 'miss' if record is None else 'hit'),))
+        if record is not None:
+            return record
+
+    # Tokens that never existed are refused without a query
+    if not share_token_index.may_contain(token):
+        metrics.inc('share_tokens_rejected_total', (('reason', 'unknown'),))
+        raise ShareableLink.DoesNotExist
+
+    # Get share link with related file and owner data in a single query
+    share_link = ShareableLink.objects.select_related(
+        'file',
+        'file__owner'
+    ).get(token=token)
+    record = build_record(share_link)
+
+    # Never keep a link cached past its expiry
+    timeout = min(timeout, (record.expires_at - timezone.now()).total_seconds())
+    if timeout > 0:
+        get_link_cache().set(token, cacheable(record), timeout)
+    return record
+
+def resolve_share_tokens(tokens):
+    """
+    ShareRecords of many tokens as {token: record}, the cache misses fetched
+    in one query. Unknown tokens are left out.
+    """
+    timeout = settings.SHARE_LINK_CACHE['TIMEOUT']
+    records, missing = {}, []
+    for token in tokens:
+        record = get_link_cache().get(token) if timeout else None
+        if timeout:
+            metrics.inc('share_link_cache_requests_total', (('result', 'miss' if record is None else 'hit'),))
+        if record is None:
+            missing.append(token)
+        else:
+            records[token] = record
+
+    unknown = [token for token in missing if not share_token_index.may_contain(token)]
+    if unknown:
+        metrics.inc('share_tokens_rejected_total', (('reason', 'unknown'),), len(unknown))
+        missing = [token for token in missing if token not in unknown]
+    if missing:
+        share_links = ShareableLink.objects.select_related('file', 'file__owner').filter(token__in=missing)
+        now = timezone.now()
+        for share_link in share_links:
+            record = records[share_link.token] = build_record(share_link)
+            record_timeout = min(timeout, (record.expires_at - now).total_seconds())
+            if record_timeout > 0:
+                get_link_cache().set(record.token, cacheable(record), record_timeout)
+    return records
+
+def invalidate_tokens(tokens):
+    tokens = list(tokens)
+    if tokens:
+        get_link_cache().delete_many(tokens)
@@ -0,0 +1,11 @@
+"""Helpers shared by the bench_* commands"""
+from contextlib import contextmanager
+
+from django.db import transaction
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction that is rolled back, so seed rows never stay"""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
@@ -0,0 +1,98 @@
+import json
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from files.management.commands._bench import rolled_back
+from files.models import File, OwnerShareStats, ShareableLink
+from files.query_budget import QueryBudget
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark sharing files with guests through one POST /api/files/share/bulk/ "
+        "against one POST /api/files/<id>/share/ per link, in-process. Seed rows "
+        "are created in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--files', type=int, default=100)
+        parser.add_argument('--guests', type=int, default=100,
+                            help="Links created = files x guests")
+        parser.add_argument('--single-sample', type=int, default=200,
+                            help="Per-link requests timed; their mean is scaled up to all links")
+
+    def handle(self, *args, **options):
+        if min(options['files'], options['guests']) < 1:
+            raise CommandError("--files and --guests must each be at least 1")
+        with override_settings(ALLOWED_HOSTS=['testserver']), rolled_back():
+            result = self.bench(options['files'], options['guests'], options['single_sample'])
+        self.stdout.write(json.dumps(result, indent=2))
+
+    def seed(self, files, guests):
+        User = get_user_model()
+        run_id = uuid.uuid4().hex
+        owner = User.objects.create_user(email=f'bench-{run_id}@example.com', password=None)
+        guest_users = User.objects.bulk_create(
+            User(email=f'bench-{run_id}-guest-{i}@example.com', role='guest', password='!')
+            for i in range(guests)
+        )
+        file_rows = File.objects.bulk_create(
+            File(
+                filename=f'file-{i}.txt',
+                file=f'encrypted_files/{owner.id}/{uuid.uuid4()}.txt',
+                encryption_key='key',
+                size=i,
+                mime_type='text/plain',
+                owner=owner,
+            )
+            for i in range(files)
+        )
+        if not connection.features.can_return_rows_from_bulk_insert:
+            guest_users = list(User.objects.filter(email__startswith=f'bench-{run_id}-guest-'))
+        return owner, [file.id for file in file_rows], [guest.id for guest in guest_users]
+
+    def bench(self, files, guests, sample):
+        owner, file_ids, guest_ids = self.seed(files, guests)
+        links = files * guests
+        client = Client(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(owner).access_token}')
+        body = {'fileIds': [str(pk) for pk in file_ids], 'guestUserIds': guest_ids,
+                'permissions': 'download', 'expiresIn': 1}
+
+        started = time.perf_counter()
+        with QueryBudget() as bulk_queries:
+            response = client.post('/api/files/share/bulk/', body, content_type='application/json')
+        bulk_time = time.perf_counter() - started
+        if response.status_code != 201 or response.json()['created'] != links:
+            raise CommandError(f"Bulk share failed: {response.status_code} {response.content[:500]!r}")
+        stored = ShareableLink.objects.filter(file_id__in=file_ids).count()
+        rollup = OwnerShareStats.objects.get(owner=owner).link_count
+        if stored != links or rollup != links:
+            raise CommandError(f"Expected {links} links, found {stored} rows and a rollup of {rollup}")
+
+        sample = min(sample, links)
+        started = time.perf_counter()
+        with QueryBudget() as single_queries:
+            for i in range(sample):
+                response = client.post(f'/api/files/{file_ids[i % files]}/share/', {
+                    'permissions': 'download', 'expiresIn': 1, 'guestUserId': guest_ids[i // files % guests],
+                }, content_type='application/json')
+                if response.status_code != 201:
+                    raise CommandError(f"Single share failed: {response.status_code}")
+        single_time = (time.perf_counter() - started) / sample * links if sample else None
+
+        return {
+            'links': links,
+            'bulk_seconds': round(bulk_time, 4),
+            'bulk_queries': len(bulk_queries),
+            'bulk_us_per_link': round(bulk_time / links * 1e6, 2),
+            'single_seconds_estimated': single_time and round(single_time, 4),
+            'single_queries_estimated': sample and round(len(single_queries) / sample * links),
+            'single_us_per_link': single_time and round(single_time / links * 1e6, 2),
+            'speedup': single_time and round(single_time / bulk_time, 2),
+        }
@@ -0,0 +1,85 @@
+import json
+import time
+import uuid
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+
+from files.encoders import RowEncoder
+from files.management.commands._bench import rolled_back
+from files.models import File
+from files.serializers import FileSerializer
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark rendering a file list through FileSerializer against the "
+        "values() + RowEncoder fast path, and check both produce identical "
+        "JSON. Seed rows are created in a transaction that is rolled back."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+        parser.add_argument('--repeat', type=int, default=3,
+                            help="Best of this many runs is reported")
+
+    def handle(self, *args, **options):
+        results = []
+        for rows in options['rows']:
+            with rolled_back():
+                results.append(self.bench(rows, options['repeat']))
+        self.stdout.write(json.dumps(results, indent=2))
+
+    def seed(self, rows):
+        owner = get_user_model().objects.create_user(
+            email=f'bench-{uuid.uuid4().hex}@example.com', password=None
+        )
+        File.objects.bulk_create(
+            (
+                File(
+                    filename=f'file-{i}.txt',
+                    file=f'encrypted_files/{owner.id}/{uuid.uuid4()}.txt',
+                    encryption_key='key',
+                    size=i,
+                    mime_type='text/plain',
+                    owner=owner,
+                )
+                for i in range(rows)
+            ),
+            batch_size=2000,
+        )
+        return owner
+
+    def timed(self, repeat, func):
+        best, output = None, None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            output = func()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, output
+
+    def bench(self, rows, repeat):
+        owner = self.seed(rows)
+        queryset = File.objects.filter(owner=owner).order_by('-uploaded_at', '-id')
+        renderer = JSONRenderer()
+        encoder = RowEncoder(FileSerializer)
+
+        serializer_time, serializer_json = self.timed(
+            repeat, lambda: renderer.render(FileSerializer(queryset.all(), many=True).data)
+        )
+        fast_time, fast_json = self.timed(
+            repeat, lambda: renderer.render(encoder.encode_many(queryset.values(*encoder.columns)))
+        )
+        if serializer_json != fast_json:
+            raise CommandError(f"Fast path output differs from FileSerializer at {rows} rows")
+
+        return {
+            'rows': rows,
+            'serializer_seconds': round(serializer_time, 4),
+            'fast_path_seconds': round(fast_time, 4),
+            'serializer_us_per_row': round(serializer_time / rows * 1e6, 2),
+            'fast_path_us_per_row': round(fast_time / rows * 1e6, 2),
+            'speedup': round(serializer_time / fast_time, 2),
+            'identical_json': True,
+        }
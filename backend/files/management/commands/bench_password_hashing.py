@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+import statistics
+import threading
+import time
+
+from django.contrib.auth import hashers
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from users.hashers import PooledBCryptSHA256PasswordHasher, hashing_pool
+
+PASSWORD = 'Bench-password-1'
+PROBE_BLOCK = os.urandom(1024 * 1024)
+
+def reset_pool():
+    # The next hash starts a pool with the settings then in effect
+    if hashing_pool.executor is not None:
+        hashing_pool.executor.shutdown()
+        hashing_pool.executor = None
+
+class Command(BaseCommand):
+    help = (
+        "Time each password hasher configuration, then run a burst of "
+        "concurrent logins beside a download-like CPU probe, hashing on the "
+        "request threads and then on the bounded hashing pool, and report "
+        "how much the burst slows the probe."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', type=int, default=5, help="Hashes timed per configuration")
+        parser.add_argument('--logins', type=int, default=16, help="Concurrent login threads in the burst")
+        parser.add_argument('--duration', type=float, default=5.0, help="Seconds each burst runs")
+
+    def handle(self, *args, **options):
+        result = {
+            'cpus': os.cpu_count(),
+            'hashers': self.bench_hashers(options['samples']),
+            'burst': self.bench_burst(options['logins'], options['duration']),
+        }
+        self.stdout.write(json.dumps(result, indent=2))
+
+    def time_hasher(self, hasher, samples):
+        encoded = hasher.encode(PASSWORD, hasher.salt())
+        started = time.perf_counter()
+        for _ in range(samples):
+            hasher.verify(PASSWORD, encoded)
+        return round((time.perf_counter() - started) / samples, 4)
+
+    def bench_hashers(self, samples):
+        results = {}
+        for rounds in (10, 11, 12, 13):
+            hasher = type('BCrypt', (hashers.BCryptSHA256PasswordHasher,), {'rounds': rounds})()
+            results[f'bcrypt_sha256 rounds={rounds}'] = self.time_hasher(hasher, samples)
+        pbkdf2 = hashers.PBKDF2PasswordHasher()
+        results[f'pbkdf2_sha256 iterations={pbkdf2.iterations}'] = self.time_hasher(pbkdf2, samples)
+        argon2 = hashers.Argon2PasswordHasher()
+        try:
+            results[
+                f'argon2id t={argon2.time_cost} m={argon2.memory_cost}KiB p={argon2.parallelism}'
+            ] = self.time_hasher(argon2, samples)
+        except ValueError:
+            results['argon2id'] = "argon2-cffi is not installed"
+        return results
+
+    def probe(self, stop, latencies):
+        """Stand-in for download traffic: checksum 1 MB blocks, timing each"""
+        while not stop.is_set():
+            started = time.perf_counter()
+            for _ in range(8):
+                hashlib.sha256(PROBE_BLOCK).digest()
+            latencies.append(time.perf_counter() - started)
+
+    def run_burst(self, logins, duration, pooled):
+        hasher = PooledBCryptSHA256PasswordHasher()
+        config = {'EXECUTOR': 'thread', 'WORKERS': 1 if pooled else 0, 'MAX_PENDING': logins,
+                  'QUEUE_TIMEOUT': 3600, 'RETRY_AFTER': 5, 'NICE': 10 if pooled else 0}
+        with override_settings(PASSWORD_HASHING=config):
+            encoded = hasher.encode(PASSWORD, hasher.salt())
+
+            stop = threading.Event()
+            latencies, verified = [], []
+            threads = [threading.Thread(target=self.probe, args=(stop, latencies))]
+            if logins:
+                def login():
+                    while not stop.is_set():
+                        hasher.verify(PASSWORD, encoded)
+                        verified.append(1)
+                threads += [threading.Thread(target=login) for _ in range(logins)]
+            for thread in threads:
+                thread.start()
+            time.sleep(duration)
+            stop.set()
+            for thread in threads:
+                thread.join()
+            reset_pool()
+
+        latencies.sort()
+        return {
+            'probe_p50_ms': round(statistics.median(latencies) * 1000, 1),
+            'probe_p99_ms': round(latencies[int(len(latencies) * 0.99)] * 1000, 1),
+            'probe_ops_per_second': round(len(latencies) / duration, 1),
+            'logins_per_second': round(len(verified) / duration, 2),
+        }
+
+    def bench_burst(self, logins, duration):
+        reset_pool()
+        return {
+            'idle': self.run_burst(0, duration, pooled=False),
+            'request_threads': self.run_burst(logins, duration, pooled=False),
+            'hashing_pool': self.run_burst(logins, duration, pooled=True),
+        }
@@ -0,0 +1,119 @@
+import json
+import secrets
+import time
+import uuid
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from files.management.commands._bench import rolled_back
+from files.models import File, ShareableLink
+from files.token_index import BloomFilter, ShareTokenIndex
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the share token Bloom filter: build time, memory and false "
+        "positive rate for --tokens random tokens, and a rebuild from "
+        "--db-rows seeded links (rolled back) against looking unknown tokens "
+        "up in the database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tokens', type=int, default=10_000_000)
+        parser.add_argument('--error-rate', type=float, default=0.01)
+        parser.add_argument('--probes', type=int, default=100_000,
+                            help="Unknown tokens checked to measure the false positive rate")
+        parser.add_argument('--db-rows', type=int, default=100_000)
+
+    def handle(self, *args, **options):
+        result = {'filter': self.bench_filter(options['tokens'], options['error_rate'], options['probes'])}
+        if options['db_rows']:
+            with rolled_back():
+                result['database'] = self.bench_database(options['db_rows'], options['error_rate'])
+        self.stdout.write(json.dumps(result, indent=2))
+
+    def bench_filter(self, count, error_rate, probes):
+        bloom = BloomFilter(count, error_rate)
+        # Token strings are made outside the timing; only adds are measured
+        build_time = 0.0
+        sample = []
+        for start in range(0, count, 100_000):
+            tokens = [secrets.token_urlsafe(32) for _ in range(min(100_000, count - start))]
+            sample.append(tokens[0])
+            started = time.perf_counter()
+            for token in tokens:
+                bloom.add(token)
+            build_time += time.perf_counter() - started
+
+        if not all(token in bloom for token in sample):
+            raise CommandError("False negative: an added token is not in the filter")
+        unknown = [secrets.token_urlsafe(32) for _ in range(probes)]
+        started = time.perf_counter()
+        false_positives = sum(token in bloom for token in unknown)
+        probe_time = time.perf_counter() - started
+
+        return {
+            'tokens': count,
+            'bits': bloom.size,
+            'hashes': bloom.hashes,
+            'memory_mb': round(len(bloom.bits) / 2 ** 20, 2),
+            'bits_per_token': round(bloom.size / count, 2),
+            'build_seconds': round(build_time, 2),
+            'build_us_per_token': round(build_time / count * 1e6, 2),
+            'target_error_rate': error_rate,
+            'false_positive_rate': round(false_positives / probes, 5) if probes else None,
+            'lookup_us': round(probe_time / probes * 1e6, 2) if probes else None,
+        }
+
+    def seed(self, rows):
+        owner = get_user_model().objects.create_user(
+            email=f'bench-{uuid.uuid4().hex}@example.com', password=None
+        )
+        file = File.objects.create(
+            filename='bench.txt', file=f'encrypted_files/{owner.id}/{uuid.uuid4()}.txt',
+            encryption_key='key', size=0, mime_type='text/plain', owner=owner,
+        )
+        expires_at = timezone.now() + timedelta(days=1)
+        ShareableLink.objects.bulk_create(
+            (
+                ShareableLink(
+                    token=secrets.token_urlsafe(32), file=file, permissions='download',
+                    expires_at=expires_at, created_by=owner,
+                )
+                for _ in range(rows)
+            ),
+            batch_size=5000,
+        )
+
+    def bench_database(self, rows, error_rate):
+        self.seed(rows)
+        total = ShareableLink.objects.count()
+        config = {'ENABLED': True, 'ERROR_RATE': error_rate, 'SYNC_INTERVAL': 3600,
+                  'REBUILD_INTERVAL': 3600, 'CACHE_ALIAS': ''}
+        with override_settings(SHARE_TOKEN_INDEX=config):
+            index = ShareTokenIndex()
+            started = time.perf_counter()
+            index.rebuild()
+            rebuild_time = time.perf_counter() - started
+
+            unknown = [secrets.token_urlsafe(32) for _ in range(1000)]
+            started = time.perf_counter()
+            rejected = sum(not index.may_contain(token) for token in unknown)
+            index_time = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for token in unknown:
+            ShareableLink.objects.select_related('file', 'file__owner').filter(token=token).first()
+        query_time = time.perf_counter() - started
+
+        return {
+            'links': total,
+            'rebuild_seconds': round(rebuild_time, 3),
+            'rebuild_us_per_link': round(rebuild_time / total * 1e6, 2),
+            'unknown_tokens_rejected': f'{rejected}/{len(unknown)}',
+            'index_us_per_unknown_token': round(index_time / len(unknown) * 1e6, 2),
+            'query_us_per_unknown_token': round(query_time / len(unknown) * 1e6, 2),
+        }
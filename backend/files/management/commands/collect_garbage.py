@@ -0,0 +1,241 @@
+import json
+import os
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from files.models import Blob, File, ShareableLink, UploadSession, get_blob_path
+from files.rollups import links_deleted
+from files.storage import get_storage
+
+PHASES = ['links', 'uploads', 'files', 'blobs', 'blob_refs']
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired share links and upload sessions, and reconcile stored "
+        "blobs against the database. Work is done in small batches and "
+        "checkpointed, so the command can be stopped and resumed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--phase', action='append', choices=PHASES,
+                            help="Only run these phases (default: all)")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Report what would be deleted without deleting it")
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--sleep', type=float, default=0.0,
+                            help="Seconds to pause between batches")
+        parser.add_argument('--max-rate', type=float, default=0.0,
+                            help="Maximum rows/objects examined per second (0 = unlimited)")
+        parser.add_argument('--time-limit', type=float, default=0.0,
+                            help="Stop (and checkpoint) after this many seconds")
+        parser.add_argument('--grace-hours', type=float, default=24.0,
+                            help="Leave unreferenced blobs younger than this alone")
+        parser.add_argument('--state-file', default=settings.GC_STATE_FILE,
+                            help="Where the resume checkpoint is kept")
+        parser.add_argument('--reset', action='store_true',
+                            help="Ignore the saved checkpoint and start over")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.dry_run = options['dry_run']
+        self.started = time.monotonic()
+        self.storage = get_storage()
+        self.state = {} if options['reset'] else self.load_state()
+        self.metrics = {}
+
+        for phase in options['phase'] or PHASES:
+            if self.out_of_time():
+                break
+            getattr(self, f'collect_{phase}')()
+
+        self.save_state()
+        self.stdout.write(json.dumps({
+            'dry_run': self.dry_run,
+            'elapsed': round(time.monotonic() - self.started, 3),
+            'completed': not self.out_of_time(),
+            'metrics': self.metrics,
+        }))
+
+    # Checkpointing and pacing
+
+    def load_state(self):
+        try:
+            with open(self.options['state_file']) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save_state(self):
+        if self.dry_run:
+            return
+        os.makedirs(os.path.dirname(self.options['state_file']), exist_ok=True)
+        with open(self.options['state_file'], 'w') as f:
+            json.dump(self.state, f)
+
+    def out_of_time(self):
+        limit = self.options['time_limit']
+        return bool(limit) and time.monotonic() - self.started >= limit
+
+    def count(self, phase, key, n=1):
+        metrics = self.metrics.setdefault(phase, {})
+        metrics[key] = metrics.get(key, 0) + n
+
+    def pace(self, phase, examined, batch_started):
+        """Report progress and wait so the batch respects --sleep/--max-rate"""
+        self.count(phase, 'batches')
+        if self.options['verbosity'] > 1:
+            self.stdout.write(f"{phase}: {json.dumps(self.metrics[phase])}")
+        delay = self.options['sleep']
+        if self.options['max_rate']:
+            delay = max(delay, examined / self.options['max_rate'] - (time.monotonic() - batch_started))
+        if delay > 0:
+            time.sleep(delay)
+
+    def batches(self, iterable):
+        batch = []
+        for item in iterable:
+            batch.append(item)
+            if len(batch) >= self.options['batch_size']:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    # Phases
+
+    def collect_links(self):
+        """Expired links, oldest first, each batch a short delete on the expires_at index"""
+        now = timezone.now()
+        while not self.out_of_time():
+            batch_started = time.monotonic()
+            links = list(
+                ShareableLink.objects.filter(expires_at__lt=now)
+                .order_by('expires_at')
+                .values_list('token', 'file_id', 'file__owner_id', 'access_count')[:self.options['batch_size']]
+            )
+            if not links:
+                break
+            if self.dry_run:
+                self.count('links', 'expired', ShareableLink.objects.filter(expires_at__lt=now).count())
+                break
+            tokens = [token for token, _, _, _ in links]
+            self.count('links', 'expired', len(tokens))
+            with transaction.atomic():
+                ShareableLink.objects.filter(token__in=tokens).delete()
+                links_deleted(link[1:] for link in links)
+            self.count('links', 'deleted', len(tokens))
+            self.pace('links', len(tokens), batch_started)
+
+    def collect_uploads(self):
+        """Abandoned chunked uploads and their partially written bytes"""
+        now = timezone.now()
+        while not self.out_of_time():
+            batch_started = time.monotonic()
+            sessions = list(
+                UploadSession.objects.filter(expires_at__lt=now)
+                .order_by('expires_at')[:self.options['batch_size']]
+            )
+            if not sessions:
+                break
+            if self.dry_run:
+                self.count('uploads', 'expired', UploadSession.objects.filter(expires_at__lt=now).count())
+                break
+            self.count('uploads', 'expired', len(sessions))
+            for session in sessions:
+                session.delete()
+            self.count('uploads', 'deleted', len(sessions))
+            self.pace('uploads', len(sessions), batch_started)
+
+    def walk(self, phase, prefix):
+        """Walk storage under prefix from the checkpoint, yielding batches of old objects"""
+        cutoff = timezone.now() - timedelta(hours=self.options['grace_hours'])
+        listing = self.storage.list(prefix, start_after=self.state.get(phase))
+        for batch in self.batches(listing):
+            if self.out_of_time():
+                return
+            batch_started = time.monotonic()
+            self.count(phase, 'examined', len(batch))
+            yield [item for item in batch if item[2] < cutoff]
+            if not self.dry_run:
+                self.state[phase] = batch[-1][0]
+            self.pace(phase, len(batch), batch_started)
+        # Finished a full pass: the next run starts from the beginning
+        self.state.pop(phase, None)
+
+    def delete_orphans(self, phase, orphans):
+        for name, size, _ in orphans:
+            self.count(phase, 'orphaned')
+            self.count(phase, 'orphaned_bytes', size)
+            if not self.dry_run:
+                self.storage.delete(name)
+                self.count(phase, 'deleted')
+
+    def collect_files(self):
+        """Stored files no File row or upload session points at"""
+        for batch in self.walk('files', 'encrypted_files'):
+            names = [name for name, _, _ in batch]
+            referenced = set(File.objects.filter(file__in=names).values_list('file', flat=True))
+            referenced.update(UploadSession.objects.filter(path__in=names).values_list('path', flat=True))
+            self.delete_orphans('files', [item for item in batch if item[0] not in referenced])
+
+    def collect_blobs(self):
+        """Content-addressed blobs without a Blob row"""
+        for batch in self.walk('blobs', 'blobs'):
+            by_hash = {os.path.basename(name): name for name, _, _ in batch}
+            known = set(Blob.objects.filter(sha256__in=list(by_hash)).values_list('sha256', flat=True))
+            self.delete_orphans('blobs', [item for item in batch if os.path.basename(item[0]) not in known])
+
+    def collect_blob_refs(self):
+        """
+        Recount Blob references; Files removed without File.delete (cascades,
+        queryset deletes) never released theirs.
+        """
+        cursor = self.state.get('blob_refs', '')
+        while not self.out_of_time():
+            batch_started = time.monotonic()
+            blobs = list(
+                Blob.objects.filter(sha256__gt=cursor)
+                .order_by('sha256')
+                .values_list('sha256', 'ref_count')[:self.options['batch_size']]
+            )
+            if not blobs:
+                self.state.pop('blob_refs', None)
+                break
+            self.count('blob_refs', 'examined', len(blobs))
+            actual = dict(
+                File.objects.filter(sha256__in=[sha256 for sha256, _ in blobs])
+                .values('sha256')
+                .annotate(refs=Count('id'))
+                .values_list('sha256', 'refs')
+            )
+            for sha256, ref_count in blobs:
+                refs = actual.get(sha256, 0)
+                if refs != ref_count:
+                    self.fix_blob_refs(sha256, ref_count, refs)
+            cursor = blobs[-1][0]
+            if not self.dry_run:
+                self.state['blob_refs'] = cursor
+            self.pace('blob_refs', len(blobs), batch_started)
+
+    def fix_blob_refs(self, sha256, ref_count, refs):
+        self.count('blob_refs', 'mismatched')
+        if self.dry_run:
+            return
+        with transaction.atomic():
+            # Skip blobs whose count moved since it was read: an upload is in flight
+            blob = Blob.objects.select_for_update().filter(sha256=sha256, ref_count=ref_count).first()
+            if blob is None:
+                return
+            if refs:
+                Blob.objects.filter(sha256=sha256).update(ref_count=refs)
+                self.count('blob_refs', 'corrected')
+            else:
+                blob.delete()
+                self.storage.delete(get_blob_path(sha256))
+                self.count('blob_refs', 'deleted')
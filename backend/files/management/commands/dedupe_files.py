@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from files.dedup import dedupe_file
+from files.models import File
+
+class Command(BaseCommand):
+    help = (
+        "Move files that are not blob-backed yet into the content-addressed "
+        "blob store: chunked uploads a server process did not get to, and "
+        "files stored before CONTENT_ADDRESSED_STORAGE was turned on."
+    )
+
+    def handle(self, *args, **options):
+        if not settings.CONTENT_ADDRESSED_STORAGE:
+            raise CommandError("CONTENT_ADDRESSED_STORAGE is off")
+        done = failed = 0
+        for file_id in File.objects.filter(sha256='').values_list('id', flat=True).iterator():
+            try:
+                done += dedupe_file(file_id)
+            except Exception as e:
+                failed += 1
+                self.stderr.write(f"{file_id}: {e}")
+        self.stdout.write(f"Moved {done} files into the blob store, {failed} failed")
@@ -0,0 +1,295 @@
+import http.client
+import json
+import os
+import random
+import secrets
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import timedelta
+from urllib.parse import urlencode, urlsplit
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from files.models import File, ShareableLink, get_upload_path
+from files.rollups import links_created
+from files.storage import get_storage
+
+SCENARIOS = ['login', 'list', 'upload', 'download', 'share', 'shared_file', 'shared_download']
+PASSWORD = 'Load-test-password-1'
+
+class HTTPClient:
+    """One keep-alive connection per load generator thread"""
+
+    def __init__(self, base_url, timeout):
+        parts = urlsplit(base_url)
+        connection_class = http.client.HTTPSConnection if parts.scheme == 'https' else http.client.HTTPConnection
+        self.connect = lambda: connection_class(parts.netloc, timeout=timeout)
+        self.prefix = parts.path.rstrip('/')
+        self.conn = self.connect()
+
+    def request(self, method, path, body=None, headers=None):
+        for attempt in range(2):
+            try:
+                self.conn.request(method, self.prefix + path, body=body, headers=headers or {})
+                response = self.conn.getresponse()
+                response.read()
+                return response.status
+            except (http.client.HTTPException, OSError):
+                # The server closed an idle keep-alive connection; retry once
+                self.conn.close()
+                self.conn = self.connect()
+                if attempt:
+                    raise
+
+def multipart_body(filename, content, fields):
+    boundary = uuid.uuid4().hex
+    parts = [
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        for name, value in fields.items()
+    ]
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        f'Content-Type: text/plain\r\n\r\n'.encode() + content + b'\r\n'
+    )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+def percentile(ordered, p):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    return ordered[max(0, min(len(ordered) - 1, round(p / 100 * len(ordered) + 0.5) - 1))]
+
+class Command(BaseCommand):
+    help = (
+        "Seed users, files and share links, drive the API of a running server "
+        "with concurrent requests, and report latency percentiles, throughput "
+        "and DB queries per request as JSON. Must use the same settings "
+        "(database and storage) as the server under test."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--users', type=int, default=10)
+        parser.add_argument('--files', type=int, default=200, help="Files, spread over the users")
+        parser.add_argument('--links', type=int, default=200, help="Share links, spread over the files")
+        parser.add_argument('--file-size', type=int, default=64 * 1024)
+        parser.add_argument('--scenario', action='append', choices=SCENARIOS,
+                            help="Only run these scenarios (default: all)")
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--requests', type=int, default=500, help="Requests per scenario")
+        parser.add_argument('--query-samples', type=int, default=5,
+                            help="In-process requests per scenario used to count DB queries")
+        parser.add_argument('--timeout', type=float, default=60.0)
+        parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+        parser.add_argument('--keep', action='store_true', help="Leave the seeded data in place")
+
+    def handle(self, *args, **options):
+        self.options = options
+        if min(options['users'], options['files'], options['links']) < 1:
+            raise CommandError("--users, --files and --links must each be at least 1")
+        self.run_id = uuid.uuid4().hex[:8]
+        self.payload = os.urandom(options['file_size'])
+        self.check_server()
+
+        seed_started = time.monotonic()
+        self.seed()
+        report = {
+            'base_url': options['base_url'],
+            'database': connection.vendor,
+            'seed': {
+                'users': len(self.users),
+                'files': len(self.files),
+                'links': len(self.tokens),
+                'file_size': options['file_size'],
+                'seconds': round(time.monotonic() - seed_started, 3),
+            },
+            'concurrency': options['concurrency'],
+            'scenarios': {},
+        }
+        try:
+            for scenario in options['scenario'] or SCENARIOS:
+                result = self.run_load(scenario)
+                result['db_queries_per_request'] = self.count_queries(scenario)
+                report['scenarios'][scenario] = result
+                self.stderr.write(
+                    f"{scenario}: {result['throughput']} req/s, p50 {result['latency_ms']['p50']} ms, "
+                    f"p99 {result['latency_ms']['p99']} ms, {result['errors']} errors"
+                )
+        finally:
+            if not options['keep']:
+                self.cleanup()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+        else:
+            self.stdout.write(output)
+
+    def check_server(self):
+        client = HTTPClient(self.options['base_url'], self.options['timeout'])
+        try:
+            client.request('GET', '/api/files/')
+        except OSError as e:
+            raise CommandError(f"No server at {self.options['base_url']}: {e}")
+
+    # Seed data
+
+    def seed(self):
+        User = get_user_model()
+        # Hash once: every seeded user shares the password
+        password = make_password(PASSWORD)
+        self.users = User.objects.bulk_create(
+            User(email=f'loadtest-{self.run_id}-{i}@example.com', password=password)
+            for i in range(self.options['users'])
+        )
+        if not connection.features.can_return_rows_from_bulk_insert:
+            self.users = list(User.objects.filter(email__startswith=f'loadtest-{self.run_id}-'))
+        self.access_tokens = {user.id: str(RefreshToken.for_user(user).access_token) for user in self.users}
+
+        storage = get_storage()
+        files = []
+        for i in range(self.options['files']):
+            owner = self.users[i % len(self.users)]
+            name = get_upload_path(owner, f'loadtest-{i}.txt')
+            storage.write(name, [self.payload])
+            files.append(File(
+                filename=f'loadtest-{i}.txt',
+                file=name,
+                encryption_key='bG9hZHRlc3Q=',
+                size=len(self.payload),
+                mime_type='text/plain',
+                owner=owner,
+            ))
+        self.files = File.objects.bulk_create(files)
+
+        expires_at = timezone.now() + timedelta(days=1)
+        links = [
+            ShareableLink(
+                token=secrets.token_urlsafe(32),
+                file=self.files[i % len(self.files)],
+                permissions='download',
+                expires_at=expires_at,
+                created_by=self.files[i % len(self.files)].owner,
+            )
+            for i in range(self.options['links'])
+        ]
+        ShareableLink.objects.bulk_create(links)
+        links_created((link.file.id, link.file.owner_id) for link in links)
+        self.tokens = [link.token for link in links]
+
+    def cleanup(self):
+        users = get_user_model().objects.filter(email__startswith=f'loadtest-{self.run_id}-')
+        # File.delete releases stored bytes; a cascading user delete would not
+        for file in File.objects.filter(owner__in=users).iterator():
+            file.delete()
+        users.delete()
+
+    # Requests
+
+    def build_request(self, scenario, rng):
+        """(method, path, body, headers) for one request of scenario"""
+        user = self.users[rng.randrange(len(self.users))]
+        headers = {'Authorization': f'Bearer {self.access_tokens[user.id]}'}
+        if scenario == 'login':
+            body = json.dumps({'email': user.email, 'password': PASSWORD})
+            return 'POST', '/api/users/login/', body, {'Content-Type': 'application/json'}
+        if scenario == 'list':
+            return 'GET', '/api/files/', None, headers
+        if scenario == 'upload':
+            body, content_type = multipart_body('upload.txt', self.payload, {'encryption_key': 'bG9hZHRlc3Q='})
+            return 'POST', '/api/files/', body, dict(headers, **{'Content-Type': content_type})
+        if scenario == 'download':
+            file = self.files[rng.randrange(len(self.files))]
+            headers = {'Authorization': f'Bearer {self.access_tokens[file.owner_id]}'}
+            return 'GET', f'/api/files/{file.id}/download/', None, headers
+        if scenario == 'share':
+            file = self.files[rng.randrange(len(self.files))]
+            headers = {'Authorization': f'Bearer {self.access_tokens[file.owner_id]}'}
+            body = json.dumps({'permissions': 'download', 'expiresIn': 1})
+            return 'POST', f'/api/files/{file.id}/share/', body, dict(headers, **{'Content-Type': 'application/json'})
+        query = urlencode({'token': self.tokens[rng.randrange(len(self.tokens))]})
+        if scenario == 'shared_file':
+            return 'GET', f'/api/files/shared-file/?{query}', None, headers
+        return 'GET', f'/api/files/shared-file/download/?{query}', None, headers
+
+    def run_load(self, scenario):
+        total = self.options['requests']
+        remaining = iter(range(total))
+        lock = threading.Lock()
+        latencies, statuses, failures = [], Counter(), Counter()
+
+        def worker(seed):
+            rng = random.Random(seed)
+            client = HTTPClient(self.options['base_url'], self.options['timeout'])
+            while True:
+                with lock:
+                    if next(remaining, None) is None:
+                        return
+                method, path, body, headers = self.build_request(scenario, rng)
+                started = time.perf_counter()
+                try:
+                    status = client.request(method, path, body, headers)
+                except OSError as e:
+                    with lock:
+                        failures[type(e).__name__] += 1
+                    continue
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[status] += 1
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(self.options['concurrency'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        latencies.sort()
+        to_ms = lambda seconds: None if seconds is None else round(seconds * 1000, 2)
+        return {
+            'requests': total,
+            'seconds': round(elapsed, 3),
+            'throughput': round(len(latencies) / elapsed, 2),
+            'latency_ms': {
+                'mean': to_ms(sum(latencies) / len(latencies)) if latencies else None,
+                'p50': to_ms(percentile(latencies, 50)),
+                'p95': to_ms(percentile(latencies, 95)),
+                'p99': to_ms(percentile(latencies, 99)),
+                'max': to_ms(latencies[-1] if latencies else None),
+            },
+            'status_codes': {str(status): count for status, count in sorted(statuses.items())},
+            'errors': sum(count for status, count in statuses.items() if status >= 400) + sum(failures.values()),
+            'connection_errors': dict(failures),
+        }
+
+    def count_queries(self, scenario):
+        """Mean DB queries of the scenario's requests, served in this process"""
+        samples = self.options['query_samples']
+        if not samples:
+            return None
+        client = Client(HTTP_HOST=urlsplit(self.options['base_url']).netloc)
+        rng = random.Random(0)
+        counts = []
+        for _ in range(samples):
+            method, path, body, headers = self.build_request(scenario, rng)
+            extra = {f"HTTP_{name.upper().replace('-', '_')}": value for name, value in headers.items()
+                     if name != 'Content-Type'}
+            with CaptureQueriesContext(connection) as queries:
+                response = client.generic(method, path, body or '', headers.get('Content-Type', ''), **extra)
+                if response.streaming:
+                    b''.join(response)
+            counts.append(len(queries))
+        return round(sum(counts) / len(counts), 2)
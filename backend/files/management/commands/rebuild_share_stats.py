@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from files.rollups import rebuild_share_stats
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the per-file and per-owner share-link rollups from the link "
+        "rows. Only needed after links or files were deleted without going "
+        "through the app (e.g. bulk deletes in the shell or admin)."
+    )
+
+    def handle(self, *args, **options):
+        files, owners = rebuild_share_stats()
+        self.stdout.write(f"Rebuilt share stats of {files} files and {owners} owners")
@@ -0,0 +1,78 @@
+import io
+import os
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.migrations.executor import MigrationExecutor
+
+from files.storage import get_storage
+
+class Command(BaseCommand):
+    help = (
+        "Check that this deployment can serve requests: system checks pass, "
+        "the database is reachable and migrated, and file storage and the "
+        "upload temp directory are writable, and used MFA codes are recorded "
+        "where every worker sees them. Run by gunicorn.conf.py before any "
+        "worker starts."
+    )
+
+    def handle(self, *args, **options):
+        failures = []
+        checks = ('system_checks', 'database', 'migrations', 'storage', 'upload_temp_dir', 'mfa_replay_cache')
+        for name in checks:
+            try:
+                warning = getattr(self, f'check_{name}')()
+            except Exception as e:
+                failures.append(name)
+                self.stdout.write(f"FAIL  {name}: {e}")
+            else:
+                self.stdout.write(f"warn  {name}: {warning}" if warning else f"ok    {name}")
+
+        if failures:
+            raise CommandError(f"Startup checks failed: {', '.join(failures)}")
+
+    def check_system_checks(self):
+        call_command('check', deploy=not settings.DEBUG, fail_level='ERROR', stdout=io.StringIO())
+
+    def check_database(self):
+        connections[DEFAULT_DB_ALIAS].ensure_connection()
+
+    def check_migrations(self):
+        connection = connections[DEFAULT_DB_ALIAS]
+        executor = MigrationExecutor(connection)
+        plan = executor.migration_plan(executor.loader.graph.leaf_nodes())
+        if plan:
+            raise Exception(f"{len(plan)} unapplied migrations, run `manage.py migrate`")
+
+    def check_storage(self):
+        storage = get_storage()
+        name = f'startup_check/{uuid.uuid4().hex}'
+        storage.write(name, [b'ok'])
+        try:
+            if b''.join(storage.read(name)) != b'ok':
+                raise Exception("read back different bytes than were written")
+        finally:
+            storage.delete(name)
+
+    def check_upload_temp_dir(self):
+        if not os.access(settings.FILE_UPLOAD_TEMP_DIR, os.W_OK):
+            raise Exception(f"{settings.FILE_UPLOAD_TEMP_DIR} is not writable")
+
+    def check_mfa_replay_cache(self):
+        """A warning in development, a failure otherwise"""
+        alias = settings.MFA_VERIFICATION['USED_CODES_CACHE']
+        if settings.SERVER_PROCESSES == 1 or not isinstance(caches[alias], (LocMemCache, DummyCache)):
+            return None
+        message = (
+            f"cache '{alias}' is per process, so a TOTP code can be replayed against each of "
+            f"{settings.SERVER_PROCESSES} workers; set MFA_USED_CODES_CACHE to a shared cache"
+        )
+        if not settings.DEBUG:
+            raise Exception(message)
+        return message
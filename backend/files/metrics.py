@@ -0,0 +1,339 @@
+import atexit
+import contextvars
+import glob
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(11))  # 1KB to 1GB
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'http_requests_total': ('counter', "Requests by view, method and status", None),
+    'http_request_duration_seconds': (
+        'histogram', "Time until the response (or its first byte, when streamed) was ready",
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+    ),
+    'db_queries_per_request': ('histogram', "Database queries per request", (0, 1, 2, 3, 5, 10, 20, 50, 100)),
+    'db_query_duration_seconds_total': ('counter', "Time spent in database queries", None),
+    'response_streamed_bytes_total': ('counter', "Bytes sent by streaming (download) responses", None),
+    'upload_size_bytes': ('histogram', "Request body size of uploads", SIZE_BUCKETS),
+    'share_link_cache_requests_total': ('counter', "Share-link token lookups by cache result", None),
+    'share_tokens_rejected_total': ('counter', "Signed share tokens refused without a lookup, by reason", None),
+    'password_hashes_total': ('counter', "Password hashes by outcome (ok, busy or timeout)", None),
+    'password_hash_queue_seconds': (
+        'histogram', "Time password hashes waited for the hashing pool",
+        (0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+    ),
+    'password_hash_duration_seconds': (
+        'histogram', "Time spent hashing passwords, by hasher method",
+        (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    ),
+    'rate_limited_requests_total': ('counter', "Requests refused by a rate limit, by scope", None),
+    'mfa_verifications_total': ('counter', "TOTP codes checked, by result (ok, invalid or replayed)", None),
+    'jwt_auth_cache_requests_total': ('counter', "Access token and user snapshot lookups by cache result", None),
+}
+
+# Views whose request bodies are recorded as uploads
+UPLOAD_VIEWS = {'create', 'upload_chunk'}
+
+class Metrics:
+    """
+    Per-process counters and histograms. Every thread records into its own
+    dicts, so recording takes no lock; a scrape merges the threads' dicts
+    and, with METRICS_DIR set, the snapshots other processes export there.
+    The dicts of threads that have exited are folded into one total, so
+    servers that start a thread per request don't accumulate them.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.shards = {}  # thread: its dict
+        self.retired = {}  # Totals of exited threads
+        self.lock = threading.Lock()
+        self.exporter = None
+
+    def shard(self):
+        try:
+            return self.local.shard
+        except AttributeError:
+            shard = self.local.shard = {}
+            with self.lock:
+                self.retire()
+                self.shards[threading.current_thread()] = shard
+            if settings.METRICS_DIR:
+                self.start_exporter(settings.METRICS_EXPORT_INTERVAL)
+            return shard
+
+    def inc(self, name, labels=(), amount=1):
+        shard = self.shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+    def observe(self, name, labels, value):
+        shard = self.shard()
+        key = (name, labels)
+        buckets = METRICS[name][2]
+        # One count per bucket, then +Inf, then the sum
+        values = shard.get(key)
+        if values is None:
+            values = shard[key] = [0] * (len(buckets) + 2)
+        values[bisect_left(buckets, value)] += 1
+        values[-1] += value
+
+    def retire(self):
+        """Fold the dicts of exited threads into self.retired; called with self.lock held"""
+        for thread in [thread for thread in self.shards if not thread.is_alive()]:
+            merge(self.retired, self.shards.pop(thread).items())
+
+    def snapshot(self):
+        """This process's totals as {(name, labels): value or histogram list}"""
+        totals = {}
+        with self.lock:
+            self.retire()
+            merge(totals, self.retired.items())
+            shards = list(self.shards.values())
+        for shard in shards:
+            # Copying a dict is atomic, even while its thread keeps recording
+            merge(totals, dict(shard).items())
+        return totals
+
+    # Multiprocess aggregation
+
+    def export_path(self, pid):
+        return os.path.join(settings.METRICS_DIR, f'{pid}.json')
+
+    def export(self):
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        path = self.export_path(os.getpid())
+        entries = [[name, labels, value] for (name, labels), value in self.snapshot().items()]
+        with open(path + '.tmp', 'w') as f:
+            json.dump(entries, f)
+        os.replace(path + '.tmp', path)
+
+    def collect(self):
+        """Totals of every process: this one live, the others from their exports"""
+        totals = self.snapshot()
+        if settings.METRICS_DIR:
+            own = self.export_path(os.getpid())
+            for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+                if path == own:
+                    continue
+                try:
+                    with open(path) as f:
+                        entries = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                merge(totals, (((name, tuple(map(tuple, labels))), value) for name, labels, value in entries))
+        return totals
+
+    def start_exporter(self, interval):
+        if self.exporter is not None and self.exporter.is_alive():
+            return
+        with self.lock:
+            if self.exporter is not None and self.exporter.is_alive():
+                return
+            self.exporter = threading.Thread(
+                target=self.run_exporter, args=(interval,), name='metrics-exporter', daemon=True
+            )
+            self.exporter.start()
+
+    def run_exporter(self, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                self.export()
+            except Exception:
+                logger.exception("Failed to export metrics")
+
+def merge(totals, items):
+    for key, value in items:
+        if isinstance(value, list):
+            current = totals.get(key)
+            totals[key] = list(value) if current is None else [a + b for a, b in zip(current, value)]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+def clear_exports():
+    """Forget the exports of previous server runs"""
+    if settings.METRICS_DIR:
+        for path in glob.glob(os.path.join(settings.METRICS_DIR, '*.json')):
+            os.remove(path)
+
+metrics = Metrics()
+
+@atexit.register
+def export_on_exit():
+    if settings.configured and settings.METRICS_DIR and (metrics.shards or metrics.retired):
+        metrics.export()
+
+# Per-request database accounting
+
+class RequestStats:
+    __slots__ = ('queries', 'query_time')
+
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+
+# Copied into sync_to_async threads, so async views' queries are counted too
+current_request = contextvars.ContextVar('current_request', default=None)
+
+def record_query(execute, sql, params, many, context):
+    stats = current_request.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.queries += 1
+        stats.query_time += time.perf_counter() - started
+
+@receiver(connection_created)
+def install_query_recorder(sender, connection, **kwargs):
+    # Fires again on every reconnect of the same connection object. Goes
+    # first, as connection.execute_wrapper() blocks pop the last wrapper.
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, record_query)
+
+# Middleware
+
+def get_view_name(view_func):
+    """Name of a view function or class-based view"""
+    return getattr(view_func, 'cls', view_func).__name__
+
+def count_streamed_bytes(response, view):
+    def counted(content):
+        sent = 0
+        try:
+            for chunk in content:
+                sent += len(chunk)
+                yield chunk
+        finally:
+            metrics.inc('response_streamed_bytes_total', (('view', view),), sent)
+
+    async def acounted(content):
+        sent = 0
+        try:
+            async for chunk in content:
+                sent += len(chunk)
+                yield chunk
+        finally:
+            metrics.inc('response_streamed_bytes_total', (('view', view),), sent)
+
+    wrap = acounted if response.is_async else counted
+    response.streaming_content = wrap(response.streaming_content)
+
+class MetricsMiddleware:
+    """
+    Records latency, status, DB queries, streamed bytes and upload sizes
+    of every request, labelled by view (the DRF action name for viewsets).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        started, stats, token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.finish(request, response, started, stats)
+        return response
+
+    async def __acall__(self, request):
+        started, stats, token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        self.finish(request, response, started, stats)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        actions = getattr(view_func, 'actions', None)
+        if actions:
+            request.metrics_view = actions.get(request.method.lower(), get_view_name(view_func))
+        else:
+            request.metrics_view = get_view_name(view_func)
+
+    def start(self, request):
+        request.metrics_view = 'unmatched'
+        stats = RequestStats()
+        return time.perf_counter(), stats, current_request.set(stats)
+
+    def finish(self, request, response, started, stats):
+        view = request.metrics_view
+        labels = (('view', view),)
+        metrics.inc('http_requests_total', labels + (('method', request.method), ('status', str(response.status_code))))
+        metrics.observe('http_request_duration_seconds', labels, time.perf_counter() - started)
+        metrics.observe('db_queries_per_request', labels, stats.queries)
+        if stats.query_time:
+            metrics.inc('db_query_duration_seconds_total', labels, stats.query_time)
+        if view in UPLOAD_VIEWS:
+            try:
+                metrics.observe('upload_size_bytes', labels, int(request.META.get('CONTENT_LENGTH') or 0))
+            except ValueError:
+                pass
+        if response.streaming:
+            count_streamed_bytes(response, view)
+
+# Exposition
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+def render(totals):
+    """Prometheus text exposition format"""
+    by_name = {}
+    for (name, labels), value in totals.items():
+        by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, (kind, help_text, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for labels, value in sorted(by_name.get(name, [])):
+            if kind != 'histogram':
+                lines.append(f'{name}{format_labels(labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(buckets + ('+Inf',), value):
+                cumulative += count
+                lines.append(f'{name}_bucket{format_labels(labels + (("le", bound),))} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {value[-1]}')
+            lines.append(f'{name}_count{format_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+def metrics_view(request):
+    token = settings.METRICS_TOKEN
+    if not token:
+        # View names and traffic are not for everyone: opt in to serving them openly
+        if not settings.METRICS_PUBLIC:
+            return HttpResponse(status=403)
+    elif request.META.get('HTTP_AUTHORIZATION') != f'Bearer {token}':
+        return HttpResponse(status=401)
+    return HttpResponse(render(metrics.collect()), content_type='text/plain; version=0.0.4; charset=utf-8')
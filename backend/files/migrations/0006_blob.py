@@ -0,0 +1,31 @@
+# Generated by Django 5.0 on 2026-10-16 22:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0005_uploadsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Blob',
+            fields=[
+                ('sha256', models.CharField(help_text='SHA-256 of the stored bytes', max_length=64, primary_key=True, serialize=False)),
+                ('size', models.BigIntegerField(help_text='Blob size in bytes')),
+                ('ref_count', models.PositiveIntegerField(default=1, help_text='Number of Files referencing this blob')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Blob',
+                'verbose_name_plural': 'Blobs',
+            },
+        ),
+        migrations.AddField(
+            model_name='file',
+            name='sha256',
+            field=models.CharField(blank=True, default='', help_text='SHA-256 of the stored ciphertext, if computed', max_length=64),
+        ),
+    ]
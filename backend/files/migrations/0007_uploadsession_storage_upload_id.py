@@ -0,0 +1,18 @@
+# Generated by Django 5.0 on 2026-10-16 22:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0006_blob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='storage_upload_id',
+            field=models.CharField(blank=True, help_text="Storage driver's id for the multipart upload", max_length=1024),
+        ),
+    ]
@@ -0,0 +1,69 @@
+# Generated by Django 5.0 on 2026-10-16 22:31
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0007_uploadsession_storage_upload_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['owner', '-uploaded_at'], name='file_owner_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(fields=['file'], name='file_file_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='file',
+            index=models.Index(condition=models.Q(('sha256', ''), _negated=True), fields=['sha256'], name='file_sha256_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shareablelink',
+            index=models.Index(fields=['file', '-created_at'], name='link_file_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shareablelink',
+            index=models.Index(fields=['created_by', '-created_at'], name='link_creator_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shareablelink',
+            index=models.Index(fields=['guest_user', '-created_at'], name='link_guest_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='shareablelink',
+            index=models.Index(fields=['expires_at'], name='link_expires_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='uploadsession',
+            index=models.Index(fields=['expires_at'], name='upload_expires_idx'),
+        ),
+        # Drop the single-column FK indexes only once the composites exist
+        migrations.AlterField(
+            model_name='file',
+            name='owner',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='files', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='shareablelink',
+            name='created_by',
+            field=models.ForeignKey(db_index=False, help_text='User who created the link', on_delete=django.db.models.deletion.CASCADE, related_name='created_links', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='shareablelink',
+            name='file',
+            field=models.ForeignKey(db_index=False, help_text='The file being shared', on_delete=django.db.models.deletion.CASCADE, related_name='shareable_links', to='files.file'),
+        ),
+        migrations.AlterField(
+            model_name='shareablelink',
+            name='guest_user',
+            field=models.ForeignKey(blank=True, db_index=False, help_text='Guest user this link is specifically shared with', limit_choices_to={'role': 'guest'}, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='shared_links', to=settings.AUTH_USER_MODEL),
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.0 on 2026-10-16 22:51
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Max, Sum
+from django.db.models.functions import Coalesce
+
+
+def backfill_share_stats(apps, schema_editor):
+    ShareableLink = apps.get_model('files', 'ShareableLink')
+    FileShareStats = apps.get_model('files', 'FileShareStats')
+    OwnerShareStats = apps.get_model('files', 'OwnerShareStats')
+    aggregates = {
+        'active_links': Count('token'),
+        'total_accesses': Coalesce(Sum('access_count'), 0),
+        'last_accessed_at': Max('last_accessed_at'),
+    }
+    links = ShareableLink.objects.order_by()
+    FileShareStats.objects.bulk_create(
+        (FileShareStats(file_id=row.pop('file_id'), **row)
+         for row in links.values('file_id').annotate(**aggregates).iterator()),
+        batch_size=1000,
+    )
+    OwnerShareStats.objects.bulk_create(
+        (OwnerShareStats(owner_id=row.pop('file__owner_id'), **row)
+         for row in links.values('file__owner_id').annotate(**aggregates).iterator()),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0009_file_listing_keyset_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileShareStats',
+            fields=[
+                ('active_links', models.PositiveIntegerField(default=0)),
+                ('total_accesses', models.PositiveBigIntegerField(default=0)),
+                ('last_accessed_at', models.DateTimeField(blank=True, null=True)),
+                ('file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='share_stats', serialize=False, to='files.file')),
+            ],
+            options={
+                'verbose_name': 'File Share Stats',
+                'verbose_name_plural': 'File Share Stats',
+            },
+        ),
+        migrations.CreateModel(
+            name='OwnerShareStats',
+            fields=[
+                ('active_links', models.PositiveIntegerField(default=0)),
+                ('total_accesses', models.PositiveBigIntegerField(default=0)),
+                ('last_accessed_at', models.DateTimeField(blank=True, null=True)),
+                ('owner', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='share_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Owner Share Stats',
+                'verbose_name_plural': 'Owner Share Stats',
+            },
+        ),
+        migrations.RunPython(backfill_share_stats, migrations.RunPython.noop),
+    ]
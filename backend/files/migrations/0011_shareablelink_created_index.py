@@ -0,0 +1,19 @@
+# Generated by Django 5.0 on 2026-10-16 22:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0010_share_stats'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shareablelink',
+            index=models.Index(fields=['created_at'], name='link_created_idx'),
+        ),
+    ]
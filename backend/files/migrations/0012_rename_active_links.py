@@ -0,0 +1,33 @@
+# Generated by Django 5.0 on 2026-10-16 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('files', '0011_shareablelink_created_index'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='filesharestats',
+            old_name='active_links',
+            new_name='link_count',
+        ),
+        migrations.RenameField(
+            model_name='ownersharestats',
+            old_name='active_links',
+            new_name='link_count',
+        ),
+        migrations.AlterField(
+            model_name='filesharestats',
+            name='link_count',
+            field=models.PositiveIntegerField(default=0, help_text='Links not yet deleted, expired or not'),
+        ),
+        migrations.AlterField(
+            model_name='ownersharestats',
+            name='link_count',
+            field=models.PositiveIntegerField(default=0, help_text='Links not yet deleted, expired or not'),
+        ),
+    ]
@@ -1,22 +1,95 @@
+import hashlib
 import os
+import re
 import uuid
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import F
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.utils import timezone
 
+from .storage import get_storage
+
 def validate_file_size(value):
     filesize = value.size
     if filesize > settings.MAX_UPLOAD_SIZE:
         raise ValidationError(f"Maximum file size that can be uploaded is {settings.MAX_UPLOAD_SIZE/(1024*1024)}MB")
 
+# Longest extension of the client's filename kept in storage names
+MAX_EXTENSION_LENGTH = 16
+
 def get_file_path(instance, filename):
-    # Generate a UUID for the file
-    ext = filename.split('.')[-1]
-    filename = f"{uuid.uuid4()}.{ext}"
+    # Generate a UUID for the file, keeping only a short alphanumeric
+    # extension so the path fits File.file and stays in the owner's directory
+    _, dot, ext = re.split(r'[/\\]', filename)[-1].rpartition('.')
+    ext = re.sub(r'[^A-Za-z0-9]', '', ext)[:MAX_EXTENSION_LENGTH] if dot else ''
+    filename = f"{uuid.uuid4()}.{ext}" if ext else str(uuid.uuid4())
     # Return the file path
     return os.path.join('encrypted_files', str(instance.owner.id), filename)
 
+def get_upload_path(owner, filename):
+    # Chunked uploads are written straight into their final location
+    return get_file_path(File(owner=owner), filename)
+
+def get_blob_path(sha256):
+    # Shard blobs by hash prefix so no directory grows unbounded
+    return os.path.join('blobs', sha256[:2], sha256[2:4], sha256)
+
+def compute_sha256(chunks):
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    return digest.hexdigest()
+
+class BlobManager(models.Manager):
+    def acquire(self, sha256, size, write):
+        """
+        Take a reference to the blob with this hash and return its storage path.
+        write(path) is only called when the blob is not stored yet.
+        """
+        path = get_blob_path(sha256)
+        if self.filter(sha256=sha256).update(ref_count=F('ref_count') + 1):
+            return path
+
+        write(path)
+        try:
+            with transaction.atomic():
+                self.create(sha256=sha256, size=size)
+        except IntegrityError:
+            # Another upload of the same content won the race
+            self.filter(sha256=sha256).update(ref_count=F('ref_count') + 1)
+        return path
+
+    def release(self, sha256):
+        """Drop a reference, unlinking the blob when it was the last one"""
+        with transaction.atomic():
+            blob = self.select_for_update().filter(sha256=sha256).first()
+            if blob is None:
+                return
+            if blob.ref_count > 1:
+                self.filter(sha256=sha256).update(ref_count=F('ref_count') - 1)
+                return
+            blob.delete()
+            # Unlink while the row is still locked so a concurrent acquire
+            # re-creates the blob after us rather than losing its bytes
+            get_storage().delete(get_blob_path(sha256))
+
+class Blob(models.Model):
+    """Content-addressed, reference-counted ciphertext shared by identical Files"""
+    sha256 = models.CharField(max_length=64, primary_key=True, help_text="SHA-256 of the stored bytes")
+    size = models.BigIntegerField(help_text="Blob size in bytes")
+    ref_count = models.PositiveIntegerField(default=1, help_text="Number of Files referencing this blob")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = BlobManager()
+
+    class Meta:
+        verbose_name = 'Blob'
+        verbose_name_plural = 'Blobs'
+
+    def __str__(self):
+        return f"{self.sha256} ({self.ref_count} refs)"
+
 class File(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     filename = models.CharField(max_length=255, help_text="Original name of the uploaded file")
@@ -24,24 +97,44 @@ class File(models.Model):
     encryption_key = models.TextField(help_text="Stores the server-side encrypted key")  # Added help_text
     size = models.BigIntegerField(help_text="File size in bytes")
     mime_type = models.CharField(max_length=255, help_text="MIME type of the file")
-    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='files')
+    # Indexed through file_owner_uploaded_idx
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='files', db_index=False)
     uploaded_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     description = models.TextField(blank=True, null=True, help_text="Optional description of the file")  # New field
+    sha256 = models.CharField(max_length=64, blank=True, default='', help_text="SHA-256 of the stored ciphertext, if computed")
 
     class Meta:
         ordering = ['-uploaded_at']
         verbose_name = 'File'
         verbose_name_plural = 'Files'
+        indexes = [
+            # File listing: owner's files, newest first (keyset on uploaded_at, id)
+            models.Index(fields=['owner', '-uploaded_at', '-id'], name='file_owner_uploaded_idx'),
+            # Garbage collection: storage names back to rows
+            models.Index(fields=['file'], name='file_file_idx'),
+            # Blob reference counting; most files are not blob-backed
+            models.Index(fields=['sha256'], name='file_sha256_idx', condition=~models.Q(sha256='')),
+        ]
 
     def __str__(self):
         return self.filename
 
+    @property
+    def is_blob_backed(self):
+        return bool(self.sha256) and self.file.name == get_blob_path(self.sha256)
+
     def delete(self, *args, **kwargs):
+        from .rollups import file_deleted
+        file_deleted(self)
+        # Shared blobs are only unlinked once no File references them
+        if self.is_blob_backed:
+            super().delete(*args, **kwargs)
+            Blob.objects.release(self.sha256)
+            return
         # Delete the actual file when the model is deleted
         if self.file:
-            if os.path.isfile(self.file.path):
-                os.remove(self.file.path)
+            get_storage().delete(self.file.name)
         super().delete(*args, **kwargs)
 
 class ShareableLink(models.Model):
@@ -61,7 +154,8 @@ class ShareableLink(models.Model):
         File,
         on_delete=models.CASCADE,
         related_name='shareable_links',
-        help_text="The file being shared"
+        help_text="The file being shared",
+        db_index=False  # Indexed through link_file_created_idx
     )
     permissions = models.CharField(
         max_length=10,
@@ -97,7 +191,8 @@ class ShareableLink(models.Model):
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
         related_name='created_links',
-        help_text="User who created the link"
+        help_text="User who created the link",
+        db_index=False  # Indexed through link_creator_created_idx
     )
     guest_user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
@@ -106,13 +201,24 @@ class ShareableLink(models.Model):
         blank=True,
         related_name='shared_links',
         help_text='Guest user this link is specifically shared with',
-        limit_choices_to={'role': 'guest'}
+        limit_choices_to={'role': 'guest'},
+        db_index=False  # Indexed through link_guest_created_idx
     )
 
     class Meta:
         ordering = ['-created_at']
         verbose_name = 'Shareable Link'
         verbose_name_plural = 'Shareable Links'
+        indexes = [
+            # Links of a file / created by a user / shared with a guest, newest first
+            models.Index(fields=['file', '-created_at'], name='link_file_created_idx'),
+            models.Index(fields=['created_by', '-created_at'], name='link_creator_created_idx'),
+            models.Index(fields=['guest_user', '-created_at'], name='link_guest_created_idx'),
+            # Expiry range scans (garbage collection)
+            models.Index(fields=['expires_at'], name='link_expires_idx'),
+            # Links created since a point in time (share token index sync)
+            models.Index(fields=['created_at'], name='link_created_idx'),
+        ]
         constraints = [
             models.CheckConstraint(
                 check=models.Q(
@@ -135,15 +241,159 @@ class ShareableLink(models.Model):
         return not self.is_expired()
 
     def record_access(self, user=None):
-        """Record an access to this link"""
-        self.access_count += 1
-        self.last_accessed_at = timezone.now()
-        if user:
-            self.accessed_by = user
-        self.save()
+        """Record an access to this link (written back in batches)"""
+        from .access import record_access
+        record_access(self.token, user)
 
     def save(self, *args, **kwargs):
         """Generate a secure token if not set"""
         if not self.token:
             self.token = uuid.uuid4().hex
         super().save(*args, **kwargs)
+
+class ShareStats(models.Model):
+    """
+    Totals over a set of share links, kept up to date as links are created,
+    accessed and deleted (see files.rollups) so they are read as one row.
+    link_count includes expired links until collect_garbage deletes them;
+    last_accessed_at also remembers accesses to links deleted since.
+    """
+    link_count = models.PositiveIntegerField(default=0, help_text="Links not yet deleted, expired or not")
+    total_accesses = models.PositiveBigIntegerField(default=0)
+    last_accessed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        abstract = True
+
+class FileShareStats(ShareStats):
+    file = models.OneToOneField(File, on_delete=models.CASCADE, primary_key=True, related_name='share_stats')
+
+    class Meta:
+        verbose_name = 'File Share Stats'
+        verbose_name_plural = 'File Share Stats'
+
+class OwnerShareStats(ShareStats):
+    owner = models.OneToOneField(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, primary_key=True, related_name='share_stats'
+    )
+
+    class Meta:
+        verbose_name = 'Owner Share Stats'
+        verbose_name_plural = 'Owner Share Stats'
+
+class UploadSession(models.Model):
+    """A resumable, chunked upload that becomes a File on commit"""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    owner = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='upload_sessions')
+    filename = models.CharField(max_length=255, help_text="Original name of the uploaded file")
+    path = models.CharField(max_length=255, help_text="Storage path the chunks are written to")
+    storage_upload_id = models.CharField(max_length=1024, blank=True, help_text="Storage driver's id for the multipart upload")
+    encryption_key = models.TextField(help_text="Stores the server-side encrypted key")
+    size = models.BigIntegerField(help_text="Total file size in bytes")
+    chunk_size = models.PositiveIntegerField(help_text="Size of every chunk except the last, in bytes")
+    mime_type = models.CharField(max_length=255, help_text="MIME type of the file")
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(help_text="When the unfinished upload may be discarded")
+
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = 'Upload Session'
+        verbose_name_plural = 'Upload Sessions'
+        indexes = [
+            models.Index(fields=['expires_at'], name='upload_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"Upload of {self.filename} ({self.received_chunks().count()}/{self.total_chunks})"
+
+    @property
+    def total_chunks(self):
+        return max(1, -(-self.size // self.chunk_size))
+
+    def is_expired(self):
+        """Check if the session has expired"""
+        return timezone.now() > self.expires_at
+
+    def chunk_length(self, index):
+        """Expected length of the chunk at index"""
+        if index == self.total_chunks - 1:
+            return self.size - index * self.chunk_size
+        return self.chunk_size
+
+    def received_chunks(self):
+        return self.chunks.values_list('index', flat=True).order_by('index')
+
+    def missing_chunks(self):
+        received = set(self.received_chunks())
+        return [i for i in range(self.total_chunks) if i not in received]
+
+    def allocate(self):
+        """Start the storage-level upload chunks are written into"""
+        self.storage_upload_id = get_storage().create_multipart(self.path, self.size)
+
+    def write_chunk(self, index, stream):
+        """
+        Stream one chunk from a file-like object into place.
+        Returns False if the stream did not hold exactly the expected bytes.
+        """
+        expected = self.chunk_length(index)
+        written = get_storage().write_part(
+            self.path, self.storage_upload_id, index, index * self.chunk_size, stream, expected
+        )
+        if written != expected or stream.read(1):
+            # The part may hold some of these bytes now, so a copy received
+            # earlier is gone too; the chunk has to be sent again
+            UploadChunk.objects.filter(session=self, index=index).delete()
+            return False
+        # Re-sending a chunk is allowed so clients can retry blindly
+        UploadChunk.objects.get_or_create(session=self, index=index)
+        return True
+
+    def commit(self):
+        """
+        Turn a fully received session into a File. Raises
+        UploadSession.DoesNotExist if another commit already did.
+        """
+        file = File(
+            filename=self.filename,
+            encryption_key=self.encryption_key,
+            size=self.size,
+            mime_type=self.mime_type,
+            owner_id=self.owner_id,
+        )
+        file.file.name = self.path
+        # Outside the transaction: an object store may take a while to
+        # assemble a large upload
+        try:
+            get_storage().complete_multipart(self.path, self.storage_upload_id, self.total_chunks)
+        except Exception:
+            # A concurrent commit may have completed (and removed) it first
+            if not UploadSession.objects.filter(pk=self.pk).exists():
+                raise UploadSession.DoesNotExist("Upload already committed")
+            raise
+        with transaction.atomic():
+            # Concurrent commits wait here, then find the session gone
+            UploadSession.objects.select_for_update().get(pk=self.pk)
+            file.save()
+            super().delete()
+            if settings.CONTENT_ADDRESSED_STORAGE:
+                from .dedup import dedupe_queue
+                # Hashed and moved into the blob store after the request
+                transaction.on_commit(lambda: dedupe_queue.submit(file.pk))
+        return file
+
+    def delete(self, *args, **kwargs):
+        # Aborting an upload discards the partially written file
+        get_storage().abort_multipart(self.path, self.storage_upload_id)
+        super().delete(*args, **kwargs)
+
+class UploadChunk(models.Model):
+    session = models.ForeignKey(UploadSession, on_delete=models.CASCADE, related_name='chunks')
+    index = models.PositiveIntegerField()
+    received_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['index']
+        constraints = [
+            models.UniqueConstraint(fields=['session', 'index'], name='unique_upload_chunk')
+        ]
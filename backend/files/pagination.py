@@ -0,0 +1,129 @@
+import base64
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+class FileCursorPagination(BasePagination):
+    """
+    Keyset pagination over (uploaded_at, id), newest first. Each page is one
+    index range scan on (owner, uploaded_at, id) whatever its position, and
+    no COUNT(*) is ever run.
+    """
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return settings.FILE_LIST_PAGE_SIZE
+        return max(1, min(page_size, settings.FILE_LIST_MAX_PAGE_SIZE))
+
+    def encode_cursor(self, obj, reverse):
+        # Pages hold File instances or .values() rows
+        if isinstance(obj, dict):
+            uploaded_at, pk = obj['uploaded_at'], obj['id']
+        else:
+            uploaded_at, pk = obj.uploaded_at, obj.id
+        raw = f"{'p' if reverse else 'n'}|{uploaded_at.isoformat()}|{pk.hex}"
+        return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4)).decode()
+            direction, uploaded_at, pk = raw.split('|')
+            uploaded_at = parse_datetime(uploaded_at)
+            if direction not in ('n', 'p') or uploaded_at is None:
+                raise ValueError
+            return direction == 'p', uploaded_at, uuid.UUID(pk)
+        except (ValueError, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        reverse = cursor is not None and cursor[0]
+
+        if cursor is None:
+            queryset = queryset.order_by('-uploaded_at', '-id')
+        elif reverse:
+            # Walk backwards from the cursor, then flip the page
+            _, uploaded_at, pk = cursor
+            queryset = queryset.filter(
+                Q(uploaded_at__gt=uploaded_at) | Q(uploaded_at=uploaded_at, id__gt=pk)
+            ).order_by('uploaded_at', 'id')
+        else:
+            _, uploaded_at, pk = cursor
+            queryset = queryset.filter(
+                Q(uploaded_at__lt=uploaded_at) | Q(uploaded_at=uploaded_at, id__lt=pk)
+            ).order_by('-uploaded_at', '-id')
+
+        # One extra row tells us whether there is another page
+        page = list(queryset[:page_size + 1])
+        has_more = len(page) > page_size
+        page = page[:page_size]
+        if reverse:
+            page.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = cursor is not None, has_more
+
+        self.page = page
+        return page
+
+    def get_link(self, obj, reverse):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(obj, reverse))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.get_link(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.page:
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.get_link(self.page[0], reverse=True)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+class LinkCursorPagination(CursorPagination):
+    """A file's share links, newest first, on the (file, created_at) index"""
+    ordering = '-created_at'
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return settings.LINK_LIST_PAGE_SIZE
+        return max(1, min(page_size, settings.LINK_LIST_MAX_PAGE_SIZE))
@@ -0,0 +1,116 @@
+import contextvars
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ContextDecorator
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+logger = logging.getLogger(__name__)
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+# The QueryBudgets active in this context; copied into sync_to_async threads
+active_budgets = contextvars.ContextVar('active_budgets', default=())
+
+def capture_query(execute, sql, params, many, context):
+    budgets = active_budgets.get()
+    if not budgets:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        query = (sql, time.perf_counter() - started)
+        for budget in budgets:
+            budget.queries.append(query)
+
+@receiver(connection_created)
+def install_query_capture(sender, connection, **kwargs):
+    if capture_query not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, capture_query)
+
+class QueryBudget(ContextDecorator):
+    """
+    Capture the SQL run inside a block (or decorated function), on any
+    thread the block hands work to, and raise QueryBudgetExceeded if more
+    than max_queries ran. With max_queries=None it only captures.
+
+        with QueryBudget(3, 'file list') as budget:
+            ...
+        budget.queries  # [(sql, seconds), ...]
+    """
+
+    def __init__(self, max_queries=None, label=''):
+        self.max_queries = max_queries
+        self.label = label
+        self.queries = []
+        self.tokens = []
+
+    def __enter__(self):
+        self.queries = []
+        self.tokens.append(active_budgets.set(active_budgets.get() + (self,)))
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        active_budgets.reset(self.tokens.pop())
+        if exc_type is None and self.max_queries is not None and len(self.queries) > self.max_queries:
+            raise QueryBudgetExceeded(
+                f"{self.label or 'Block'} ran {len(self.queries)} queries, "
+                f"budget is {self.max_queries}:\n" + '\n'.join(sql for sql, _ in self.queries)
+            )
+        return False
+
+    def __len__(self):
+        return len(self.queries)
+
+def normalize_sql(sql):
+    """Collapse IN lists so one query shape matches however many ids it has"""
+    return re.sub(r'IN \((?:%s, )*%s\)', 'IN (...)', sql)
+
+def duplicate_queries(queries, threshold):
+    """(sql, count) of the query shapes run at least threshold times"""
+    counts = Counter(normalize_sql(sql) for sql, _ in queries)
+    return [(sql, count) for sql, count in counts.most_common() if count >= threshold]
+
+class DuplicateQueryMiddleware:
+    """
+    Development aid: log requests that repeat a query shape, the usual
+    sign of an N+1 (a related object fetched once per row).
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        with QueryBudget() as budget:
+            response = self.get_response(request)
+        self.report(request, budget)
+        return response
+
+    async def __acall__(self, request):
+        with QueryBudget() as budget:
+            response = await self.get_response(request)
+        self.report(request, budget)
+        return response
+
+    def report(self, request, budget):
+        duplicates = duplicate_queries(budget.queries, settings.DUPLICATE_QUERY_THRESHOLD)
+        if duplicates:
+            logger.warning(
+                "%s %s ran %d queries, repeating: %s",
+                request.method, request.path, len(budget),
+                '; '.join(f"{count}x {sql}" for sql, count in duplicates),
+            )
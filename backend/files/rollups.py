@@ -0,0 +1,107 @@
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Max, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import FileShareStats, OwnerShareStats, ShareableLink
+
+BATCH_SIZE = 500  # Rows per UPDATE, each with its own CASE branch
+
+def latest(a, b):
+    if a is None or b is None:
+        return a or b
+    return max(a, b)
+
+def update_share_stats(changes):
+    """
+    Apply (file_id, owner_id, links, accesses, last_accessed_at) changes to
+    the file and owner rollups. links and accesses are added (negative to
+    subtract); last_accessed_at only moves forward and may be None.
+    """
+    by_file, by_owner = {}, {}
+    for file_id, owner_id, links, accesses, accessed_at in changes:
+        for totals, key in ((by_file, file_id), (by_owner, owner_id)):
+            current_links, current_accesses, current_at = totals.get(key, (0, 0, None))
+            totals[key] = (current_links + links, current_accesses + accesses, latest(current_at, accessed_at))
+    apply_totals(FileShareStats, by_file)
+    apply_totals(OwnerShareStats, by_owner)
+
+def apply_totals(model, totals):
+    items = [(key, change) for key, change in totals.items() if change != (0, 0, None)]
+    for i in range(0, len(items), BATCH_SIZE):
+        apply_batch(model, dict(items[i:i + BATCH_SIZE]))
+
+def apply_batch(model, totals):
+    # Rows usually exist already: one UPDATE covers the whole batch
+    if write_totals(model, totals) == len(totals):
+        return
+    existing = set(model.objects.filter(pk__in=list(totals)).values_list('pk', flat=True))
+    missing = {key: change for key, change in totals.items() if key not in existing}
+    # A concurrent writer may create the same rows; then we just add to theirs
+    model.objects.bulk_create([model(pk=key) for key in missing], ignore_conflicts=True)
+    write_totals(model, missing)
+
+def write_totals(model, totals):
+    links = [When(pk=key, then=Value(n)) for key, (n, _, _) in totals.items() if n]
+    accesses = [When(pk=key, then=Value(n)) for key, (_, n, _) in totals.items() if n]
+    accessed_at = [
+        When(pk=key, then=Greatest(Coalesce(F('last_accessed_at'), Value(at)), Value(at)))
+        for key, (_, _, at) in totals.items() if at is not None
+    ]
+    updates = {}
+    # Clamped at zero so a missed increment can't make a row unwritable
+    if links:
+        updates['link_count'] = Greatest(
+            F('link_count') + Case(*links, default=Value(0)), Value(0),
+            output_field=models.PositiveIntegerField()
+        )
+    if accesses:
+        updates['total_accesses'] = Greatest(
+            F('total_accesses') + Case(*accesses, default=Value(0)), Value(0),
+            output_field=models.PositiveBigIntegerField()
+        )
+    if accessed_at:
+        updates['last_accessed_at'] = Case(
+            *accessed_at, default=F('last_accessed_at'), output_field=models.DateTimeField()
+        )
+    return model.objects.filter(pk__in=list(totals)).update(**updates)
+
+def links_created(links):
+    """Count new links, given (file_id, owner_id) pairs"""
+    update_share_stats((file_id, owner_id, 1, 0, None) for file_id, owner_id in links)
+
+def links_deleted(links):
+    """Forget deleted links, given (file_id, owner_id, access_count) rows"""
+    update_share_stats((file_id, owner_id, -1, -count, None) for file_id, owner_id, count in links)
+
+def file_deleted(file):
+    """Take a file's links out of its owner's rollup (its own row cascades away)"""
+    stats = FileShareStats.objects.filter(file_id=file.pk).first()
+    if stats is not None:
+        apply_totals(OwnerShareStats, {file.owner_id: (-stats.link_count, -stats.total_accesses, None)})
+
+def rebuild_share_stats():
+    """
+    Recompute every rollup from the link rows, fixing drift left by deletes
+    that bypass the hooks above (queryset or cascading deletes of Files).
+    Returns the number of (file, owner) rows written.
+    """
+    links = ShareableLink.objects.order_by()
+    aggregates = {
+        'link_count': Count('token'),
+        'total_accesses': Coalesce(Sum('access_count'), 0),
+        'last_accessed_at': Max('last_accessed_at'),
+    }
+    with transaction.atomic():
+        FileShareStats.objects.all().delete()
+        OwnerShareStats.objects.all().delete()
+        files = FileShareStats.objects.bulk_create(
+            (FileShareStats(file_id=row.pop('file_id'), **row)
+             for row in links.values('file_id').annotate(**aggregates).iterator()),
+            batch_size=1000,
+        )
+        owners = OwnerShareStats.objects.bulk_create(
+            (OwnerShareStats(owner_id=row.pop('file__owner_id'), **row)
+             for row in links.values('file__owner_id').annotate(**aggregates).iterator()),
+            batch_size=1000,
+        )
+    return len(files), len(owners)
@@ -1,9 +1,22 @@
 from rest_framework import serializers
-from .models import File, ShareableLink
+from .models import Blob, File, ShareableLink, UploadSession, compute_sha256, get_file_path, get_upload_path
+from .rollups import links_created
+from .storage import get_storage
+from django.conf import settings
+from django.db import transaction
 from django.core.files.uploadedfile import UploadedFile
 from django.utils import timezone
 from datetime import timedelta
 
+UNSUPPORTED_TYPE_MESSAGE = (
+    "Unsupported file type. Please upload only: "
+    "Text Files (TXT, CSV, JSON), "
+    "Image Files (PNG, JPEG, GIF), "
+    "PDF Files, "
+    "Video Files (MP4, AVI), "
+    "or Audio Files (MP3, WAV)"
+)
+
 # Supported file types
 SUPPORTED_MIME_TYPES = {
     # Text Files
@@ -40,14 +53,7 @@ class FileUploadSerializer(serializers.Serializer):
         
         # Validate file type
         if value.content_type not in SUPPORTED_MIME_TYPES:
-            raise serializers.ValidationError(
-                "Unsupported file type. Please upload only: "
-                "Text Files (TXT, CSV, JSON), "
-                "Image Files (PNG, JPEG, GIF), "
-                "PDF Files, "
-                "Video Files (MP4, AVI), "
-                "or Audio Files (MP3, WAV)"
-            )
+            raise serializers.ValidationError(UNSUPPORTED_TYPE_MESSAGE)
         
         # Validate file size (5MB)
         if value.size > 5 * 1024 * 1024:
@@ -60,14 +66,138 @@ class FileUploadSerializer(serializers.Serializer):
         encryption_key = validated_data['encryption_key']
         user = self.context['request'].user
 
-        return File.objects.create(
+        if settings.CONTENT_ADDRESSED_STORAGE:
+            return self.create_blob_backed(file, encryption_key, user)
+
+        instance = File(
             filename=file.name,
-            file=file,
             encryption_key=encryption_key,
             size=file.size,
             mime_type=file.content_type,
             owner=user
         )
+        instance.file.name = get_file_path(instance, file.name)
+        get_storage().write(instance.file.name, file.chunks())
+        instance.save()
+        return instance
+
+    def create_blob_backed(self, file, encryption_key, user):
+        # Hash first so re-uploads of identical ciphertext are never written again
+        sha256 = compute_sha256(file.chunks())
+
+        def write(path):
+            get_storage().write(path, file.chunks())
+
+        instance = File(
+            filename=file.name,
+            encryption_key=encryption_key,
+            size=file.size,
+            mime_type=file.content_type,
+            owner=user,
+            sha256=sha256
+        )
+        with transaction.atomic():
+            instance.file.name = Blob.objects.acquire(sha256, file.size, write)
+            instance.save()
+        return instance
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    chunk_size = serializers.IntegerField(
+        min_value=1,
+        max_value=settings.MAX_UPLOAD_CHUNK_SIZE,
+        default=settings.UPLOAD_CHUNK_SIZE
+    )
+    total_chunks = serializers.IntegerField(read_only=True)
+    received_chunks = serializers.SerializerMethodField()
+
+    class Meta:
+        model = UploadSession
+        fields = [
+            'id', 'filename', 'size', 'mime_type', 'encryption_key', 'chunk_size',
+            'total_chunks', 'received_chunks', 'created_at', 'expires_at'
+        ]
+        read_only_fields = ['id', 'created_at', 'expires_at']
+        extra_kwargs = {
+            'encryption_key': {'write_only': True}
+        }
+
+    def get_received_chunks(self, obj):
+        return list(obj.received_chunks())
+
+    def validate_mime_type(self, value):
+        if value not in SUPPORTED_MIME_TYPES:
+            raise serializers.ValidationError(UNSUPPORTED_TYPE_MESSAGE)
+        return value
+
+    def validate_filename(self, value):
+        # A name, not a path, as multipart uploads send it
+        if any(char in value for char in '/\\\0') or value.strip() in ('', '.', '..'):
+            raise serializers.ValidationError("Invalid filename")
+        return value
+
+    def validate(self, attrs):
+        # Object stores reject small parts anywhere but at the end
+        min_part_size = get_storage().min_part_size
+        if attrs['chunk_size'] < min_part_size and attrs['size'] > attrs['chunk_size']:
+            raise serializers.ValidationError(
+                {'chunk_size': f"Chunks must be at least {min_part_size} bytes"}
+            )
+        return attrs
+
+    def validate_size(self, value):
+        if value < 0:
+            raise serializers.ValidationError("File size cannot be negative")
+        if value > settings.MAX_CHUNKED_UPLOAD_SIZE:
+            raise serializers.ValidationError(
+                f"File size cannot exceed {settings.MAX_CHUNKED_UPLOAD_SIZE // (1024 * 1024)}MB"
+            )
+        return value
+
+    def create(self, validated_data):
+        user = self.context['request'].user
+        session = UploadSession(
+            **validated_data,
+            owner=user,
+            path=get_upload_path(user, validated_data['filename']),
+            expires_at=timezone.now() + timedelta(hours=settings.UPLOAD_SESSION_EXPIRY_HOURS)
+        )
+        session.allocate()
+        session.save()
+        return session
+
+class BulkShareSerializer(serializers.Serializer):
+    """One link per file, or per (file, guest) pair when guests are given"""
+    fileIds = serializers.ListField(child=serializers.UUIDField(), allow_empty=False)
+    guestUserIds = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    permissions = serializers.ChoiceField(choices=ShareableLink.PERMISSION_CHOICES)
+    expiresIn = serializers.IntegerField(min_value=1)  # In hours
+
+    def validate(self, attrs):
+        # Repeated ids would only create duplicate links
+        attrs['fileIds'] = list(dict.fromkeys(attrs['fileIds']))
+        attrs['guestUserIds'] = list(dict.fromkeys(attrs['guestUserIds']))
+        links = len(attrs['fileIds']) * max(1, len(attrs['guestUserIds']))
+        if links > settings.MAX_BULK_SHARE_LINKS:
+            raise serializers.ValidationError(
+                f"At most {settings.MAX_BULK_SHARE_LINKS} links can be created at once, not {links}"
+            )
+        return attrs
+
+class ArchiveSerializer(serializers.Serializer):
+    fileIds = serializers.ListField(
+        child=serializers.UUIDField(), allow_empty=False, max_length=settings.MAX_ARCHIVE_FILES
+    )
+
+class SharedArchiveSerializer(serializers.Serializer):
+    tokens = serializers.ListField(
+        child=serializers.CharField(max_length=64), allow_empty=False, max_length=settings.MAX_ARCHIVE_FILES
+    )
+
+class ShareStatsSerializer(serializers.Serializer):
+    """FileShareStats or OwnerShareStats"""
+    link_count = serializers.IntegerField()
+    total_accesses = serializers.IntegerField()
+    last_accessed_at = serializers.DateTimeField()
 
 class ShareableLinkSerializer(serializers.ModelSerializer):
     expires_in = serializers.IntegerField(write_only=True, required=True)
@@ -106,7 +236,10 @@ class ShareableLinkSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         expires_in = validated_data.pop('expires_in')
         expires_at = timezone.now() + timedelta(minutes=expires_in)
-        return ShareableLink.objects.create(
-            **validated_data,
-            expires_at=expires_at
-        )
+        with transaction.atomic():
+            link = ShareableLink.objects.create(
+                **validated_data,
+                expires_at=expires_at
+            )
+            links_created([(link.file_id, link.file.owner_id)])
+        return link
@@ -0,0 +1,113 @@
+"""
+Share-link tokens. With SHARE_TOKEN_FORMAT = 'signed' a token carries its
+link's file, permissions, expiry and guest under an HMAC, so forged,
+expired and wrong-guest tokens are turned away before any lookup; a token
+that passes is still resolved through the link cache and database, which
+is what lets deleting a link revoke it.
+"""
+import base64
+import binascii
+import secrets
+import struct
+import uuid
+from collections import namedtuple
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .metrics import metrics
+
+KEY_SALT = 'files.share_tokens'
+VERSION = 1
+# version, flags, expiry (epoch seconds), file id, guest id (0 for none), nonce
+PAYLOAD = struct.Struct('>BBI16sQ4s')
+MAC_SIZE = 14
+# 48 bytes, so exactly 64 base64 characters; random tokens are 43
+SIGNED_TOKEN_LENGTH = (PAYLOAD.size + MAC_SIZE) * 4 // 3
+
+FLAG_DOWNLOAD = 1
+
+Claims = namedtuple('Claims', ['file_id', 'permissions', 'expires_at', 'guest_id'])
+
+class InvalidShareToken(Exception):
+    pass
+
+def sign(payload, secret):
+    return salted_hmac(KEY_SALT, payload, secret=secret, algorithm='sha256').digest()[:MAC_SIZE]
+
+def make_signed_token(file_id, permissions, expires_at, guest_id=None):
+    # The expiry is kept to the second, never later than the link's own
+    payload = PAYLOAD.pack(
+        VERSION,
+        FLAG_DOWNLOAD if permissions == 'download' else 0,
+        int(expires_at.timestamp()),
+        uuid.UUID(str(file_id)).bytes,
+        int(guest_id or 0),
+        secrets.token_bytes(4),
+    )
+    return base64.urlsafe_b64encode(payload + sign(payload, settings.SECRET_KEY)).decode()
+
+def generate_share_token(file_id, permissions, expires_at, guest_id=None):
+    if settings.SHARE_TOKEN_FORMAT == 'signed':
+        return make_signed_token(file_id, permissions, expires_at, guest_id)
+    return secrets.token_urlsafe(32)
+
+def read_claims(token):
+    """
+    The Claims of a signed token, or None for a random one. Raises
+    InvalidShareToken for a token no key of ours signed.
+    """
+    if len(token) != SIGNED_TOKEN_LENGTH:
+        if not settings.SHARE_TOKEN_ACCEPT_UNSIGNED:
+            raise InvalidShareToken
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token)
+    except (binascii.Error, ValueError):
+        raise InvalidShareToken
+    payload, mac = raw[:PAYLOAD.size], raw[PAYLOAD.size:]
+    secrets_to_try = [settings.SECRET_KEY, *settings.SECRET_KEY_FALLBACKS]
+    if not any(constant_time_compare(mac, sign(payload, secret)) for secret in secrets_to_try):
+        raise InvalidShareToken
+    version, flags, expires_at, file_id, guest_id, _ = PAYLOAD.unpack(payload)
+    if version != VERSION:
+        raise InvalidShareToken
+    return Claims(
+        file_id=uuid.UUID(bytes=file_id),
+        permissions='download' if flags & FLAG_DOWNLOAD else 'view',
+        expires_at=datetime.fromtimestamp(expires_at, dt_timezone.utc),
+        guest_id=guest_id or None,
+    )
+
+def is_forged_share_token(token):
+    try:
+        read_claims(token)
+    except InvalidShareToken:
+        metrics.inc('share_tokens_rejected_total', (('reason', 'invalid'),))
+        return True
+    return False
+
+def reject_share_token(token, user):
+    """
+    (status, message) for a token that can be refused from its claims
+    alone, or None when it has to be looked up.
+    """
+    try:
+        claims = read_claims(token)
+    except InvalidShareToken:
+        reason, rejection = 'invalid', (404, 'This link is invalid')
+    else:
+        if claims is None:
+            return None
+        if claims.expires_at < timezone.now():
+            reason, rejection = 'expired', (403, 'This link has expired')
+        elif claims.guest_id is not None and not user.is_authenticated:
+            reason, rejection = 'unauthenticated', (401, 'Authentication required for this link')
+        elif claims.guest_id is not None and user.id != claims.guest_id:
+            reason, rejection = 'wrong_guest', (403, 'This link is not shared with you')
+        else:
+            return None
+    metrics.inc('share_tokens_rejected_total', (('reason', reason),))
+    return rejection
@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .link_cache import invalidate_tokens
+from .models import File, ShareableLink
+from .token_index import share_token_index
+
+@receiver([post_save, post_delete], sender=ShareableLink)
+def invalidate_link(sender, instance, **kwargs):
+    invalidate_tokens([instance.token])
+
+@receiver(post_save, sender=ShareableLink)
+def index_link(sender, instance, created, **kwargs):
+    if created:
+        share_token_index.add([instance.token])
+
+@receiver(post_save, sender=File)
+def invalidate_file_links(sender, instance, created, **kwargs):
+    # Deleting a File cascades to its links, which invalidate themselves
+    if not created:
+        invalidate_tokens(instance.shareable_links.values_list('token', flat=True))
@@ -0,0 +1,315 @@
+import io
+import os
+import tempfile
+from datetime import datetime, timezone
+from functools import lru_cache
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+class BlobStorage:
+    """
+    Interface for all reads and writes of stored ciphertext. Names are
+    relative keys such as 'encrypted_files/<owner>/<uuid>.<ext>'.
+    """
+    # Smallest chunk a multipart upload may use (except for its last chunk)
+    min_part_size = 1
+
+    def exists(self, name):
+        raise NotImplementedError
+
+    def size(self, name):
+        raise NotImplementedError
+
+    def read(self, name, start=0, end=None):
+        """Iterate over the bytes from start to end (inclusive, None for EOF)"""
+        raise NotImplementedError
+
+    async def aread(self, name, start=0, end=None):
+        """
+        Async read for ASGI responses. Each chunk is read in a worker thread
+        only once the previous one has been sent, so a slow client makes the
+        download wait instead of buffering.
+        """
+        chunks = self.read(name, start, end)
+        read_chunk = sync_to_async(next, thread_sensitive=False)
+        try:
+            while (chunk := await read_chunk(chunks, None)) is not None:
+                yield chunk
+        finally:
+            try:
+                chunks.close()
+            except ValueError:
+                # Cancelled (client gone) while a read was still running in
+                # its thread; the generator is closed when it is collected
+                pass
+
+    def write(self, name, chunks):
+        """Store an iterable of bytes under name"""
+        raise NotImplementedError
+
+    def delete(self, name):
+        """Delete name; deleting a missing name is not an error"""
+        raise NotImplementedError
+
+    def move(self, source, target):
+        raise NotImplementedError
+
+    def list(self, prefix, start_after=None):
+        """
+        Iterate over (name, size, modified) of everything stored under prefix,
+        in a stable order; start_after resumes after a previously seen name.
+        """
+        raise NotImplementedError
+
+    def path(self, name):
+        """Local filesystem path, only available on local drivers"""
+        raise NotImplementedError(f"{type(self).__name__} does not store files locally")
+
+    def create_multipart(self, name, size):
+        """Start a chunked upload and return its upload id"""
+        raise NotImplementedError
+
+    def write_part(self, name, upload_id, index, offset, stream, length):
+        """Copy up to length bytes of stream into part index; return the bytes copied"""
+        raise NotImplementedError
+
+    def complete_multipart(self, name, upload_id, parts):
+        raise NotImplementedError
+
+    def abort_multipart(self, name, upload_id):
+        raise NotImplementedError
+
+def copy_stream(stream, write, length):
+    """Copy up to length bytes from stream through write, returning the count"""
+    copied = 0
+    while copied < length:
+        data = stream.read(min(settings.UPLOAD_STREAM_BLOCK_SIZE, length - copied))
+        if not data:
+            break
+        write(data)
+        copied += len(data)
+    return copied
+
+class LocalStorage(BlobStorage):
+    def __init__(self, location=None):
+        self.location = location or settings.MEDIA_ROOT
+
+    def path(self, name):
+        return os.path.join(self.location, name)
+
+    def exists(self, name):
+        return os.path.isfile(self.path(name))
+
+    def size(self, name):
+        return os.path.getsize(self.path(name))
+
+    def read(self, name, start=0, end=None):
+        with open(self.path(name), 'rb') as f:
+            f.seek(start)
+            remaining = None if end is None else end - start + 1
+            while remaining is None or remaining > 0:
+                block = settings.DOWNLOAD_CHUNK_SIZE
+                data = f.read(block if remaining is None else min(block, remaining))
+                if not data:
+                    break
+                if remaining is not None:
+                    remaining -= len(data)
+                yield data
+
+    def write(self, name, chunks):
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write next to the target and rename so readers never see partial data
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def delete(self, name):
+        try:
+            os.remove(self.path(name))
+        except FileNotFoundError:
+            pass
+
+    def move(self, source, target):
+        os.makedirs(os.path.dirname(self.path(target)), exist_ok=True)
+        os.replace(self.path(source), self.path(target))
+
+    def list(self, prefix, start_after=None):
+        # Walk in sorted order, comparing path components so a resumed walk
+        # can prune every directory that sorts before start_after
+        after = start_after.split('/') if start_after else None
+        for root, dirnames, filenames in os.walk(self.path(prefix)):
+            parts = os.path.relpath(root, self.location).replace(os.sep, '/').split('/')
+            dirnames[:] = sorted(
+                d for d in dirnames
+                if after is None or parts + [d] >= after[:len(parts) + 1]
+            )
+            for filename in sorted(filenames):
+                if after is not None and parts + [filename] <= after:
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, filename))
+                except FileNotFoundError:
+                    continue
+                modified = datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+                yield '/'.join(parts + [filename]), stat.st_size, modified
+
+    def create_multipart(self, name, size):
+        # Chunks are written in place into a sparse file of the final size
+        path = self.path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.truncate(size)
+        return ''
+
+    def write_part(self, name, upload_id, index, offset, stream, length):
+        with open(self.path(name), 'r+b') as f:
+            f.seek(offset)
+            return copy_stream(stream, f.write, length)
+
+    def complete_multipart(self, name, upload_id, parts):
+        pass
+
+    def abort_multipart(self, name, upload_id):
+        self.delete(name)
+
+class IterableReader(io.RawIOBase):
+    """Read-only file object over an iterable of bytes"""
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.pending = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            try:
+                self.pending = next(self.chunks)
+            except StopIteration:
+                return 0
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+class S3Storage(BlobStorage):
+    """
+    Driver for S3-compatible object stores (AWS S3, MinIO, Ceph RGW, ...).
+    Chunked uploads map onto S3 multipart uploads, one part per chunk.
+    """
+    min_part_size = 5 * 1024 * 1024
+
+    def __init__(self, bucket=None, endpoint_url=None, access_key_id=None,
+                 secret_access_key=None, region=None):
+        try:
+            import boto3
+        except ImportError:
+            raise ImproperlyConfigured("S3Storage requires boto3 (pip install boto3)")
+        config = settings.S3_STORAGE
+        self.bucket = bucket or config['BUCKET']
+        self.client = boto3.client(
+            's3',
+            endpoint_url=endpoint_url or config['ENDPOINT_URL'],
+            aws_access_key_id=access_key_id or config['ACCESS_KEY_ID'],
+            aws_secret_access_key=secret_access_key or config['SECRET_ACCESS_KEY'],
+            region_name=region or config['REGION'],
+        )
+
+    def head(self, name):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=name)
+        except ClientError as e:
+            if e.response['Error']['Code'] in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def exists(self, name):
+        return self.head(name) is not None
+
+    def size(self, name):
+        head = self.head(name)
+        if head is None:
+            raise FileNotFoundError(name)
+        return head['ContentLength']
+
+    def read(self, name, start=0, end=None):
+        if end is not None and end < start:
+            return
+        byte_range = f'bytes={start}-' if end is None else f'bytes={start}-{end}'
+        body = self.client.get_object(Bucket=self.bucket, Key=name, Range=byte_range)['Body']
+        try:
+            yield from body.iter_chunks(settings.DOWNLOAD_CHUNK_SIZE)
+        finally:
+            body.close()
+
+    def write(self, name, chunks):
+        # Managed transfer: switches to multipart for large bodies
+        self.client.upload_fileobj(io.BufferedReader(IterableReader(chunks)), self.bucket, name)
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=name)
+
+    def move(self, source, target):
+        self.client.copy({'Bucket': self.bucket, 'Key': source}, self.bucket, target)
+        self.delete(source)
+
+    def list(self, prefix, start_after=None):
+        paginator = self.client.get_paginator('list_objects_v2')
+        params = {'Bucket': self.bucket, 'Prefix': prefix.rstrip('/') + '/'}
+        if start_after:
+            params['StartAfter'] = start_after
+        for page in paginator.paginate(**params):
+            for item in page.get('Contents', []):
+                yield item['Key'], item['Size'], item['LastModified']
+
+    def create_multipart(self, name, size):
+        return self.client.create_multipart_upload(Bucket=self.bucket, Key=name)['UploadId']
+
+    def write_part(self, name, upload_id, index, offset, stream, length):
+        # Parts need a known length and a seekable body for retries, so the
+        # chunk is spooled (in memory when small) before it is sent
+        with tempfile.SpooledTemporaryFile(max_size=settings.UPLOAD_STREAM_BLOCK_SIZE * 16) as spool:
+            copied = copy_stream(stream, spool.write, length)
+            if copied != length:
+                return copied
+            spool.seek(0)
+            self.client.upload_part(
+                Bucket=self.bucket, Key=name, UploadId=upload_id,
+                PartNumber=index + 1, Body=spool, ContentLength=length
+            )
+        return copied
+
+    def complete_multipart(self, name, upload_id, parts):
+        uploaded = []
+        paginator = self.client.get_paginator('list_parts')
+        for page in paginator.paginate(Bucket=self.bucket, Key=name, UploadId=upload_id):
+            uploaded.extend(
+                {'PartNumber': part['PartNumber'], 'ETag': part['ETag']}
+                for part in page.get('Parts', [])
+            )
+        if len(uploaded) != parts:
+            raise ValueError(f"Expected {parts} uploaded parts, found {len(uploaded)}")
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket, Key=name, UploadId=upload_id,
+            MultipartUpload={'Parts': uploaded}
+        )
+
+    def abort_multipart(self, name, upload_id):
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=name, UploadId=upload_id)
+
+@lru_cache(maxsize=None)
+def get_storage():
+    """The configured storage driver, shared by the whole process"""
+    return import_string(settings.FILE_STORAGE_BACKEND)()
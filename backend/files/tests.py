@@ -0,0 +1,1165 @@
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from io import StringIO
+import uuid
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import sync_to_async
+from botocore.response import StreamingBody
+from botocore.stub import ANY, Stubber
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.db.models import Q
+from django.core.management import call_command
+from django.test import AsyncRequestFactory, Client, LiveServerTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import async_views
+from .access import access_buffer
+from .dedup import dedupe_file, dedupe_queue
+from .encoders import RowEncoder
+from .link_cache import get_link_cache
+from .management.commands.collect_garbage import Command as CollectGarbage
+from .metrics import Metrics, metrics
+from .models import (
+    Blob, File, FileShareStats, OwnerShareStats, ShareableLink, UploadSession, get_blob_path, get_upload_path,
+)
+from .query_budget import QueryBudget, duplicate_queries
+from .rollups import links_created
+from .serializers import FileSerializer
+from .share_tokens import InvalidShareToken, make_signed_token, read_claims
+from .storage import S3Storage, get_storage
+from .throttling import CacheRateLimiter, get_rate_limiter
+from .token_index import ShareTokenIndex
+
+User = get_user_model()
+
+class MediaRootMixin:
+    """Files written by a test go to a temporary MEDIA_ROOT"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_override = override_settings(MEDIA_ROOT=cls.media_root)
+        cls.media_override.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_override.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+def owner_client(email='owner@example.com'):
+    user = User.objects.create_user(email=email, password='Test-password-1')
+    client = APIClient()
+    client.force_authenticate(user)
+    return user, client
+
+def bearer_client(user):
+    client = Client(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+    # Budgets are for returning users, whose token and snapshot are cached
+    client.get('/api/users/profile/')
+    return client
+
+class QueryBudgetMixin:
+    """
+    Query counts are exact and include JWT authentication (none once the
+    user's token and snapshot are cached). Change a budget only together
+    with the change that needs the extra queries.
+    """
+
+    def assertQueryBudget(self, budget, client, method, path, status, **kwargs):
+        with self.assertNumQueries(budget), QueryBudget() as captured:
+            response = getattr(client, method)(path, **kwargs)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, status)
+        # The same query shape twice is an N+1
+        self.assertEqual(duplicate_queries(captured.queries, 2), [])
+        return response
+
+class FileListTests(TestCase):
+    def setUp(self):
+        self.owner, self.client = owner_client()
+        for i, filename in enumerate(['a.txt', 'résumé "final".pdf', 'b' * 255]):
+            File.objects.create(
+                filename=filename, file=f'encrypted_files/{i}.bin', encryption_key='a2V5',
+                size=i * 1000, mime_type='text/plain', owner=self.owner,
+            )
+        self.files = File.objects.filter(owner=self.owner).order_by('-uploaded_at', '-id')
+
+    def test_encoded_rows_render_like_file_serializer(self):
+        encoder = RowEncoder(FileSerializer)
+        renderer = JSONRenderer()
+        for tz in ('UTC', 'America/New_York'):
+            with self.subTest(tz=tz), timezone.override(tz):
+                self.assertEqual(
+                    renderer.render(encoder.encode_many(self.files.values(*encoder.columns))),
+                    renderer.render(FileSerializer(self.files, many=True).data),
+                )
+
+    def test_list_pages_match_file_serializer(self):
+        response = self.client.get('/api/files/', {'page_size': 2})
+        results = response.json()['results']
+        results += self.client.get(response.json()['next']).json()['results']
+        expected = FileSerializer(self.files, many=True).data
+        self.assertEqual(results, json.loads(JSONRenderer().render(expected)))
+
+class BulkShareTests(TestCase):
+    def setUp(self):
+        self.owner, self.client = owner_client()
+        self.files = [
+            File.objects.create(
+                filename=f'{i}.txt', file=f'encrypted_files/{i}.bin', encryption_key='a2V5',
+                size=1, mime_type='text/plain', owner=self.owner,
+            )
+            for i in range(2)
+        ]
+        self.guests = [
+            User.objects.create_user(email=f'guest-{i}@example.com', password='Test-password-1', role='guest')
+            for i in range(2)
+        ]
+
+    def bulk_share(self, file_ids, guest_ids=None):
+        data = {'fileIds': [str(file_id) for file_id in file_ids], 'permissions': 'download', 'expiresIn': 1}
+        if guest_ids is not None:
+            data['guestUserIds'] = guest_ids
+        return self.client.post('/api/files/share/bulk/', data, format='json')
+
+    def test_one_link_per_file_and_guest(self):
+        response = self.bulk_share([file.id for file in self.files], [guest.id for guest in self.guests])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.data['created'], response.data['failed']), (4, 0))
+        pairs = {(result['fileId'], result['guestUserId']): result['token'] for result in response.data['results']}
+        links = ShareableLink.objects.filter(created_by=self.owner)
+        self.assertEqual(
+            {(str(link.file_id), link.guest_user_id): link.token for link in links}, pairs,
+        )
+        self.assertEqual(FileShareStats.objects.get(file=self.files[0]).link_count, 2)
+        self.assertEqual(OwnerShareStats.objects.get(owner=self.owner).link_count, 4)
+
+    def test_stats_count_expired_links_until_they_are_deleted(self):
+        self.bulk_share([self.files[0].id], [guest.id for guest in self.guests])
+        ShareableLink.objects.filter(guest_user=self.guests[0]).update(expires_at=timezone.now() - timedelta(hours=1))
+        response = self.client.get(f'/api/files/{self.files[0].id}/stats/')
+        self.assertEqual(response.data['link_count'], 2)
+        call_command('collect_garbage', phase=['links'], state_file=os.devnull, stdout=StringIO())
+        response = self.client.get(f'/api/files/{self.files[0].id}/stats/')
+        self.assertEqual(response.data['link_count'], 1)
+
+    def test_other_users_files_and_non_guests_are_reported_per_item(self):
+        other = User.objects.create_user(email='other@example.com', password='Test-password-1')
+        others_file = File.objects.create(
+            filename='x.txt', file='encrypted_files/x.bin', encryption_key='a2V5',
+            size=1, mime_type='text/plain', owner=other,
+        )
+        response = self.bulk_share([self.files[0].id, others_file.id], [self.guests[0].id, self.owner.id])
+        self.assertEqual(response.status_code, 201)
+        errors = {
+            (result['fileId'], result['guestUserId']): result.get('error')
+            for result in response.data['results']
+        }
+        self.assertEqual(errors, {
+            (str(self.files[0].id), self.guests[0].id): None,
+            (str(self.files[0].id), self.owner.id): 'Guest user not found',
+            (str(others_file.id), self.guests[0].id): 'File not found',
+            (str(others_file.id), self.owner.id): 'File not found',
+        })
+        self.assertEqual(ShareableLink.objects.count(), 1)
+        self.assertFalse(FileShareStats.objects.filter(file=others_file).exists())
+
+    def test_nothing_to_create_is_a_bad_request(self):
+        response = self.bulk_share([uuid.uuid4()])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['results'][0]['error'], 'File not found')
+
+    @override_settings(MAX_BULK_SHARE_LINKS=3)
+    def test_calls_are_capped_at_max_bulk_share_links(self):
+        response = self.bulk_share([file.id for file in self.files], [guest.id for guest in self.guests])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ShareableLink.objects.exists())
+
+def hot_queries():
+    """(description, queryset, index expected in its plan) for each hot query shape"""
+    now = timezone.now()
+    file_id = uuid.uuid4()
+    return [
+        ("file listing", File.objects.filter(owner_id=1).order_by('-uploaded_at', '-id'),
+         'file_owner_uploaded_idx'),
+        ("file listing, later page",
+         File.objects.filter(owner_id=1)
+         .filter(Q(uploaded_at__lt=now) | Q(uploaded_at=now, id__lt=file_id))
+         .order_by('-uploaded_at', '-id'),
+         'file_owner_uploaded_idx'),
+        ("garbage collection: files by storage name", File.objects.filter(file__in=['a', 'b']),
+         'file_file_idx'),
+        ("blob reference counts", File.objects.filter(sha256__in=['a', 'b']).exclude(sha256=''),
+         'file_sha256_idx'),
+        ("links of a file", ShareableLink.objects.filter(file_id=file_id).order_by('-created_at'),
+         'link_file_created_idx'),
+        ("links created by a user", ShareableLink.objects.filter(created_by_id=1).order_by('-created_at'),
+         'link_creator_created_idx'),
+        ("links shared with a guest", ShareableLink.objects.filter(guest_user_id=1).order_by('-created_at'),
+         'link_guest_created_idx'),
+        ("expired links", ShareableLink.objects.filter(expires_at__lt=now).order_by('expires_at'),
+         'link_expires_idx'),
+        ("share token index sync", ShareableLink.objects.filter(created_at__gte=now).values_list('token', 'created_at'),
+         'link_created_idx'),
+        ("expired uploads", UploadSession.objects.filter(expires_at__lt=now).order_by('expires_at'),
+         'upload_expires_idx'),
+    ]
+
+class QueryPlanTests(TestCase):
+    def test_hot_queries_use_their_index(self):
+        if connection.vendor == 'postgresql':
+            # Small tables make sequential scans cheapest; ask whether the
+            # index is usable at all, as it must be at production sizes
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        for description, queryset, index in hot_queries():
+            with self.subTest(description):
+                self.assertIn(index, queryset.explain())
+
+@override_settings(SHARE_ACCESS_FLUSH_INTERVAL=0)
+class SharedAccessTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(email='owner@example.com', password='Test-password-1')
+        self.guest = User.objects.create_user(email='guest@example.com', password='Test-password-1', role='guest')
+        self.client = APIClient()
+        self.client.force_authenticate(self.guest)
+        storage = get_storage()
+        self.tokens = []
+        for i in range(2):
+            name = get_upload_path(self.owner, f'{i}.txt')
+            storage.write(name, [b'shared'])
+            file = File.objects.create(
+                filename=f'{i}.txt', file=name, encryption_key='a2V5',
+                size=6, mime_type='text/plain', owner=self.owner,
+            )
+            self.tokens.append(ShareableLink.objects.create(
+                token=uuid.uuid4().hex, file=file, permissions='download',
+                expires_at=timezone.now() + timedelta(hours=1), created_by=self.owner, guest_user=self.guest,
+            ).token)
+        links_created(ShareableLink.objects.values_list('file_id', 'created_by_id'))
+
+    def assertAccesses(self, *counts):
+        links = ShareableLink.objects.in_bulk(self.tokens, field_name='token')
+        self.assertEqual([links[token].access_count for token in self.tokens], list(counts))
+        for token in self.tokens:
+            if links[token].access_count:
+                self.assertEqual(links[token].accessed_by_id, self.guest.id)
+        self.assertEqual(OwnerShareStats.objects.get(owner=self.owner).total_accesses, sum(counts))
+
+    def test_shared_download_is_recorded(self):
+        response = self.client.get('/api/files/shared-file/download/', {'token': self.tokens[0]})
+        self.assertEqual(b''.join(response.streaming_content), b'shared')
+        self.assertAccesses(1, 0)
+
+    def test_shared_archive_records_each_link_once(self):
+        response = self.client.post(
+            '/api/files/shared-file/archive/', {'tokens': self.tokens + [self.tokens[0]]}, format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertAccesses(1, 1)
+
+    def test_refused_shared_download_is_not_recorded(self):
+        self.client.force_authenticate(self.owner)
+        response = self.client.get('/api/files/shared-file/download/', {'token': self.tokens[0]})
+        self.assertEqual(response.status_code, 403)
+        self.assertAccesses(0, 0)
+
+    async def test_async_shared_download_is_recorded(self):
+        access_token = RefreshToken.for_user(self.guest).access_token
+        request = AsyncRequestFactory().get(
+            '/api/files/shared-file/download/', {'token': self.tokens[1]},
+            headers={'Authorization': f'Bearer {access_token}'},
+        )
+        response = await async_views.download_shared_file(request)
+        self.assertEqual(response.status_code, 200)
+        await sync_to_async(self.assertAccesses)(0, 1)
+
+@override_settings(SHARE_LINK_CACHE=dict(settings.SHARE_LINK_CACHE, TIMEOUT=60))
+class ShareLinkCacheTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(email='owner@example.com', password='Test-password-1')
+        guest = User.objects.create_user(email='guest@example.com', password='Test-password-1', role='guest')
+        self.client = APIClient()
+        self.client.force_authenticate(guest)
+        name = get_upload_path(self.owner, 'a.txt')
+        get_storage().write(name, [b'shared'])
+        self.file = File.objects.create(
+            filename='a.txt', file=name, encryption_key='a2V5',
+            size=6, mime_type='text/plain', owner=self.owner,
+        )
+        self.link = ShareableLink.objects.create(
+            token=uuid.uuid4().hex, file=self.file, permissions='download',
+            expires_at=timezone.now() + timedelta(hours=1), created_by=self.owner, guest_user=guest,
+        )
+        self.token = self.link.token
+
+    def tearDown(self):
+        access_buffer.flush()
+
+    def shared_file(self):
+        return self.client.get('/api/files/shared-file/', {'token': self.token})
+
+    def test_cached_records_leave_out_the_encryption_key(self):
+        self.assertEqual(self.shared_file().status_code, 200)
+        self.assertIsNone(get_link_cache().get(self.token).encryption_key)
+        # Loaded when the download is served
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/files/shared-file/download/', {'token': self.token})
+        self.assertEqual(response['x-encryption-key'], 'a2V5')
+        self.assertEqual(b''.join(response.streaming_content), b'shared')
+
+    def test_deleted_link_is_invalidated(self):
+        self.assertEqual(self.shared_file().status_code, 200)
+        self.link.delete()
+        self.assertIsNone(get_link_cache().get(self.token))
+        self.assertEqual(self.shared_file().status_code, 404)
+
+    def test_edited_link_is_invalidated(self):
+        self.assertEqual(self.shared_file().status_code, 200)
+        self.link.expires_at = timezone.now() - timedelta(minutes=1)
+        self.link.save()
+        self.assertEqual(self.shared_file().status_code, 403)
+
+    def test_edited_file_invalidates_its_links(self):
+        self.assertEqual(self.shared_file().data['filename'], 'a.txt')
+        self.file.filename = 'b.txt'
+        self.file.save()
+        self.assertEqual(self.shared_file().data['filename'], 'b.txt')
+
+@override_settings(SHARE_TOKEN_INDEX=dict(settings.SHARE_TOKEN_INDEX, ENABLED=True, CACHE_ALIAS=''))
+class ShareTokenIndexTests(TestCase):
+    def test_lookups_go_to_the_database_while_the_filter_builds(self):
+        index = ShareTokenIndex()
+        ready = threading.Event()
+        build = index.build
+
+        def slow_build():
+            ready.wait(5)
+            return build()
+
+        with mock.patch.object(index, 'build', slow_build):
+            self.assertTrue(index.may_contain('unknown'))
+            self.assertIsNone(index.filter)
+            ready.set()
+            index.rebuilder.join(5)
+        self.assertIsNotNone(index.filter)
+        self.assertFalse(index.may_contain('unknown'))
+
+class RangeDownloadTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        self.owner, self.client = owner_client()
+        name = get_upload_path(self.owner, 'a.txt')
+        get_storage().write(name, [b'0123456789'])
+        self.file = File.objects.create(
+            filename='a.txt', file=name, encryption_key='a2V5',
+            size=10, mime_type='text/plain', owner=self.owner,
+        )
+        self.url = f'/api/files/{self.file.id}/download/'
+
+    def get_range(self, if_range):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-4', HTTP_IF_RANGE=if_range)
+        return response.status_code, b''.join(response.streaming_content)
+
+    def test_if_range_date_must_equal_last_modified(self):
+        last_modified = self.client.get(self.url)['Last-Modified']
+        self.assertEqual(self.get_range(last_modified), (206, b'234'))
+        later = http_date(self.file.updated_at.timestamp() + 60)
+        self.assertEqual(self.get_range(later), (200, b'0123456789'))
+
+    def test_if_range_etag_must_match(self):
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.get_range(etag), (206, b'234'))
+        self.assertEqual(self.get_range('"other"'), (200, b'0123456789'))
+
+class FileDeliveryTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        self.owner, self.client = owner_client()
+        name = get_upload_path(self.owner, 'a b.txt')
+        get_storage().write(name, [b'0123456789'])
+        self.file = File.objects.create(
+            filename='a b.txt', file=name, encryption_key='a2V5',
+            size=10, mime_type='text/plain', owner=self.owner,
+        )
+        self.url = f'/api/files/{self.file.id}/download/'
+
+    def assertOffloaded(self, response):
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.streaming)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['x-encryption-key'], 'a2V5')
+        self.assertIn('attachment', response['Content-Disposition'])
+
+    @override_settings(FILE_DELIVERY_BACKEND='nginx', FILE_DELIVERY_INTERNAL_URL='/protected-media/')
+    def test_nginx_gets_an_internal_redirect(self):
+        response = self.client.get(self.url)
+        self.assertOffloaded(response)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{self.file.file.name}')
+        self.assertNotIn('X-Sendfile', response)
+
+    @override_settings(FILE_DELIVERY_BACKEND='sendfile')
+    def test_sendfile_gets_the_absolute_path(self):
+        # Ranges are left to the server too
+        response = self.client.get(self.url, HTTP_RANGE='bytes=2-4')
+        self.assertOffloaded(response)
+        self.assertEqual(response['X-Sendfile'], get_storage().path(self.file.file.name))
+        self.assertNotIn('X-Accel-Redirect', response)
+
+    @override_settings(FILE_DELIVERY_BACKEND='python')
+    def test_python_streams_the_body(self):
+        response = self.client.get(self.url)
+        self.assertTrue(response.streaming)
+        self.assertEqual(b''.join(response.streaming_content), b'0123456789')
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertNotIn('X-Sendfile', response)
+
+class UploadSessionTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        self.owner, self.client = owner_client()
+
+    def start_upload(self, size=10, chunk_size=4, filename='a.txt'):
+        response = self.client.post('/api/files/uploads/', {
+            'filename': filename, 'size': size, 'mime_type': 'text/plain',
+            'encryption_key': 'a2V5', 'chunk_size': chunk_size,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return f"/api/files/uploads/{response.data['id']}/"
+
+    def put_chunk(self, upload, index, data):
+        return self.client.put(f'{upload}chunks/{index}/', data=data, content_type='application/octet-stream')
+
+    def download(self, file_id):
+        response = self.client.get(f'/api/files/{file_id}/download/')
+        return b''.join(response.streaming_content)
+
+    def test_chunks_in_any_order_commit_to_a_file(self):
+        upload = self.start_upload()
+        for index, data in ((2, b'89'), (0, b'0123'), (1, b'4567')):
+            self.assertEqual(self.put_chunk(upload, index, data).status_code, 200)
+        response = self.client.post(f'{upload}commit/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.download(response.data['id']), b'0123456789')
+
+    def test_failed_resend_of_a_received_chunk_must_be_sent_again(self):
+        upload = self.start_upload()
+        for index, data in ((0, b'0123'), (1, b'4567'), (2, b'89')):
+            self.put_chunk(upload, index, data)
+
+        self.assertEqual(self.put_chunk(upload, 1, b'XY').status_code, 400)
+        response = self.client.post(f'{upload}commit/')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['missing_chunks'], [1])
+
+        self.put_chunk(upload, 1, b'4567')
+        response = self.client.post(f'{upload}commit/')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.download(response.data['id']), b'0123456789')
+
+    def test_oversized_chunk_is_refused(self):
+        upload = self.start_upload()
+        self.assertEqual(self.put_chunk(upload, 2, b'89x').status_code, 400)
+        self.assertEqual(self.client.get(upload).data['received_chunks'], [])
+
+    def test_second_commit_of_a_session_finds_it_gone(self):
+        upload = self.start_upload(size=4)
+        self.put_chunk(upload, 0, b'0123')
+        stale = UploadSession.objects.get(owner=self.owner)
+        self.assertEqual(self.client.post(f'{upload}commit/').status_code, 201)
+        with self.assertRaises(UploadSession.DoesNotExist):
+            stale.commit()
+        self.assertEqual(File.objects.filter(owner=self.owner).count(), 1)
+
+    def test_long_dotless_filename_fits_the_storage_name(self):
+        filename = 'x' * 200
+        upload = self.start_upload(size=4, filename=filename)
+        self.put_chunk(upload, 0, b'0123')
+        response = self.client.post(f'{upload}commit/')
+        self.assertEqual(response.status_code, 201)
+        file = File.objects.get(pk=response.data['id'])
+        self.assertEqual(file.filename, filename)
+        self.assertLessEqual(len(file.file.name), File._meta.get_field('file').max_length)
+        self.assertEqual(os.path.dirname(file.file.name), f'encrypted_files/{self.owner.id}')
+
+    def test_filename_with_a_path_is_refused(self):
+        for filename in ('a.x/../../b', 'dir\\a.txt', '..'):
+            with self.subTest(filename=filename):
+                response = self.client.post('/api/files/uploads/', {
+                    'filename': filename, 'size': 4, 'mime_type': 'text/plain', 'encryption_key': 'a2V5',
+                }, format='json')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('filename', response.data)
+
+    def test_storage_names_keep_only_a_short_extension(self):
+        for filename, ext in (('a.txt', '.txt'), ('a.b/c', ''), ('a.' + 'z' * 40, '.' + 'z' * 16), ('a.p\\hp', '')):
+            with self.subTest(filename=filename):
+                name = get_upload_path(self.owner, filename)
+                self.assertEqual(os.path.dirname(name), f'encrypted_files/{self.owner.id}')
+                self.assertEqual(os.path.splitext(name)[1], ext)
+
+    def test_put_is_only_allowed_for_chunks(self):
+        file = File.objects.create(
+            filename='a.txt', file='encrypted_files/a.txt', encryption_key='a2V5',
+            size=1, mime_type='text/plain', owner=self.owner,
+        )
+        response = self.client.put(f'/api/files/{file.id}/', {
+            'filename': 'b.txt', 'size': 2, 'mime_type': 'text/html',
+        }, format='json')
+        self.assertEqual(response.status_code, 405)
+        file.refresh_from_db()
+        self.assertEqual((file.filename, file.size), ('a.txt', 1))
+
+class LoadTestCommandTests(MediaRootMixin, LiveServerTestCase):
+    def test_report_covers_every_scenario_and_seed_is_removed(self):
+        out = StringIO()
+        # One client at a time: the live server shares SQLite's in-memory test database
+        with override_settings(RATE_LIMITS=dict(settings.RATE_LIMITS, ENABLED=False)):
+            call_command(
+                'loadtest', base_url=self.live_server_url, users=2, files=3, links=3, file_size=64,
+                concurrency=1, requests=4, query_samples=2, stdout=out, stderr=StringIO(),
+            )
+        access_buffer.flush()
+        report = json.loads(out.getvalue())
+        self.assertEqual(report['seed'], {
+            'users': 2, 'files': 3, 'links': 3, 'file_size': 64, 'seconds': report['seed']['seconds'],
+        })
+        self.assertEqual(set(report['scenarios']), {
+            'login', 'list', 'upload', 'download', 'share', 'shared_file', 'shared_download',
+        })
+        for name, result in report['scenarios'].items():
+            with self.subTest(scenario=name):
+                self.assertEqual(result['errors'], 0)
+                self.assertEqual(sum(result['status_codes'].values()), 4)
+                self.assertLessEqual(result['latency_ms']['p50'], result['latency_ms']['p99'])
+                self.assertIsNotNone(result['db_queries_per_request'])
+        self.assertFalse(User.objects.filter(email__startswith='loadtest-').exists())
+        self.assertFalse(File.objects.exists())
+
+@override_settings(CONTENT_ADDRESSED_STORAGE=True)
+class BlobStoreTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        self.owner, self.client = owner_client()
+
+    def upload(self, content):
+        response = self.client.post('/api/files/', {
+            'file': SimpleUploadedFile('a.txt', content, content_type='text/plain'), 'encryption_key': 'a2V5',
+        })
+        self.assertEqual(response.status_code, 201)
+        return File.objects.get(pk=response.data['id'])
+
+    def chunked_upload(self, content):
+        response = self.client.post('/api/files/uploads/', {
+            'filename': 'a.txt', 'size': len(content), 'mime_type': 'text/plain', 'encryption_key': 'a2V5',
+        }, format='json')
+        upload = f"/api/files/uploads/{response.data['id']}/"
+        self.client.put(f'{upload}chunks/0/', data=content, content_type='application/octet-stream')
+        with mock.patch.object(dedupe_queue, 'submit') as submit, self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'{upload}commit/')
+        self.assertEqual(response.status_code, 201)
+        submit.assert_called_once_with(uuid.UUID(response.data['id']))
+        return File.objects.get(pk=response.data['id'])
+
+    def download(self, file):
+        response = self.client.get(f'/api/files/{file.id}/download/')
+        return b''.join(response.streaming_content)
+
+    def test_identical_uploads_share_one_blob(self):
+        first, second = self.upload(b'same bytes'), self.upload(b'same bytes')
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(first.file.name, get_blob_path(first.sha256))
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+        self.upload(b'other bytes')
+        self.assertEqual(Blob.objects.count(), 2)
+
+    def test_blob_is_deleted_with_its_last_file(self):
+        first, second = self.upload(b'same bytes'), self.upload(b'same bytes')
+        storage = get_storage()
+
+        self.assertEqual(self.client.delete(f'/api/files/{first.id}/').status_code, 204)
+        self.assertEqual(Blob.objects.get().ref_count, 1)
+        self.assertEqual(self.download(second), b'same bytes')
+
+        self.assertEqual(self.client.delete(f'/api/files/{second.id}/').status_code, 204)
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(storage.exists(second.file.name))
+
+    def test_committed_upload_is_deduplicated_after_the_request(self):
+        existing = self.upload(b'same bytes')
+        file = self.chunked_upload(b'same bytes')
+        upload_path = file.file.name
+        # Served from its upload path until the background thread runs
+        self.assertEqual(file.sha256, '')
+        self.assertEqual(self.download(file), b'same bytes')
+
+        self.assertTrue(dedupe_file(file.id))
+        file.refresh_from_db()
+        self.assertEqual(file.file.name, existing.file.name)
+        self.assertEqual(Blob.objects.get().ref_count, 2)
+        self.assertFalse(get_storage().exists(upload_path))
+        self.assertEqual(self.download(file), b'same bytes')
+        self.assertFalse(dedupe_file(file.id))
+
+    def test_new_content_is_moved_into_the_blob_store(self):
+        file = self.chunked_upload(b'new bytes')
+        self.assertTrue(dedupe_file(file.id))
+        file.refresh_from_db()
+        self.assertTrue(file.is_blob_backed)
+        self.assertEqual(Blob.objects.get(sha256=file.sha256).ref_count, 1)
+        self.assertEqual(self.download(file), b'new bytes')
+
+    def test_dedupe_files_catches_up_on_missed_uploads(self):
+        file = self.chunked_upload(b'new bytes')
+        call_command('dedupe_files', stdout=StringIO())
+        file.refresh_from_db()
+        self.assertTrue(file.is_blob_backed)
+
+class BenchCommandTests(TestCase):
+    def assertRolledBack(self, command, **options):
+        out = StringIO()
+        call_command(command, stdout=out, **options)
+        json.loads(out.getvalue())
+        self.assertFalse(User.objects.filter(email__startswith='bench-').exists())
+        self.assertFalse(File.objects.exists())
+        self.assertFalse(ShareableLink.objects.exists())
+
+    def test_seed_rows_are_rolled_back(self):
+        self.assertRolledBack('bench_file_list', rows=[10], repeat=1)
+        self.assertRolledBack('bench_token_index', tokens=1000, probes=100, db_rows=10)
+        with override_settings(RATE_LIMITS=dict(settings.RATE_LIMITS, ENABLED=False)):
+            self.assertRolledBack('bench_bulk_share', files=2, guests=2, single_sample=2)
+
+class CollectGarbageTests(MediaRootMixin, TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(email='owner@example.com', password='Test-password-1')
+        self.storage = get_storage()
+        self.state_file = os.path.join(self.media_root, 'gc', f'{uuid.uuid4()}.json')
+        # Each test walks storage from a clean slate
+        for prefix in ('encrypted_files', 'blobs'):
+            shutil.rmtree(self.storage.path(prefix), ignore_errors=True)
+
+    def store(self, name, content=b'bytes', age_hours=48):
+        self.storage.write(name, [content])
+        modified = (timezone.now() - timedelta(hours=age_hours)).timestamp()
+        os.utime(self.storage.path(name), (modified, modified))
+        return name
+
+    def create_file(self, name, sha256=''):
+        return File.objects.create(
+            filename='a.txt', file=name, encryption_key='a2V5', size=5,
+            mime_type='text/plain', owner=self.owner, sha256=sha256,
+        )
+
+    def create_blob(self, content, ref_count):
+        sha256 = hashlib.sha256(content).hexdigest()
+        self.store(get_blob_path(sha256), content)
+        Blob.objects.create(sha256=sha256, size=len(content), ref_count=ref_count)
+        return sha256
+
+    def collect(self, **options):
+        stdout = StringIO()
+        call_command('collect_garbage', state_file=self.state_file, stdout=stdout, **options)
+        return json.loads(stdout.getvalue())
+
+    def test_dry_run_deletes_nothing(self):
+        orphan = self.store('encrypted_files/orphan')
+        file = self.create_file(self.store('encrypted_files/kept'))
+        link = ShareableLink.objects.create(
+            token=uuid.uuid4().hex, file=file, expires_at=timezone.now() - timedelta(hours=1), created_by=self.owner,
+        )
+        session = UploadSession.objects.create(
+            owner=self.owner, filename='a.txt', path=self.store('encrypted_files/upload'), encryption_key='a2V5',
+            size=5, chunk_size=5, mime_type='text/plain', expires_at=timezone.now() - timedelta(hours=1),
+        )
+        unreferenced = self.create_blob(b'unreferenced', ref_count=1)
+
+        result = self.collect(dry_run=True)
+        self.assertEqual(result['metrics']['links']['expired'], 1)
+        self.assertEqual(result['metrics']['uploads']['expired'], 1)
+        self.assertEqual(result['metrics']['files']['orphaned'], 1)
+        self.assertEqual(result['metrics']['blob_refs']['mismatched'], 1)
+        self.assertTrue(ShareableLink.objects.filter(pk=link.pk).exists())
+        self.assertTrue(UploadSession.objects.filter(pk=session.pk).exists())
+        self.assertTrue(Blob.objects.filter(pk=unreferenced).exists())
+        for name in (orphan, file.file.name, session.path, get_blob_path(unreferenced)):
+            self.assertTrue(self.storage.exists(name))
+        self.assertFalse(os.path.exists(self.state_file))
+
+    def test_orphans_are_kept_during_the_grace_period(self):
+        old = self.store('encrypted_files/old')
+        new = self.store('encrypted_files/new', age_hours=1)
+        referenced = self.create_file(self.store('encrypted_files/referenced')).file.name
+
+        result = self.collect(phase=['files'])
+        self.assertEqual(result['metrics']['files'], {'examined': 3, 'orphaned': 1, 'orphaned_bytes': 5, 'deleted': 1, 'batches': 1})
+        self.assertFalse(self.storage.exists(old))
+        self.assertTrue(self.storage.exists(new))
+        self.assertTrue(self.storage.exists(referenced))
+
+        self.collect(phase=['files'], grace_hours=0)
+        self.assertFalse(self.storage.exists(new))
+        self.assertTrue(self.storage.exists(referenced))
+
+    def test_resumes_from_the_checkpoint(self):
+        orphans = [self.store(f'encrypted_files/{name}') for name in 'abc']
+
+        # Stopped after the first batch
+        first_batch = lambda command: command.metrics.get('files', {}).get('batches', 0) >= 1
+        with mock.patch.object(CollectGarbage, 'out_of_time', autospec=True, side_effect=first_batch):
+            result = self.collect(phase=['files'], batch_size=1)
+        self.assertFalse(result['completed'])
+        self.assertEqual([self.storage.exists(name) for name in orphans], [False, True, True])
+        with open(self.state_file) as f:
+            self.assertEqual(json.load(f), {'files': orphans[0]})
+
+        result = self.collect(phase=['files'], batch_size=1)
+        self.assertTrue(result['completed'])
+        self.assertEqual(result['metrics']['files']['examined'], 2)
+        self.assertFalse(any(self.storage.exists(name) for name in orphans))
+        # A finished pass starts over next time
+        with open(self.state_file) as f:
+            self.assertEqual(json.load(f), {})
+
+    def test_blobs_with_live_references_are_kept(self):
+        miscounted = self.create_blob(b'miscounted', ref_count=3)
+        self.create_file(get_blob_path(miscounted), sha256=miscounted)
+        shared = self.create_blob(b'shared', ref_count=2)
+        for _ in range(2):
+            self.create_file(get_blob_path(shared), sha256=shared)
+        unreferenced = self.create_blob(b'unreferenced', ref_count=1)
+        untracked = self.store(get_blob_path(hashlib.sha256(b'untracked').hexdigest()))
+
+        result = self.collect(phase=['blobs', 'blob_refs'], grace_hours=0)
+        self.assertEqual(result['metrics']['blobs']['deleted'], 1)
+        self.assertEqual(result['metrics']['blob_refs'], {'examined': 3, 'mismatched': 2, 'corrected': 1, 'deleted': 1, 'batches': 1})
+        self.assertEqual(dict(Blob.objects.values_list('sha256', 'ref_count')), {miscounted: 1, shared: 2})
+        self.assertTrue(self.storage.exists(get_blob_path(miscounted)))
+        self.assertTrue(self.storage.exists(get_blob_path(shared)))
+        self.assertFalse(self.storage.exists(get_blob_path(unreferenced)))
+        self.assertFalse(self.storage.exists(untracked))
+
+class MetricsTests(TestCase):
+    def setUp(self):
+        self.owner, self.client = owner_client()
+
+    def requests_counted(self, view, status='200'):
+        key = ('http_requests_total', (('view', view), ('method', 'GET'), ('status', status)))
+        return metrics.snapshot().get(key, 0)
+
+    def test_middleware_counts_requests_by_view(self):
+        before = self.requests_counted('list')
+        histogram = ('db_queries_per_request', (('view', 'list'),))
+        observed = sum(metrics.snapshot().get(histogram, [0])[:-1])
+        for _ in range(2):
+            self.assertEqual(self.client.get('/api/files/').status_code, 200)
+        self.assertEqual(self.requests_counted('list'), before + 2)
+        self.assertEqual(sum(metrics.snapshot()[histogram][:-1]), observed + 2)
+
+    @override_settings(METRICS_TOKEN='scrape-token')
+    def test_metrics_output(self):
+        self.client.get('/api/files/')
+        self.assertEqual(self.client.get('/metrics').status_code, 401)
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        lines = response.content.decode().splitlines()
+        self.assertIn('# TYPE http_requests_total counter', lines)
+        self.assertIn(f'http_requests_total{{view="list",method="GET",status="200"}} {self.requests_counted("list")}', lines)
+        self.assertIn('# TYPE http_request_duration_seconds histogram', lines)
+        self.assertTrue(any(line.startswith('http_request_duration_seconds_bucket{view="list",le="+Inf"}') for line in lines))
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_metrics_are_closed_without_a_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        with self.settings(METRICS_PUBLIC=True):
+            self.assertEqual(self.client.get('/metrics').status_code, 200)
+
+    def test_exited_threads_are_folded_into_one_total(self):
+        recorder = Metrics()
+        for _ in range(5):
+            thread = threading.Thread(target=recorder.inc, args=('http_requests_total',))
+            thread.start()
+            thread.join()
+        recorder.observe('db_queries_per_request', (), 1)
+        self.assertEqual(len(recorder.shards), 1)
+        self.assertEqual(recorder.snapshot()[('http_requests_total', ())], 5)
+        self.assertEqual(recorder.snapshot()[('db_queries_per_request', ())][-1], 1)
+
+class S3StorageTests(TestCase):
+    """The S3 driver's calls, against a stubbed client"""
+
+    def setUp(self):
+        self.storage = S3Storage(bucket='files', access_key_id='key', secret_access_key='secret', region='us-east-1')
+        self.stubber = Stubber(self.storage.client)
+        self.stubber.activate()
+        self.addCleanup(self.stubber.deactivate)
+        self.key = {'Bucket': 'files', 'Key': 'encrypted_files/1/a.bin'}
+        self.upload = dict(self.key, UploadId='upload-1')
+
+    def tearDown(self):
+        self.stubber.assert_no_pending_responses()
+
+    def test_multipart_upload(self):
+        self.stubber.add_response('create_multipart_upload', self.upload, self.key)
+        for number, etag in ((1, '"a"'), (2, '"b"')):
+            self.stubber.add_response(
+                'upload_part', {'ETag': etag},
+                dict(self.upload, PartNumber=number, Body=ANY, ContentLength=3),
+            )
+        self.stubber.add_response('list_parts', {
+            'Parts': [{'PartNumber': 1, 'ETag': '"a"'}, {'PartNumber': 2, 'ETag': '"b"'}],
+        }, self.upload)
+        self.stubber.add_response('complete_multipart_upload', {}, dict(self.upload, MultipartUpload={
+            'Parts': [{'PartNumber': 1, 'ETag': '"a"'}, {'PartNumber': 2, 'ETag': '"b"'}],
+        }))
+
+        upload_id = self.storage.create_multipart(self.key['Key'], 6)
+        self.assertEqual(upload_id, 'upload-1')
+        stream = io.BytesIO(b'abcdef')
+        for index in range(2):
+            self.assertEqual(self.storage.write_part(self.key['Key'], upload_id, index, index * 3, stream, 3), 3)
+        self.storage.complete_multipart(self.key['Key'], upload_id, 2)
+
+    def test_short_part_is_not_sent(self):
+        self.assertEqual(self.storage.write_part(self.key['Key'], 'upload-1', 0, 0, io.BytesIO(b'ab'), 3), 2)
+
+    def test_complete_refuses_missing_parts(self):
+        self.stubber.add_response('list_parts', {'Parts': [{'PartNumber': 1, 'ETag': '"a"'}]}, self.upload)
+        with self.assertRaises(ValueError):
+            self.storage.complete_multipart(self.key['Key'], 'upload-1', 2)
+
+    def test_abort_multipart(self):
+        self.stubber.add_response('abort_multipart_upload', {}, self.upload)
+        self.storage.abort_multipart(self.key['Key'], 'upload-1')
+
+    def test_read_range(self):
+        self.stubber.add_response(
+            'get_object', {'Body': StreamingBody(io.BytesIO(b'bcd'), 3)}, dict(self.key, Range='bytes=1-3'),
+        )
+        self.stubber.add_response(
+            'get_object', {'Body': StreamingBody(io.BytesIO(b'cdef'), 4)}, dict(self.key, Range='bytes=2-'),
+        )
+        self.assertEqual(b''.join(self.storage.read(self.key['Key'], 1, 3)), b'bcd')
+        self.assertEqual(b''.join(self.storage.read(self.key['Key'], 2)), b'cdef')
+        # An empty range makes no request
+        self.assertEqual(b''.join(self.storage.read(self.key['Key'], 3, 2)), b'')
+
+    def test_delete(self):
+        self.stubber.add_response('delete_object', {}, self.key)
+        self.storage.delete(self.key['Key'])
+
+    def test_exists(self):
+        self.stubber.add_response('head_object', {'ContentLength': 6}, self.key)
+        self.stubber.add_client_error('head_object', '404', expected_params=self.key)
+        self.assertTrue(self.storage.exists(self.key['Key']))
+        self.assertFalse(self.storage.exists(self.key['Key']))
+
+@override_settings(
+    SHARE_TOKEN_FORMAT='signed', SHARE_TOKEN_ACCEPT_UNSIGNED=True,
+    RATE_LIMITS=dict(settings.RATE_LIMITS, ENABLED=False),
+)
+class SignedShareTokenTests(TestCase):
+    def setUp(self):
+        self.owner, self.client = owner_client()
+        self.guest = User.objects.create_user(email='guest@example.com', password='Test-password-1', role='guest')
+        self.viewer = User.objects.create_user(email='viewer@example.com', password='Test-password-1', role='guest')
+        self.file = File.objects.create(
+            filename='a.txt', file='encrypted_files/a.bin', encryption_key='a2V5',
+            size=1, mime_type='text/plain', owner=self.owner,
+        )
+
+    def share(self, **data):
+        response = self.client.post(
+            f'/api/files/{self.file.id}/share/', dict({'permissions': 'view', 'expiresIn': 1}, **data), format='json',
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data['token']
+
+    def tearDown(self):
+        access_buffer.flush()
+
+    def shared_file(self, token, user=None):
+        client = APIClient()
+        client.force_authenticate(user or self.viewer)
+        return client.get('/api/files/shared-file/', {'token': token})
+
+    def assertRefusedWithoutLookup(self, token, status, user=None):
+        with self.assertNumQueries(0):
+            response = self.shared_file(token, user)
+        self.assertEqual(response.status_code, status)
+        return response
+
+    def test_signed_token_resolves_its_link(self):
+        token = self.share()
+        self.assertEqual(len(token), 64)
+        self.assertEqual(read_claims(token).file_id, self.file.id)
+        self.assertEqual(self.shared_file(token).data['filename'], 'a.txt')
+
+    def test_tampered_tokens_are_refused(self):
+        token = self.share()
+        for position in (10, 60):  # Payload and signature
+            with self.subTest(position=position):
+                flipped = 'A' if token[position] != 'A' else 'B'
+                self.assertRefusedWithoutLookup(token[:position] + flipped + token[position + 1:], 404)
+        self.assertRefusedWithoutLookup(make_signed_token(self.file.id, 'view', timezone.now())[:-1] + '!', 404)
+
+        forged = token[:60] + ('A' if token[60] != 'A' else 'B') + token[61:]
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        response = client.post('/api/files/shared-file/archive/', {'tokens': [token, forged]}, format='json')
+        self.assertEqual((response.status_code, response.data['tokens']), (404, [forged]))
+
+    def test_token_signed_with_another_key_is_refused(self):
+        with override_settings(SECRET_KEY='another-key'):
+            token = make_signed_token(self.file.id, 'view', timezone.now() + timedelta(hours=1))
+        with self.assertRaises(InvalidShareToken):
+            read_claims(token)
+        self.assertRefusedWithoutLookup(token, 404)
+
+    def test_expired_token_is_refused(self):
+        token = make_signed_token(self.file.id, 'download', timezone.now() - timedelta(seconds=1))
+        response = self.assertRefusedWithoutLookup(token, 403)
+        self.assertEqual(response.data['message'], 'This link has expired')
+
+    def test_guest_token_is_refused_to_anyone_else(self):
+        token = self.share(guestUserId=self.guest.id)
+        response = self.assertRefusedWithoutLookup(token, 403)
+        self.assertEqual(response.data['message'], 'This link is not shared with you')
+        self.assertEqual(self.shared_file(token, self.guest).status_code, 200)
+
+    def test_tokens_signed_with_a_rotated_key_still_verify(self):
+        with override_settings(SECRET_KEY='old-key'):
+            token = self.share()
+        with override_settings(SECRET_KEY='new-key', SECRET_KEY_FALLBACKS=['old-key']):
+            self.assertEqual(self.shared_file(token).status_code, 200)
+        with override_settings(SECRET_KEY='new-key', SECRET_KEY_FALLBACKS=[]):
+            self.assertRefusedWithoutLookup(token, 404)
+
+    def test_deleting_a_signed_link_revokes_it(self):
+        token = self.share()
+        self.assertEqual(self.client.delete(f'/api/files/{self.file.id}/').status_code, 204)
+        self.assertEqual(self.shared_file(token).status_code, 404)
+
+    def test_unsigned_tokens_are_looked_up_only_while_accepted(self):
+        with override_settings(SHARE_TOKEN_FORMAT='random'):
+            token = self.share()
+        self.assertNotEqual(len(token), 64)
+        self.assertEqual(self.shared_file(token).status_code, 200)
+        with override_settings(SHARE_TOKEN_ACCEPT_UNSIGNED=False):
+            self.assertRefusedWithoutLookup(token, 404)
+
+LIMITS = {
+    'ENABLED': True, 'BACKEND': 'files.throttling.LocalRateLimiter', 'OPTIONS': {},
+    'RATES': {'login_ip': '30/min', 'login_account': '2/min', 'share_ip': '30/min', 'share_token': '1/min'},
+}
+
+@override_settings(RATE_LIMITS=LIMITS)
+class RateLimitTests(TestCase):
+    def setUp(self):
+        # A limiter of its own, without other tests' buckets
+        get_rate_limiter.cache_clear()
+        self.addCleanup(get_rate_limiter.cache_clear)
+        self.owner, self.client = owner_client()
+        self.file = File.objects.create(
+            filename='a.txt', file='encrypted_files/a.bin', encryption_key='a2V5',
+            size=1, mime_type='text/plain', owner=self.owner,
+        )
+        expires_at = timezone.now() + timedelta(hours=1)
+        self.tokens = [
+            ShareableLink.objects.create(
+                token=uuid.uuid4().hex, file=self.file, expires_at=expires_at, created_by=self.owner,
+            ).token
+            for _ in range(2)
+        ]
+
+    def tearDown(self):
+        access_buffer.flush()
+
+    def assertThrottled(self, response, retry_after):
+        self.assertEqual(response.status_code, 429)
+        self.assertAlmostEqual(int(response['Retry-After']), retry_after, delta=1)
+
+    def test_login_is_limited_per_account(self):
+        login = lambda email: APIClient().post(
+            '/api/users/login/', {'email': email, 'password': 'wrong'}, format='json',
+        )
+        for _ in range(2):
+            self.assertEqual(login(self.owner.email).status_code, 401)
+        self.assertThrottled(login(self.owner.email), 30)
+        # Same address written differently
+        self.assertThrottled(login(self.owner.email.upper()), 30)
+        self.assertEqual(login('other@example.com').status_code, 401)
+
+    def test_shared_file_is_limited_per_token(self):
+        url = '/api/files/shared-file/'
+        self.assertEqual(self.client.get(url, {'token': self.tokens[0]}).status_code, 200)
+        self.assertThrottled(self.client.get(url, {'token': self.tokens[0]}), 60)
+        self.assertEqual(self.client.get(url, {'token': self.tokens[1]}).status_code, 200)
+
+    def test_shared_archive_is_limited_per_body_token(self):
+        self.client.get('/api/files/shared-file/', {'token': self.tokens[0]})
+        response = self.client.post('/api/files/shared-file/archive/', {'tokens': self.tokens}, format='json')
+        self.assertThrottled(response, 60)
+
+class CacheRateLimiterTests(TestCase):
+    def hit(self, limiter, now, times=1):
+        with mock.patch('files.throttling.time.time', return_value=now):
+            return [limiter.hit('key', 10, 60) for _ in range(times)]
+
+    def test_previous_window_is_weighted_by_its_overlap(self):
+        limiter = CacheRateLimiter(key_prefix=f'rate-limit-test:{uuid.uuid4().hex}:')
+        start = 600 * 60
+        results = self.hit(limiter, start, 11)
+        self.assertEqual([allowed for allowed, _ in results], [True] * 10 + [False])
+        self.assertAlmostEqual(results[-1][1], 60)
+
+        # Half-way through the next window 11 * 0.5 of the previous one count
+        results = self.hit(limiter, start + 90, 5)
+        self.assertEqual([allowed for allowed, _ in results], [True] * 4 + [False])
+        self.assertAlmostEqual(results[-1][1], 0.5 / 11 * 60)
+
+        # Once a whole window has passed, only the new one counts
+        self.assertEqual([allowed for allowed, _ in self.hit(limiter, start + 180, 10)], [True] * 10)
+
+# SQLite has no row locks, and its test database can't take concurrent writes
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentCommitTests(MediaRootMixin, TransactionTestCase):
+    def test_concurrent_commits_create_one_file(self):
+        owner, client = owner_client()
+        response = client.post('/api/files/uploads/', {
+            'filename': 'a.txt', 'size': 4, 'mime_type': 'text/plain', 'encryption_key': 'a2V5',
+        }, format='json')
+        upload = f"/api/files/uploads/{response.data['id']}/"
+        client.put(f'{upload}chunks/0/', data=b'0123', content_type='application/octet-stream')
+
+        sessions = [UploadSession.objects.get(pk=response.data['id']) for _ in range(2)]
+        results = []
+
+        def commit(session):
+            try:
+                results.append(session.commit())
+            except UploadSession.DoesNotExist:
+                results.append(None)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=commit, args=(session,)) for session in sessions]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(File.objects.filter(owner=owner).count(), 1)
+        self.assertEqual(sorted(result is None for result in results), [False, True])
+
+class FileQueryBudgetTests(QueryBudgetMixin, MediaRootMixin, TestCase):
+    rows = 5  # Seeded files and links; list endpoints must not scale with them
+
+    def setUp(self):
+        self.owner = User.objects.create_user(email='owner@example.com', password='Test-password-1')
+        self.guest = User.objects.create_user(email='guest@example.com', password='Test-password-1', role='guest')
+        storage = get_storage()
+        self.files = []
+        for i in range(self.rows):
+            name = get_upload_path(self.owner, f'budget-{i}.txt')
+            storage.write(name, [os.urandom(64)])
+            self.files.append(File.objects.create(
+                filename=f'budget-{i}.txt', file=name, encryption_key='a2V5',
+                size=64, mime_type='text/plain', owner=self.owner,
+            ))
+        expires_at = timezone.now() + timedelta(hours=1)
+        self.tokens = [
+            ShareableLink.objects.create(
+                token=uuid.uuid4().hex, file=file, permissions='download',
+                expires_at=expires_at, created_by=self.owner, guest_user=self.guest,
+            ).token
+            for file in self.files
+        ]
+        links_created([(file.id, self.owner.id) for file in self.files])
+        self.client = bearer_client(self.owner)
+
+    def tearDown(self):
+        # Written now, while the test database is still there
+        access_buffer.flush()
+
+    def test_file_actions(self):
+        file = self.files[0]
+        file_ids = [str(f.id) for f in self.files]
+        self.assertQueryBudget(1, self.client, 'get', '/api/files/', 200)
+        self.assertQueryBudget(1, self.client, 'post', '/api/files/', 201, data={
+            'file': SimpleUploadedFile('new.txt', os.urandom(64), content_type='text/plain'),
+            'encryption_key': 'a2V5',
+        })
+        self.assertQueryBudget(1, self.client, 'get', f'/api/files/{file.id}/', 200)
+        self.assertQueryBudget(
+            3, self.client, 'patch', f'/api/files/{file.id}/', 200,
+            data={'filename': 'renamed.txt'}, content_type='application/json',
+        )
+        self.assertQueryBudget(1, self.client, 'get', f'/api/files/{file.id}/download/', 200)
+        self.assertQueryBudget(
+            1, self.client, 'post', '/api/files/archive/', 200,
+            data={'fileIds': file_ids}, content_type='application/json',
+        )
+        self.assertQueryBudget(7, self.client, 'delete', f'/api/files/{self.files[-1].id}/', 204)
+
+    def test_sharing_actions(self):
+        file = self.files[0]
+        self.assertQueryBudget(
+            6, self.client, 'post', f'/api/files/{file.id}/share/', 201,
+            data={'permissions': 'download', 'expiresIn': 1}, content_type='application/json',
+        )
+        # One INSERT per batch of links (~99 on SQLite)
+        self.assertQueryBudget(7, self.client, 'post', '/api/files/share/bulk/', 201, data={
+            'fileIds': [str(f.id) for f in self.files] + [str(uuid.uuid4())],
+            'guestUserIds': [self.guest.id], 'permissions': 'download', 'expiresIn': 1,
+        }, content_type='application/json')
+        self.assertQueryBudget(2, self.client, 'get', f'/api/files/{file.id}/links/', 200)
+        self.assertQueryBudget(2, self.client, 'get', f'/api/files/{file.id}/stats/', 200)
+        self.assertQueryBudget(1, self.client, 'get', '/api/files/share-stats/', 200)
+
+    def test_shared_access_actions(self):
+        guest = bearer_client(self.guest)
+        self.assertQueryBudget(
+            1, guest, 'get', '/api/files/shared-file/', 200, data={'token': self.tokens[0]},
+        )
+        self.assertQueryBudget(
+            1, guest, 'get', '/api/files/shared-file/download/', 200, data={'token': self.tokens[1]},
+        )
+        self.assertQueryBudget(
+            1, guest, 'post', '/api/files/shared-file/archive/', 200,
+            data={'tokens': self.tokens[2:]}, content_type='application/json',
+        )
+
+    def test_upload_actions(self):
+        new_upload = {'size': 64, 'mime_type': 'text/plain', 'encryption_key': 'a2V5'}
+        response = self.assertQueryBudget(
+            2, self.client, 'post', '/api/files/uploads/', 201,
+            data=dict(new_upload, filename='chunked.txt'), content_type='application/json',
+        )
+        upload = f"/api/files/uploads/{response.json()['id']}/"
+        self.assertQueryBudget(
+            6, self.client, 'put', f'{upload}chunks/0/', 200,
+            data=os.urandom(64), content_type='application/octet-stream',
+        )
+        self.assertQueryBudget(2, self.client, 'get', upload, 200)
+        self.assertQueryBudget(8, self.client, 'post', f'{upload}commit/', 201)
+
+        response = self.assertQueryBudget(
+            2, self.client, 'post', '/api/files/uploads/', 201,
+            data=dict(new_upload, filename='abandoned.txt'), content_type='application/json',
+        )
+        upload = f"/api/files/uploads/{response.json()['id']}/"
+        self.assertQueryBudget(3, self.client, 'delete', upload, 204)
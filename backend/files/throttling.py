@@ -0,0 +1,184 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+from rest_framework.throttling import BaseThrottle
+
+from .metrics import metrics
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+@lru_cache(maxsize=None)
+def parse_rate(rate):
+    """'10/min' -> (10, 60), as DRF's throttle rates are written"""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+class LocalRateLimiter:
+    """
+    Per-process token buckets: each key may burst to limit requests and
+    regains limit per period, continuously. The least recently used keys
+    are forgotten beyond max_entries.
+    """
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self.buckets = OrderedDict()
+        self.lock = threading.Lock()
+
+    def hit(self, key, limit, period):
+        """(allowed, seconds until the next request would be)"""
+        rate = limit / period
+        now = time.monotonic()
+        with self.lock:
+            tokens, updated = self.buckets.get(key, (limit, now))
+            tokens = min(limit, tokens + (now - updated) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self.buckets[key] = (tokens, now)
+            self.buckets.move_to_end(key)
+            while len(self.buckets) > self.max_entries:
+                self.buckets.popitem(last=False)
+        return allowed, 0 if allowed else (1 - tokens) / rate
+
+class CacheRateLimiter:
+    """
+    Sliding-window counters in a Django cache (e.g. Redis) shared by every
+    process, kept with the cache's atomic add() and incr(). The previous
+    window's count is weighted by how much of it the sliding window still
+    covers. Refused requests are counted too, so a client has to pause to
+    get under the limit again.
+    """
+
+    def __init__(self, alias='default', key_prefix='rate-limit:'):
+        self.alias = alias
+        self.key_prefix = key_prefix
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def hit(self, key, limit, period):
+        cache = self.cache
+        position = time.time() / period
+        window = int(position)
+        elapsed = position - window  # Fraction of the current window gone
+        current_key = f'{self.key_prefix}{key}:{window}'
+        cache.add(current_key, 0, period * 2)
+        try:
+            count = cache.incr(current_key)
+        except ValueError:
+            # Evicted between add() and incr()
+            cache.set(current_key, 1, period * 2)
+            count = 1
+        previous = cache.get(f'{self.key_prefix}{key}:{window - 1}', 0)
+
+        estimate = previous * (1 - elapsed) + count
+        if estimate <= limit:
+            return True, 0
+        if count > limit or not previous:
+            return False, (1 - elapsed) * period
+        # Until enough of the previous window has slid out
+        return False, min(1 - elapsed, (estimate - limit) / previous) * period
+
+@lru_cache(maxsize=None)
+def get_rate_limiter():
+    config = settings.RATE_LIMITS
+    return import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+
+def hash_key(value):
+    # Keeps emails and share tokens out of cache keys, at a fixed length
+    return hashlib.blake2b(value.encode(), digest_size=12).hexdigest()
+
+class RateLimitThrottle(BaseThrottle):
+    """
+    Throttle on RATE_LIMITS['RATES'][scope] for the key get_key() returns
+    (None for requests it doesn't apply to). A request with several keys
+    (get_keys) is refused if any of them is over the limit.
+    """
+
+    scope = None
+
+    def get_key(self, request, view):
+        raise NotImplementedError
+
+    def get_keys(self, request, view):
+        key = self.get_key(request, view)
+        return [] if key is None else [key]
+
+    def allow_request(self, request, view):
+        config = settings.RATE_LIMITS
+        rate = config['RATES'].get(self.scope)
+        if not config['ENABLED'] or not rate:
+            return True
+        limit, period = parse_rate(rate)
+        self.retry_after = 0
+        for key in self.get_keys(request, view):
+            allowed, self.retry_after = get_rate_limiter().hit(f'{self.scope}:{key}', limit, period)
+            if not allowed:
+                metrics.inc('rate_limited_requests_total', (('scope', self.scope),))
+                return False
+        return True
+
+    def wait(self):
+        return self.retry_after
+
+class LoginIPThrottle(RateLimitThrottle):
+    scope = 'login_ip'
+
+    def get_key(self, request, view):
+        return self.get_ident(request)
+
+class LoginAccountThrottle(RateLimitThrottle):
+    scope = 'login_account'
+
+    def get_key(self, request, view):
+        email = request.data.get('email')
+        if not isinstance(email, str) or not email:
+            return None
+        return hash_key(email.strip().lower())
+
+class MFAAccountThrottle(RateLimitThrottle):
+    scope = 'mfa_account'
+
+    def get_key(self, request, view):
+        return request.user.id if request.user.is_authenticated else self.get_ident(request)
+
+class ShareIPThrottle(RateLimitThrottle):
+    scope = 'share_ip'
+
+    def get_key(self, request, view):
+        return self.get_ident(request)
+
+class ShareTokenThrottle(RateLimitThrottle):
+    scope = 'share_token'
+
+    def get_keys(self, request, view):
+        # request.GET works for Django and DRF requests alike (async views)
+        tokens = [request.GET.get('token')]
+        if request.method == 'POST':
+            # download_shared_archive sends its tokens in the body
+            body_tokens = request.data.get('tokens') if isinstance(request.data, dict) else None
+            if isinstance(body_tokens, list):
+                # Longer lists are refused by the view
+                tokens += body_tokens[:settings.MAX_ARCHIVE_FILES]
+        return [hash_key(token) for token in dict.fromkeys(tokens) if isinstance(token, str) and token]
+
+SHARE_THROTTLES = [ShareIPThrottle, ShareTokenThrottle]
+
+def throttle_wait(request, throttle_classes):
+    """
+    Seconds to wait when a throttle refuses the request, else None: the
+    check DRF views make, for views outside DRF.
+    """
+    waits = []
+    for throttle in (throttle_class() for throttle_class in throttle_classes):
+        if not throttle.allow_request(request, None):
+            waits.append(throttle.wait())
+    return max(waits) if waits else None
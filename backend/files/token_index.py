@@ -0,0 +1,172 @@
+import hashlib
+import logging
+import math
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import ShareableLink
+
+logger = logging.getLogger(__name__)
+
+CACHE_KEY = 'share-token-index'
+MIN_CAPACITY = 100000
+# Links committed late (long transactions, clock skew between servers) are
+# still picked up by a sync that re-reads this far behind its high-water mark
+SYNC_OVERLAP = timedelta(seconds=60)
+
+class BloomFilter:
+    """
+    Set of strings that answers "maybe present" or "definitely absent":
+    no false negatives, and false positives at about error_rate until more
+    than capacity keys are added.
+    """
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(1, capacity)
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key):
+        # Double hashing: k positions from one 128-bit digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        bits = self.bits
+        added = False
+        for position in self.positions(key):
+            mask = 1 << (position & 7)
+            if not bits[position >> 3] & mask:
+                bits[position >> 3] |= mask
+                added = True
+        self.count += added
+        return added
+
+    def __contains__(self, key):
+        bits = self.bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self.positions(key))
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def saturated(self):
+        return self.count > self.capacity
+
+class ShareTokenIndex:
+    """
+    Per-process Bloom filter of every ShareableLink token, so lookups of
+    tokens that never existed are answered without the database. Tokens
+    created here are added at once; those created by other processes are
+    picked up by a sync (one indexed range query on created_at) that runs
+    at most every SYNC_INTERVAL seconds, when a token is missing. Deleted
+    links stay in the filter, so their tokens are still looked up, until
+    the next full rebuild. The filter is built in a background thread; until
+    it is ready every token is looked up.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.filter = None
+        self.synced_to = None  # created_at of the newest link added
+        self.last_sync = 0.0
+        self.built_at = 0.0
+        self.rebuilder = None
+
+    @property
+    def config(self):
+        return settings.SHARE_TOKEN_INDEX
+
+    def may_contain(self, token):
+        if not self.config['ENABLED']:
+            return True
+        bloom = self.filter
+        if bloom is None:
+            # Until the first build is done every token goes to the database
+            self.start_rebuild()
+            return True
+        if bloom.saturated or time.monotonic() - self.built_at > self.config['REBUILD_INTERVAL']:
+            self.start_rebuild()
+        if token in bloom:
+            return True
+        self.sync()
+        return token in self.filter
+
+    def add(self, tokens):
+        if not self.config['ENABLED'] or self.filter is None:
+            return
+        with self.lock:
+            for token in tokens:
+                self.filter.add(token)
+
+    def sync(self, force=False):
+        """Add links created (by any process) since the last sync"""
+        if not force and time.monotonic() - self.last_sync < self.config['SYNC_INTERVAL']:
+            return
+        with self.lock:
+            if not force and time.monotonic() - self.last_sync < self.config['SYNC_INTERVAL']:
+                return
+            self.last_sync = time.monotonic()
+            links = ShareableLink.objects.filter(created_at__gte=self.synced_to - SYNC_OVERLAP)
+            for token, created_at in links.values_list('token', 'created_at').iterator():
+                self.filter.add(token)
+                self.synced_to = max(self.synced_to, created_at)
+
+    def build(self):
+        """A new filter of every token and its high-water mark, from cache when fresh"""
+        cache = caches[self.config['CACHE_ALIAS']] if self.config['CACHE_ALIAS'] else None
+        if cache is not None:
+            cached = cache.get(CACHE_KEY)
+            if cached is not None and not cached[0].saturated:
+                return cached
+
+        started = timezone.now()
+        capacity = max(MIN_CAPACITY, ShareableLink.objects.count() * 2)
+        bloom = BloomFilter(capacity, self.config['ERROR_RATE'])
+        for token in ShareableLink.objects.values_list('token', flat=True).iterator(chunk_size=10000):
+            bloom.add(token)
+        if cache is not None:
+            cache.set(CACHE_KEY, (bloom, started), self.config['REBUILD_INTERVAL'])
+        return bloom, started
+
+    def rebuild(self):
+        bloom, synced_to = self.build()
+        with self.lock:
+            self.filter, self.synced_to = bloom, synced_to
+            self.built_at = time.monotonic()
+            self.last_sync = 0.0
+        # Cover links created while the filter was built (or cached)
+        self.sync(force=True)
+
+    def start_rebuild(self):
+        if self.rebuilder is not None and self.rebuilder.is_alive():
+            return
+        with self.lock:
+            if self.rebuilder is not None and self.rebuilder.is_alive():
+                return
+            # Don't ask again until this rebuild has had its chance
+            self.built_at = time.monotonic()
+            self.rebuilder = threading.Thread(target=self.run_rebuild, name='share-token-index', daemon=True)
+            self.rebuilder.start()
+
+    def run_rebuild(self):
+        close_old_connections()
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception("Failed to rebuild the share token index")
+        finally:
+            close_old_connections()
+
+share_token_index = ShareTokenIndex()
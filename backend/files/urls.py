@@ -1,10 +1,22 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import async_views
 from .views import FileViewSet
 
 router = DefaultRouter()
 router.register(r'', FileViewSet, basename='file')
 
-urlpatterns = [
+urlpatterns = []
+
+if settings.ASYNC_DOWNLOADS:
+    # Matched before the router, replacing FileViewSet.download and
+    # FileViewSet.download_shared_file
+    urlpatterns += [
+        path('<uuid:pk>/download/', async_views.download, name='file-download-async'),
+        path('shared-file/download/', async_views.download_shared_file, name='file-download-shared-file-async'),
+    ]
+
+urlpatterns += [
     path('', include(router.urls)),
 ]
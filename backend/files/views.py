@@ -2,27 +2,50 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.http import FileResponse, Http404
+from django.http import Http404
 from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db import transaction
 from django.utils import timezone
 from datetime import timedelta
-import mimetypes
-import os
-import base64
-import secrets
+import io
 
-from .models import File, ShareableLink
-from .serializers import FileSerializer, FileUploadSerializer
+from .access import record_access
+from .archives import build_archive_response
+from .downloads import build_file_response
+from .encoders import RowEncoder
+from .link_cache import load_encryption_keys, record_to_file, resolve_share_token, resolve_share_tokens
+from .models import File, FileShareStats, OwnerShareStats, ShareableLink, UploadSession
+from .pagination import FileCursorPagination, LinkCursorPagination
+from .rollups import links_created
+from .serializers import (
+    ArchiveSerializer, BulkShareSerializer, FileSerializer, FileUploadSerializer, SharedArchiveSerializer,
+    ShareableLinkSerializer, ShareStatsSerializer, UploadSessionSerializer,
+)
 from .permissions import IsFileOwner
+from .share_tokens import generate_share_token, is_forged_share_token, reject_share_token
+from .storage import get_storage
+from .throttling import SHARE_THROTTLES
+from .token_index import share_token_index
+
+file_list_encoder = RowEncoder(FileSerializer)
 
 class FileViewSet(viewsets.ModelViewSet):
     serializer_class = FileSerializer
     permission_classes = [IsAuthenticated, IsFileOwner]
+    pagination_class = FileCursorPagination
     http_method_names = ['get', 'post', 'patch', 'delete']
     
     def get_queryset(self):
         return File.objects.filter(owner=self.request.user)
 
+    def list(self, request, *args, **kwargs):
+        # Fetch only the listed columns and encode rows without FileSerializer
+        queryset = self.filter_queryset(self.get_queryset()).values(*file_list_encoder.columns)
+        page = self.paginate_queryset(queryset)
+        return self.get_paginated_response(file_list_encoder.encode_many(page))
+
     def create(self, request, *args, **kwargs):
         serializer = FileUploadSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
@@ -31,46 +54,98 @@ class FileViewSet(viewsets.ModelViewSet):
         response_serializer = FileSerializer(file)
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
 
+    def get_upload_session(self, upload_id):
+        try:
+            return UploadSession.objects.get(id=upload_id, owner=self.request.user)
+        except (UploadSession.DoesNotExist, ValidationError):
+            raise Http404("Upload not found")
+
+    def upload_expired_response(self):
+        return Response(
+            {
+                'error': 'Upload Expired',
+                'message': 'This upload session has expired'
+            },
+            status=status.HTTP_410_GONE
+        )
+
+    @action(detail=False, methods=['post'], url_path='uploads')
+    def start_upload(self, request):
+        """Start a resumable upload; chunks are then PUT and the upload committed"""
+        serializer = UploadSessionSerializer(data=request.data, context={'request': request})
+        serializer.is_valid(raise_exception=True)
+        session = serializer.save()
+        return Response(UploadSessionSerializer(session).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get', 'delete'], url_path=r'uploads/(?P<upload_id>[0-9a-f-]+)')
+    def upload_session(self, request, upload_id=None):
+        """Report upload progress so clients can resume, or abort the upload"""
+        session = self.get_upload_session(upload_id)
+        if request.method == 'DELETE':
+            session.delete()
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response(UploadSessionSerializer(session).data)
+
+    # PUT is allowed on this route only, not as a full update of files
+    @action(
+        detail=False, methods=['put'], url_path=r'uploads/(?P<upload_id>[0-9a-f-]+)/chunks/(?P<index>[0-9]+)',
+        http_method_names=['put'],
+    )
+    def upload_chunk(self, request, upload_id=None, index=None):
+        """Write one chunk of raw request body into the upload"""
+        session = self.get_upload_session(upload_id)
+        if session.is_expired():
+            return self.upload_expired_response()
+
+        index = int(index)
+        if index >= session.total_chunks:
+            return Response(
+                {'error': f'Chunk index must be below {session.total_chunks}'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Read the raw body directly so the chunk is never parsed or spooled
+        stream = request.stream or io.BytesIO()
+        if not session.write_chunk(index, stream):
+            return Response(
+                {'error': f'Chunk {index} must be exactly {session.chunk_length(index)} bytes'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response({'index': index, 'missing_chunks': session.missing_chunks()})
+
+    @action(detail=False, methods=['post'], url_path=r'uploads/(?P<upload_id>[0-9a-f-]+)/commit')
+    def commit_upload(self, request, upload_id=None):
+        """Finalize a fully received upload into a File"""
+        session = self.get_upload_session(upload_id)
+        if session.is_expired():
+            return self.upload_expired_response()
+
+        missing = session.missing_chunks()
+        if missing:
+            return Response(
+                {
+                    'error': 'Upload incomplete',
+                    'missing_chunks': missing
+                },
+                status=status.HTTP_409_CONFLICT
+            )
+
+        try:
+            file = session.commit()
+        except UploadSession.DoesNotExist:
+            # A concurrent commit of the same session got there first
+            raise Http404("Upload not found")
+        return Response(FileSerializer(file).data, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['get'])
     def download(self, request, pk=None):
         try:
             file = self.get_object()
             
-            # Open the file in binary mode
-            file_path = file.file.path
-            if not os.path.exists(file_path):
+            if not get_storage().exists(file.file.name):
                 raise Http404("File not found")
             
-            # Get the MIME type
-            content_type, _ = mimetypes.guess_type(file.filename)
-            if content_type is None:
-                content_type = 'application/octet-stream'
-            
-            # Create the response with the file
-            response = FileResponse(
-                open(file_path, 'rb'),
-                content_type=content_type,
-                as_attachment=True,
-                filename=file.filename
-            )
-            
-            # Add the encryption key to the response headers
-            try:
-                # Try to decode the key to check if it's valid base64
-                base64.b64decode(file.encryption_key)
-                # If it's valid base64, use it as is
-                key = file.encryption_key
-            except:
-                # If it's not valid base64, encode it
-                key = base64.b64encode(file.encryption_key.encode()).decode()
-            
-            # Set the encryption key header
-            response['x-encryption-key'] = key
-            
-            # Ensure CORS headers are set
-            response['Access-Control-Expose-Headers'] = 'x-encryption-key'
-            
-            return response
+            return build_file_response(request, file)
             
         except File.DoesNotExist:
             raise Http404("File not found")
@@ -80,6 +155,26 @@ class FileViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=False, methods=['post'], url_path='archive')
+    def archive(self, request):
+        """Download many files as one streamed ZIP, their keys in manifest.json"""
+        serializer = ArchiveSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        file_ids = list(dict.fromkeys(serializer.validated_data['fileIds']))
+
+        files = {file.id: file for file in self.get_queryset().filter(id__in=file_ids)}
+        missing = [str(file_id) for file_id in file_ids if file_id not in files]
+        if missing:
+            return Response(
+                {
+                    'error': 'File Not Found',
+                    'message': 'Some files do not exist',
+                    'fileIds': missing
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return build_archive_response([files[file_id] for file_id in file_ids])
+
     @action(detail=True, methods=['post'], url_path='share')
     def generate_shareable_link(self, request, pk=None):
         """Generate a shareable link for a file"""
@@ -99,19 +194,21 @@ class FileViewSet(viewsets.ModelViewSet):
         # Calculate expiration time
         expiration_time = timezone.now() + timedelta(hours=expires_in)
         
-        # Generate a secure token
-        token = secrets.token_urlsafe(32)
-        
         try:
+            # Generate a secure (random or signed) token
+            token = generate_share_token(file.id, permissions, expiration_time, guest_user_id)
+
             # Create shareable link
-            share_link = ShareableLink.objects.create(
-                token=token,
-                file=file,
-                permissions=permissions,
-                expires_at=expiration_time,
-                created_by=request.user,
-                guest_user_id=guest_user_id  # Django will handle the foreign key relationship
-            )
+            with transaction.atomic():
+                share_link = ShareableLink.objects.create(
+                    token=token,
+                    file=file,
+                    permissions=permissions,
+                    expires_at=expiration_time,
+                    created_by=request.user,
+                    guest_user_id=guest_user_id  # Django will handle the foreign key relationship
+                )
+                links_created([(file.id, file.owner_id)])
             
             return Response({
                 'token': token,
@@ -127,7 +224,90 @@ class FileViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-    @action(detail=False, methods=['get'], url_path='shared-file')
+    @action(detail=False, methods=['post'], url_path='share/bulk')
+    def bulk_share(self, request):
+        """
+        Share many files at once: one link per file, or per (file, guest) pair
+        when guestUserIds is given. Ids that are not the user's files or not
+        guests are reported per item; everything else is created together.
+        """
+        serializer = BulkShareSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        file_ids, guest_ids = data['fileIds'], data['guestUserIds']
+
+        owned = set(self.get_queryset().filter(id__in=file_ids).order_by().values_list('id', flat=True))
+        guests = set()
+        if guest_ids:
+            guests = set(
+                get_user_model().objects.filter(id__in=guest_ids, role='guest').values_list('id', flat=True)
+            )
+
+        expiration_time = timezone.now() + timedelta(hours=data['expiresIn'])
+        results, links = [], []
+        for file_id in file_ids:
+            for guest_user_id in guest_ids or [None]:
+                result = {'fileId': str(file_id), 'guestUserId': guest_user_id}
+                results.append(result)
+                if file_id not in owned:
+                    result['error'] = 'File not found'
+                elif guest_user_id is not None and guest_user_id not in guests:
+                    result['error'] = 'Guest user not found'
+                else:
+                    result['token'] = generate_share_token(
+                        file_id, data['permissions'], expiration_time, guest_user_id
+                    )
+                    links.append(ShareableLink(
+                        token=result['token'],
+                        file_id=file_id,
+                        permissions=data['permissions'],
+                        expires_at=expiration_time,
+                        created_by=request.user,
+                        guest_user_id=guest_user_id,
+                    ))
+
+        if links:
+            with transaction.atomic():
+                ShareableLink.objects.bulk_create(links)
+                links_created((link.file_id, request.user.id) for link in links)
+            share_token_index.add(link.token for link in links)
+
+        return Response({
+            'permissions': data['permissions'],
+            'expires_at': expiration_time.isoformat(),
+            'created': len(links),
+            'failed': len(results) - len(links),
+            'results': results,
+        }, status=status.HTTP_201_CREATED if links else status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=True, methods=['get'], url_path='links')
+    def links(self, request, pk=None):
+        """List a file's share links, newest first"""
+        file = self.get_object()
+        paginator = LinkCursorPagination()
+        page = paginator.paginate_queryset(
+            file.shareable_links.select_related('file'), request, view=self
+        )
+        serializer = ShareableLinkSerializer(page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'], url_path='stats')
+    def share_stats(self, request, pk=None):
+        """Share totals of one file, read from its rollup row"""
+        file = self.get_object()
+        stats = FileShareStats.objects.filter(file=file).first() or FileShareStats(file=file)
+        return Response(ShareStatsSerializer(stats).data)
+
+    @action(detail=False, methods=['get'], url_path='share-stats')
+    def owner_share_stats(self, request):
+        """Share totals over all of the user's files, read from their rollup row"""
+        stats = (
+            OwnerShareStats.objects.filter(owner=request.user).first()
+            or OwnerShareStats(owner=request.user)
+        )
+        return Response(ShareStatsSerializer(stats).data)
+
+    @action(detail=False, methods=['get'], url_path='shared-file', throttle_classes=SHARE_THROTTLES)
     def shared_file(self, request):
         """Get shared file details with access validation"""
         token = request.query_params.get('token')
@@ -140,13 +320,15 @@ class FileViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        # Signed tokens that can't be valid are refused without a lookup
+        rejection = reject_share_token(token, request.user)
+        if rejection:
+            status_code, message = rejection
+            return Response({'error': 'Access Denied', 'message': message}, status=status_code)
+
         try:
-            # Get share link with related file and owner data in a single query
-            share_link = ShareableLink.objects.select_related(
-                'file', 
-                'file__owner',
-                'guest_user'
-            ).get(token=token)
+            # Resolve the link from the token cache, falling back to the DB
+            share_link = resolve_share_token(token)
 
             # Check if token is expired
             if share_link.expires_at < timezone.now():
@@ -159,7 +341,7 @@ class FileViewSet(viewsets.ModelViewSet):
                 )
 
             # Check guest user access if specified
-            if share_link.guest_user_id is not None:
+            if share_link.guest_id is not None:
                 if not request.user.is_authenticated:
                     return Response(
                         {
@@ -168,7 +350,7 @@ class FileViewSet(viewsets.ModelViewSet):
                         },
                         status=status.HTTP_401_UNAUTHORIZED
                     )
-                if request.user.id != share_link.guest_user_id:
+                if request.user.id != share_link.guest_id:
                     return Response(
                         {
                             'error': 'Access Denied',
@@ -177,14 +359,16 @@ class FileViewSet(viewsets.ModelViewSet):
                         status=status.HTTP_403_FORBIDDEN
                     )
 
+            record_access(token, request.user)
+
             # Return file metadata
             return Response({
-                'filename': share_link.file.filename,
-                'fileId': str(share_link.file.id),
-                'mime_type': share_link.file.mime_type,
-                'size': share_link.file.size,
-                'shared_by': share_link.file.owner.email,
-                'uploaded_at': share_link.file.uploaded_at.isoformat(),
+                'filename': share_link.filename,
+                'fileId': str(share_link.file_id),
+                'mime_type': share_link.mime_type,
+                'size': share_link.size,
+                'shared_by': share_link.owner_email,
+                'uploaded_at': share_link.uploaded_at.isoformat(),
                 'permissions': share_link.permissions
             })
 
@@ -197,7 +381,7 @@ class FileViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-    @action(detail=False, methods=['get'], url_path='shared-file/download')
+    @action(detail=False, methods=['get'], url_path='shared-file/download', throttle_classes=SHARE_THROTTLES)
     def download_shared_file(self, request):
         """Download a shared file with token validation"""
         token = request.query_params.get('token')
@@ -210,13 +394,15 @@ class FileViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
 
+        # Signed tokens that can't be valid are refused without a lookup
+        rejection = reject_share_token(token, request.user)
+        if rejection:
+            status_code, message = rejection
+            return Response({'error': 'Access Denied', 'message': message}, status=status_code)
+
         try:
-            # Get share link with related file data in a single query
-            share_link = ShareableLink.objects.select_related(
-                'file', 
-                'file__owner',
-                'guest_user'
-            ).get(token=token)
+            # Resolve the link from the token cache, falling back to the DB
+            share_link = resolve_share_token(token)
 
             # Check if token is expired
             if share_link.expires_at < timezone.now():
@@ -229,7 +415,7 @@ class FileViewSet(viewsets.ModelViewSet):
                 )
 
             # Check guest user access if specified
-            if share_link.guest_user_id is not None:
+            if share_link.guest_id is not None:
                 if not request.user.is_authenticated:
                     return Response(
                         {
@@ -238,7 +424,7 @@ class FileViewSet(viewsets.ModelViewSet):
                         },
                         status=status.HTTP_401_UNAUTHORIZED
                     )
-                if request.user.id != share_link.guest_user_id:
+                if request.user.id != share_link.guest_id:
                     return Response(
                         {
                             'error': 'Access Denied',
@@ -248,10 +434,9 @@ class FileViewSet(viewsets.ModelViewSet):
                     )
 
             # Get the file
-            file = share_link.file
-            file_path = file.file.path
+            file = record_to_file(share_link)
             
-            if not os.path.exists(file_path):
+            if not load_encryption_keys([file]) or not get_storage().exists(file.file.name):
                 return Response(
                     {
                         'error': 'File Not Found',
@@ -259,36 +444,9 @@ class FileViewSet(viewsets.ModelViewSet):
                     },
                     status=status.HTTP_404_NOT_FOUND
                 )
-            
-            # Get the MIME type
-            content_type, _ = mimetypes.guess_type(file.filename)
-            if content_type is None:
-                content_type = 'application/octet-stream'
-            
-            # Create the response with the file
-            response = FileResponse(
-                open(file_path, 'rb'),
-                content_type=content_type,
-                as_attachment=True,
-                filename=file.filename
-            )
-            
-            # Add the encryption key to the response headers
-            try:
-                # Try to decode the key to check if it's valid base64
-                base64.b64decode(file.encryption_key)
-                key = file.encryption_key
-            except:
-                # If it's not valid base64, encode it
-                key = base64.b64encode(file.encryption_key.encode()).decode()
-            
-            # Set the encryption key header
-            response['x-encryption-key'] = key
-            
-            # Ensure CORS headers are set
-            response['Access-Control-Expose-Headers'] = 'x-encryption-key'
-            
-            return response
+
+            record_access(token, request.user)
+            return build_file_response(request, file)
 
         except ShareableLink.DoesNotExist:
             return Response(
@@ -307,6 +465,63 @@ class FileViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+    @action(detail=False, methods=['post'], url_path='shared-file/archive', throttle_classes=SHARE_THROTTLES)
+    def download_shared_archive(self, request):
+        """Download the files of many share links as one streamed ZIP"""
+        serializer = SharedArchiveSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        tokens = list(dict.fromkeys(serializer.validated_data['tokens']))
+
+        # Every link is checked as download_shared_file would; any failure
+        # rejects the whole archive
+        # Forged signed tokens are refused before the lookup
+        forged = [token for token in tokens if is_forged_share_token(token)]
+        share_links = resolve_share_tokens([token for token in tokens if token not in forged])
+        invalid = [token for token in tokens if token not in share_links]
+        if invalid:
+            return self.shared_archive_denied(
+                'These links are invalid', invalid, status.HTTP_404_NOT_FOUND
+            )
+        now = timezone.now()
+        expired = [token for token in tokens if share_links[token].expires_at < now]
+        if expired:
+            return self.shared_archive_denied(
+                'These links have expired', expired, status.HTTP_403_FORBIDDEN
+            )
+        restricted = [token for token in tokens if share_links[token].guest_id is not None]
+        if restricted and not request.user.is_authenticated:
+            return self.shared_archive_denied(
+                'Authentication required for these links', restricted, status.HTTP_401_UNAUTHORIZED
+            )
+        denied = [token for token in restricted if share_links[token].guest_id != request.user.id]
+        if denied:
+            return self.shared_archive_denied(
+                'These links are not shared with you', denied, status.HTTP_403_FORBIDDEN
+            )
+
+        files = [record_to_file(share_links[token]) for token in tokens]
+        if not load_encryption_keys(files):
+            return Response(
+                {
+                    'error': 'File Not Found',
+                    'message': 'A shared file no longer exists'
+                },
+                status=status.HTTP_404_NOT_FOUND
+            )
+        for token in tokens:
+            record_access(token, request.user)
+        return build_archive_response(files, 'shared-files.zip')
+
+    def shared_archive_denied(self, message, tokens, status_code):
+        return Response(
+            {
+                'error': 'Access Denied',
+                'message': message,
+                'tokens': tokens
+            },
+            status=status_code
+        )
+
     def destroy(self, request, *args, **kwargs):
         try:
             instance = self.get_object()
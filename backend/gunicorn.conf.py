@@ -0,0 +1,73 @@
+"""
+Production server profile: `gunicorn -c gunicorn.conf.py`
+
+SERVER_WORKER_CLASS selects the worker model:
+  gthread  WSGI, WEB_CONCURRENCY processes of WEB_THREADS threads (default)
+  uvicorn  ASGI (secure_file_share.asgi) with async downloads, one event
+           loop per process
+  sync     WSGI, one request at a time per process
+"""
+import multiprocessing
+import os
+import sys
+
+WORKER_CLASSES = {
+    'sync': 'sync',
+    'gthread': 'gthread',
+    'uvicorn': 'uvicorn.workers.UvicornWorker',
+}
+
+worker_model = os.getenv('SERVER_WORKER_CLASS', 'gthread')
+if worker_model not in WORKER_CLASSES:
+    sys.exit(f"SERVER_WORKER_CLASS must be one of {', '.join(WORKER_CLASSES)}, not '{worker_model}'")
+
+if worker_model == 'uvicorn':
+    wsgi_app = 'secure_file_share.asgi:application'
+    # Settings are loaded by the startup check below, before asgi.py runs
+    os.environ.setdefault('ASYNC_DOWNLOADS', 'true')
+    # Async views run queries in short-lived executor threads whose
+    # persistent connections would never be closed; pool with pgbouncer
+    os.environ.setdefault('DB_CONN_MAX_AGE', '0')
+else:
+    wsgi_app = 'secure_file_share.wsgi:application'
+
+worker_class = WORKER_CLASSES[worker_model]
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.getenv('WEB_THREADS', 4)) if worker_model == 'gthread' else 1
+
+bind = os.getenv('BIND', '0.0.0.0:8000')
+# Upload chunks (up to MAX_UPLOAD_CHUNK_SIZE) need time on slow links
+timeout = int(os.getenv('WEB_TIMEOUT', 120))
+graceful_timeout = 30
+keepalive = 5
+# Recycle workers now and then to cap the growth of per-process caches
+max_requests = int(os.getenv('WEB_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+accesslog = '-'
+errorlog = '-'
+
+def on_starting(server):
+    """Refuse to start any workers if the deployment cannot serve requests"""
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'secure_file_share.settings')
+    import django
+    from django.conf import settings
+    from django.core.management import call_command
+    from django.core.management.base import CommandError
+    from django.db import connections
+
+    django.setup()
+    from files.metrics import clear_exports
+    clear_exports()
+    try:
+        call_command('startup_check')
+        if settings.SHARE_TOKEN_INDEX['ENABLED']:
+            # Built once here; forked workers share the pages until they write
+            from files.token_index import share_token_index
+            share_token_index.rebuild()
+    except CommandError as e:
+        server.log.error(str(e))
+        sys.exit(1)
+    finally:
+        # Workers must not inherit the master's database connection
+        connections.close_all()
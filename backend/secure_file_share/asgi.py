@@ -0,0 +1,15 @@
+"""
+ASGI config for secure_file_share project.
+
+Serves downloads from async views (see files.async_views), so a slow
+client does not hold a worker thread for the length of its download.
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'secure_file_share.settings')
+os.environ.setdefault('ASYNC_DOWNLOADS', 'true')
+
+application = get_asgi_application()
@@ -32,6 +32,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'files.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -61,8 +62,14 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'secure_file_share.wsgi.application'
+ASGI_APPLICATION = 'secure_file_share.asgi.application'
 
 # Database
+# Each worker keeps its connection for DB_CONN_MAX_AGE seconds instead of
+# reconnecting per request (0 closes it after every request); health checks
+# replace a connection the server has dropped before it is reused.
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE', 60))
+
 if os.getenv('USE_POSTGRES', '').lower() == 'true':
     DATABASES = {
         'default': {
@@ -72,6 +79,8 @@ if os.getenv('USE_POSTGRES', '').lower() == 'true':
             'PASSWORD': os.getenv('DB_PASSWORD', 'postgres'),
             'HOST': os.getenv('DB_HOST', 'localhost'),
             'PORT': os.getenv('DB_PORT', '5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
         }
     }
 else:
@@ -79,6 +88,8 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': os.path.join(BASE_DIR, 'data', 'db.sqlite3'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
         }
     }
 
@@ -98,6 +109,44 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Password hashing runs on a bounded pool per process (users.hashers). The
+# first hasher hashes new passwords; the others still verify (and upgrade,
+# at the next login) existing hashes. bcrypt_sha256 at 12 rounds costs about
+# as much as Django's PBKDF2 default (~0.35 s per hash on one core, see
+# bench_password_hashing); argon2 needs argon2-cffi.
+PASSWORD_HASHER = os.getenv('PASSWORD_HASHER', 'bcrypt')
+PASSWORD_HASHER_CLASSES = {
+    'bcrypt': 'users.hashers.PooledBCryptSHA256PasswordHasher',
+    'argon2': 'users.hashers.PooledArgon2PasswordHasher',
+    'pbkdf2': 'users.hashers.PooledPBKDF2PasswordHasher',
+}
+PASSWORD_HASHERS = [PASSWORD_HASHER_CLASSES[PASSWORD_HASHER]] + [
+    path for name, path in PASSWORD_HASHER_CLASSES.items() if name != PASSWORD_HASHER
+]
+
+# Server processes and request threads per process, as gunicorn.conf.py
+# sets them up
+SERVER_PROCESSES = int(os.getenv('WEB_CONCURRENCY', (os.cpu_count() or 1) * 2 + 1))
+REQUEST_THREADS = int(os.getenv('WEB_THREADS', 4)) if os.getenv('SERVER_WORKER_CLASS', 'gthread') == 'gthread' else 1
+
+# At most WORKERS hashes run at once per process, at a lower CPU priority
+# (NICE) than request handling, so a login burst can't starve downloads.
+# Every running or queued hash holds a request thread while it waits, so
+# at most MAX_PENDING of them are allowed: one fewer than REQUEST_THREADS,
+# leaving a thread for other traffic (with one thread per process nothing
+# can be left, and hashes just don't queue). Beyond that, login and
+# registration answer 429 at once; a hash that waits QUEUE_TIMEOUT seconds
+# answers 503. EXECUTOR 'process' hashes in spawned processes instead of
+# threads. WORKERS = 0 hashes on the request thread.
+PASSWORD_HASHING = {
+    'EXECUTOR': os.getenv('PASSWORD_HASHING_EXECUTOR', 'thread'),
+    'WORKERS': int(os.getenv('PASSWORD_HASHING_WORKERS', 1)),
+    'MAX_PENDING': int(os.getenv('PASSWORD_HASHING_MAX_PENDING', max(1, REQUEST_THREADS - 1))),
+    'QUEUE_TIMEOUT': 5.0,  # Seconds
+    'RETRY_AFTER': 5,  # Seconds, sent with 429 and 503
+    'NICE': 10,
+}
+
 # Internationalization
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'UTC'
@@ -121,11 +170,14 @@ AUTH_USER_MODEL = 'users.User'
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    # Reverse proxies in front of the app; rate limits key on the client
+    # address they add to X-Forwarded-For (0 trusts only REMOTE_ADDR)
+    'NUM_PROXIES': int(os.getenv('NUM_PROXIES', 0)),
 }
 
 # JWT settings
@@ -155,6 +207,49 @@ SIMPLE_JWT = {
     'TOKEN_USER_CLASS': 'rest_framework_simplejwt.models.TokenUser',
 }
 
+# Rate limits (files.throttling) on login, MFA verification and the
+# shared-file endpoints, as DRF rates ('10/min'); None lifts one. The
+# default backend keeps token buckets per process, so each worker allows
+# the full rate; files.throttling.CacheRateLimiter (OPTIONS: alias,
+# key_prefix) shares sliding-window counters through a cache such as
+# Redis. Set RATE_LIMITS=false for load tests.
+RATE_LIMITS = {
+    'ENABLED': os.getenv('RATE_LIMITS', 'true').lower() != 'false',
+    'BACKEND': os.getenv('RATE_LIMIT_BACKEND', 'files.throttling.LocalRateLimiter'),
+    'OPTIONS': {},
+    'RATES': {
+        'login_ip': '30/min',  # Per client IP, see NUM_PROXIES
+        'login_account': '10/min',  # Per email address tried
+        'mfa_account': '10/min',  # Per user
+        'share_ip': '300/min',
+        'share_token': '120/min',
+    },
+}
+
+# TOTP checks (users.mfa). An accepted code is kept in USED_CODES_CACHE
+# until it expires and refused if used again; with the per-process default
+# cache, a code could still be replayed once against each other worker, so
+# point it at a shared cache (e.g. Redis) in production; startup_check fails
+# otherwise when DEBUG is off and there is more than one server process.
+MFA_VERIFICATION = {
+    'VALID_WINDOW': 0,  # Time steps accepted either side of the current one
+    'USED_CODES_CACHE': os.getenv('MFA_USED_CODES_CACHE', 'default'),  # CACHES alias
+    'SECRET_TIMEOUT': 300,  # Seconds a worker keeps a user's secret
+}
+
+# Validated access tokens and user snapshots kept by
+# users.authentication.CachedJWTAuthentication, so authenticated requests
+# make no user query. A change to a user is seen at once by the process
+# that saved it and within USER_TIMEOUT by the others; use
+# files.link_cache.DjangoTokenCache with OPTIONS {'key_prefix': 'jwt-auth:'}
+# to invalidate across workers.
+JWT_AUTH_CACHE = {
+    'BACKEND': os.getenv('JWT_AUTH_CACHE_BACKEND', 'files.link_cache.LRUTokenCache'),
+    'OPTIONS': {},
+    'TOKEN_TIMEOUT': int(os.getenv('JWT_AUTH_TOKEN_CACHE_TIMEOUT', 300)),  # Seconds, 0 disables
+    'USER_TIMEOUT': int(os.getenv('JWT_AUTH_USER_CACHE_TIMEOUT', 30)),  # Seconds, 0 disables
+}
+
 # CORS settings
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
@@ -166,12 +261,126 @@ MAX_UPLOAD_SIZE = 5 * 1024 * 1024  # 5MB
 FILE_UPLOAD_MAX_MEMORY_SIZE = MAX_UPLOAD_SIZE
 DATA_UPLOAD_MAX_MEMORY_SIZE = MAX_UPLOAD_SIZE
 
+# Chunked (resumable) upload settings
+MAX_CHUNKED_UPLOAD_SIZE = int(os.getenv('MAX_CHUNKED_UPLOAD_SIZE', 10 * 1024 * 1024 * 1024))  # 10GB
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # Default chunk size offered to clients
+MAX_UPLOAD_CHUNK_SIZE = 64 * 1024 * 1024
+UPLOAD_STREAM_BLOCK_SIZE = 64 * 1024  # Bytes copied per read while streaming a chunk
+UPLOAD_SESSION_EXPIRY_HOURS = 24
+
+# Storage driver for all encrypted file bytes. Use 'files.storage.S3Storage'
+# (requires boto3) to share one object store between backend replicas.
+FILE_STORAGE_BACKEND = os.getenv('FILE_STORAGE_BACKEND', 'files.storage.LocalStorage')
+S3_STORAGE = {
+    'BUCKET': os.getenv('S3_BUCKET', 'secure-file-share'),
+    'ENDPOINT_URL': os.getenv('S3_ENDPOINT_URL'),  # e.g. http://minio:9000 for a local stand-in
+    'ACCESS_KEY_ID': os.getenv('S3_ACCESS_KEY_ID'),
+    'SECRET_ACCESS_KEY': os.getenv('S3_SECRET_ACCESS_KEY'),
+    'REGION': os.getenv('S3_REGION', 'us-east-1'),
+}
+
+# Store uploads as SHA-256 addressed blobs under MEDIA_ROOT/blobs/, shared
+# (and reference-counted) between Files with identical ciphertext. Chunked
+# uploads are hashed and moved after their commit, on a background thread
+# (files.dedup); `manage.py dedupe_files` catches up on any left behind.
+CONTENT_ADDRESSED_STORAGE = os.getenv('CONTENT_ADDRESSED_STORAGE', '').lower() == 'true'
+
+# File list pagination (keyset cursors, see files.pagination)
+FILE_LIST_PAGE_SIZE = 100
+FILE_LIST_MAX_PAGE_SIZE = 1000
+
+# Share links of a file, listed at /api/files/<id>/links/
+LINK_LIST_PAGE_SIZE = 50
+LINK_LIST_MAX_PAGE_SIZE = 1000
+
+# Most links one POST /api/files/share/bulk/ may create (files x guests)
+MAX_BULK_SHARE_LINKS = 10000
+
+# Most files one ZIP archive download may hold
+MAX_ARCHIVE_FILES = 1000
+
+# Download settings
+DOWNLOAD_CHUNK_SIZE = 64 * 1024  # Bytes read per iteration while streaming a download
+MAX_DOWNLOAD_RANGES = 16  # Range requests asking for more parts are served in full
+
+# How download bodies are delivered once a request is authorized:
+#   'python'   - streamed by the Django worker (development)
+#   'nginx'    - X-Accel-Redirect to FILE_DELIVERY_INTERNAL_URL
+#   'sendfile' - X-Sendfile with the absolute path (Apache/lighttpd)
+FILE_DELIVERY_BACKEND = os.getenv('FILE_DELIVERY_BACKEND', 'python')
+# Internal nginx location aliased to MEDIA_ROOT
+FILE_DELIVERY_INTERNAL_URL = os.getenv('FILE_DELIVERY_INTERNAL_URL', '/protected-media/')
+
+# Route the download endpoints to async views (files.async_views) that
+# stream without holding a thread. On by default under asgi.py.
+ASYNC_DOWNLOADS = os.getenv('ASYNC_DOWNLOADS', '').lower() == 'true'
+
+# Cache of resolved share-link tokens used by the shared-file endpoints.
+# LRUTokenCache is per process, so a link deleted through one worker stays
+# usable in the others for up to TIMEOUT seconds: 5 by default when there is
+# more than one server process. Use files.link_cache.DjangoTokenCache, with
+# CACHES on a shared server (e.g. Redis), to invalidate across workers; a
+# longer TIMEOUT is then safe.
+SHARE_LINK_CACHE = {
+    'BACKEND': os.getenv('SHARE_LINK_CACHE_BACKEND', 'files.link_cache.LRUTokenCache'),
+    'OPTIONS': {},
+    # Seconds, 0 disables the cache
+    'TIMEOUT': int(os.getenv('SHARE_LINK_CACHE_TIMEOUT', 60 if SERVER_PROCESSES == 1 else 5)),
+}
+
+# Bloom filter of existing share-link tokens (files.token_index), so tokens
+# that never existed are refused without a database lookup. Each process
+# syncs links created elsewhere at most every SYNC_INTERVAL seconds, when a
+# token is missing: a brand-new link may look invalid to another process for
+# that long. With CACHE_ALIAS set, a rebuilt filter is shared through that
+# cache instead of every process scanning the links table.
+SHARE_TOKEN_INDEX = {
+    'ENABLED': os.getenv('SHARE_TOKEN_INDEX', '').lower() == 'true',
+    'ERROR_RATE': 0.01,  # False positives (lookups of unknown tokens) let through
+    'SYNC_INTERVAL': 1.0,  # Seconds
+    'REBUILD_INTERVAL': 3600,  # Seconds; drops deleted links' tokens
+    'CACHE_ALIAS': os.getenv('SHARE_TOKEN_INDEX_CACHE', ''),
+}
+
+# Format of new share-link tokens: 'random', or 'signed' to embed the link's
+# file, permissions, expiry and guest under an HMAC of SECRET_KEY (keys in
+# SECRET_KEY_FALLBACKS still verify), so bad tokens are refused without a
+# lookup. Once every random token has expired, set
+# SHARE_TOKEN_ACCEPT_UNSIGNED=false to refuse those without a lookup too.
+SHARE_TOKEN_FORMAT = os.getenv('SHARE_TOKEN_FORMAT', 'random')
+SHARE_TOKEN_ACCEPT_UNSIGNED = os.getenv('SHARE_TOKEN_ACCEPT_UNSIGNED', 'true').lower() == 'true'
+
+# Share-link access counts are buffered per process and written back in
+# bulk every SHARE_ACCESS_FLUSH_INTERVAL seconds (0 writes synchronously)
+SHARE_ACCESS_FLUSH_INTERVAL = float(os.getenv('SHARE_ACCESS_FLUSH_INTERVAL', 5))
+SHARE_ACCESS_MAX_PENDING = 10000  # Flush early once this many links are buffered
+SHARE_ACCESS_FLUSH_BATCH_SIZE = 500  # Links per UPDATE statement
+
+# Request metrics served at /metrics (Prometheus text format). With several
+# worker processes, point METRICS_DIR at a directory they share: each exports
+# its totals there every METRICS_EXPORT_INTERVAL seconds and a scrape of any
+# worker sums them. Scrapes must send METRICS_TOKEN as a Bearer token; with
+# no token set, /metrics answers 403 unless METRICS_PUBLIC is true.
+METRICS_DIR = os.getenv('METRICS_DIR')
+METRICS_EXPORT_INTERVAL = float(os.getenv('METRICS_EXPORT_INTERVAL', 5))
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+METRICS_PUBLIC = os.getenv('METRICS_PUBLIC', '').lower() == 'true'
+
+# In development, log requests that run one query shape this many times
+DUPLICATE_QUERY_THRESHOLD = 3
+
+# Resume checkpoint for `manage.py collect_garbage`
+GC_STATE_FILE = os.path.join(BASE_DIR, 'data', 'gc_state.json')
+
 # Ensure temp directory exists and is writable
 FILE_UPLOAD_TEMP_DIR = os.path.join(BASE_DIR, 'data', 'tmp')
 os.makedirs(FILE_UPLOAD_TEMP_DIR, exist_ok=True)
 
 # Development-specific settings
 if DEBUG:
+    # Log repeated queries (likely N+1s), see files.query_budget
+    MIDDLEWARE.append('files.query_budget.DuplicateQueryMiddleware')
+
     # Disable some security settings in development
     SESSION_COOKIE_SECURE = False
     CSRF_COOKIE_SECURE = False
@@ -2,9 +2,11 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from files.metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/files/', include('files.urls')),
     path('api/users/', include('users.urls')),
+    path('metrics', metrics_view, name='metrics'),
 ] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,116 @@
+import hashlib
+import uuid
+from collections import namedtuple
+from functools import lru_cache
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from files.metrics import metrics
+
+# Everything request.user needs on the hot paths; other fields are deferred
+# and loaded from the database only when a view touches them
+UserSnapshot = namedtuple('UserSnapshot', ['id', 'email', 'role', 'is_active', 'is_mfa_enabled'])
+
+@lru_cache(maxsize=None)
+def get_auth_cache():
+    config = settings.JWT_AUTH_CACHE
+    return import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+
+def token_key(raw_token):
+    if isinstance(raw_token, str):
+        raw_token = raw_token.encode()
+    # Bearer tokens themselves are never used as cache keys
+    return 'claims:' + hashlib.blake2b(raw_token, digest_size=16).hexdigest()
+
+def user_key(user_id):
+    return f'user:{user_id}'
+
+def token_version_key(user_id):
+    return f'token-version:{user_id}'
+
+def snapshot_to_user(snapshot):
+    """User instance with only the snapshot's fields loaded, as from .only()"""
+    User = get_user_model()
+    loaded = snapshot._asdict()
+    # from_db() takes the loaded values in model field order
+    field_names = [f.attname for f in User._meta.concrete_fields if f.attname in loaded]
+    return User.from_db(DEFAULT_DB_ALIAS, field_names, [loaded[name] for name in field_names])
+
+def invalidate_user(user_id):
+    get_auth_cache().delete_many([user_key(user_id)])
+
+def invalidate_user_tokens(user_id):
+    """Make every cached token of the user miss, and be validated again"""
+    timeout = settings.JWT_AUTH_CACHE['TOKEN_TIMEOUT']
+    if timeout:
+        # Kept as long as any token cached under the previous version
+        get_auth_cache().set(token_version_key(user_id), uuid.uuid4().hex, timeout)
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that keeps validated tokens and a UserSnapshot of
+    their users in JWT_AUTH_CACHE, so a repeated request makes no user
+    query. Snapshots are dropped when the user is saved or deleted. Tokens
+    are cached with their user's token version, and all of a user's tokens
+    miss once the version changes, as it does when one of their tokens is
+    blacklisted (see users.signals).
+    """
+
+    def get_validated_token(self, raw_token):
+        timeout = settings.JWT_AUTH_CACHE['TOKEN_TIMEOUT']
+        if not timeout:
+            return super().get_validated_token(raw_token)
+        cache = get_auth_cache()
+        key = token_key(raw_token)
+        cached = cache.get(key)
+        if cached is not None:
+            version, user_id, validated_token = cached
+            if version != cache.get(token_version_key(user_id)):
+                cached = None
+        metrics.inc('jwt_auth_cache_requests_total', (('kind', 'token'), ('result', 'miss' if cached is None else 'hit')))
+        if cached is not None:
+            return validated_token
+
+        validated_token = super().get_validated_token(raw_token)
+        user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+        # An invalidation after this read still makes the entry miss
+        version = cache.get(token_version_key(user_id))
+        # Never keep a token cached past its expiry
+        expires_in = validated_token.get('exp', 0) - timezone.now().timestamp()
+        timeout = min(timeout, expires_in)
+        if timeout > 0:
+            cache.set(key, (version, user_id, validated_token), timeout)
+        return validated_token
+
+    def get_user(self, validated_token):
+        timeout = settings.JWT_AUTH_CACHE['USER_TIMEOUT']
+        # Revocation on password change needs the password hash, which isn't cached
+        if not timeout or api_settings.CHECK_REVOKE_TOKEN:
+            return super().get_user(validated_token)
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        snapshot = get_auth_cache().get(user_key(user_id))
+        metrics.inc('jwt_auth_cache_requests_total', (('kind', 'user'), ('result', 'miss' if snapshot is None else 'hit')))
+        if snapshot is None:
+            values = self.user_model.objects.filter(
+                **{api_settings.USER_ID_FIELD: user_id}
+            ).values_list(*UserSnapshot._fields).first()
+            if values is None:
+                raise AuthenticationFailed(_("User not found"), code="user_not_found")
+            snapshot = UserSnapshot(*values)
+            get_auth_cache().set(user_key(user_id), snapshot, timeout)
+
+        if not snapshot.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        return snapshot_to_user(snapshot)
@@ -0,0 +1,147 @@
+"""
+Password hashers that run on a small, bounded per-process pool instead of
+the request thread. A burst of logins then queues for (and is refused by)
+the pool rather than taking every worker thread, and the pool's threads or
+processes run at a lower CPU priority than request handling.
+"""
+import multiprocessing
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from django.utils.module_loading import import_string
+
+from files.metrics import metrics
+
+class PasswordHashingUnavailable(Exception):
+    """The pool can't take a hash now; try again after retry_after seconds"""
+
+    status_code = 503
+
+    def __init__(self, retry_after):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+class PasswordHashingBusy(PasswordHashingUnavailable):
+    """MAX_PENDING hashes are already running or waiting"""
+
+    status_code = 429
+
+def lower_priority(nice):
+    if not nice:
+        return
+    if sys.platform.startswith('linux'):
+        # Linux keeps a nice value per thread
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+    else:
+        os.nice(nice)
+
+def init_hashing_process(nice):
+    import django
+
+    django.setup()
+    lower_priority(nice)
+
+def call_hasher(path, method, *args):
+    """Run one hasher method; returns (seconds taken, result)"""
+    started = time.perf_counter()
+    result = getattr(import_string(path)(), method)(*args)
+    return time.perf_counter() - started, result
+
+class HashingPool:
+    """
+    At most WORKERS hashes run at once, and MAX_PENDING run or wait. Further
+    hashes are refused at once with PasswordHashingBusy, and those that
+    wait longer than QUEUE_TIMEOUT with PasswordHashingUnavailable.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.pid = None
+        self.pending = 0  # Running and queued hashes
+
+    @property
+    def config(self):
+        return settings.PASSWORD_HASHING
+
+    def get_executor(self):
+        # Created in each (forked) worker on first use
+        if self.executor is None or self.pid != os.getpid():
+            config = self.config
+            if config['EXECUTOR'] == 'process':
+                self.executor = ProcessPoolExecutor(
+                    config['WORKERS'], mp_context=multiprocessing.get_context('spawn'),
+                    initializer=init_hashing_process, initargs=(config['NICE'],),
+                )
+            else:
+                self.executor = ThreadPoolExecutor(
+                    config['WORKERS'], thread_name_prefix='password-hashing',
+                    initializer=lower_priority, initargs=(config['NICE'],),
+                )
+            self.pid = os.getpid()
+            self.pending = 0
+        return self.executor
+
+    def run(self, path, method, *args):
+        config = self.config
+        if not config['WORKERS']:
+            return call_hasher(path, method, *args)[1]
+
+        with self.lock:
+            if self.pending >= max(config['MAX_PENDING'], 1):
+                metrics.inc('password_hashes_total', (('result', 'busy'),))
+                raise PasswordHashingBusy(config['RETRY_AFTER'])
+            executor = self.get_executor()
+            self.pending += 1
+        started = time.perf_counter()
+        try:
+            future = executor.submit(call_hasher, path, method, *args)
+            try:
+                duration, result = future.result(timeout=config['QUEUE_TIMEOUT'])
+            except FutureTimeoutError:
+                if future.cancel():
+                    metrics.inc('password_hashes_total', (('result', 'timeout'),))
+                    raise PasswordHashingUnavailable(config['RETRY_AFTER'])
+                # Already running: worth finishing
+                duration, result = future.result()
+        finally:
+            with self.lock:
+                self.pending -= 1
+        metrics.inc('password_hashes_total', (('result', 'ok'),))
+        metrics.observe('password_hash_queue_seconds', (), time.perf_counter() - started - duration)
+        metrics.observe('password_hash_duration_seconds', (('method', method),), duration)
+        return result
+
+hashing_pool = HashingPool()
+
+class PooledHasherMixin:
+    """Runs the next hasher class in the MRO on hashing_pool"""
+
+    @classmethod
+    def base_hasher_path(cls):
+        base = cls.__mro__[cls.__mro__.index(PooledHasherMixin) + 1]
+        return f'{base.__module__}.{base.__qualname__}'
+
+    def encode(self, password, salt, *args):
+        return hashing_pool.run(self.base_hasher_path(), 'encode', password, salt, *args)
+
+    def verify(self, password, encoded):
+        return hashing_pool.run(self.base_hasher_path(), 'verify', password, encoded)
+
+    def harden_runtime(self, password, encoded):
+        return hashing_pool.run(self.base_hasher_path(), 'harden_runtime', password, encoded)
+
+class PooledArgon2PasswordHasher(PooledHasherMixin, hashers.Argon2PasswordHasher):
+    pass
+
+class PooledBCryptSHA256PasswordHasher(PooledHasherMixin, hashers.BCryptSHA256PasswordHasher):
+    pass
+
+class PooledPBKDF2PasswordHasher(PooledHasherMixin, hashers.PBKDF2PasswordHasher):
+    pass
@@ -0,0 +1,75 @@
+"""
+TOTP verification for User.verify_mfa_token. Each accepted code is
+recorded in a cache until its time step is over, so it can't be used
+twice, and the codes expected for a step are computed once per secret, so
+retries cost a lookup rather than HMACs.
+"""
+import time
+from functools import lru_cache
+
+import pyotp
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.crypto import constant_time_compare
+
+from files.link_cache import LRUTokenCache
+from files.metrics import metrics
+
+# user id -> mfa_secret, so request.user (which defers it) needn't load it
+secret_cache = LRUTokenCache()
+
+@lru_cache(maxsize=4096)
+def get_totp(secret):
+    return pyotp.TOTP(secret)
+
+@lru_cache(maxsize=16384)
+def expected_code(secret, counter):
+    return get_totp(secret).generate_otp(counter)
+
+def get_secret(user):
+    if 'mfa_secret' not in user.get_deferred_fields():
+        return user.mfa_secret
+    secret = secret_cache.get(user.pk)
+    if secret is None:
+        secret = user.mfa_secret
+        secret_cache.set(user.pk, secret, settings.MFA_VERIFICATION['SECRET_TIMEOUT'])
+    return secret
+
+def invalidate_secret(user_id):
+    secret_cache.delete_many([user_id])
+
+def used_codes():
+    return caches[settings.MFA_VERIFICATION['USED_CODES_CACHE']]
+
+def verify_totp(user, code):
+    """
+    Whether code is the user's TOTP for the current time step (give or
+    take VALID_WINDOW steps) and hasn't been accepted before.
+    """
+    secret = get_secret(user)
+    code = str(code).strip()
+    if not secret or not code:
+        metrics.inc('mfa_verifications_total', (('result', 'invalid'),))
+        return False
+
+    window = settings.MFA_VERIFICATION['VALID_WINDOW']
+    interval = get_totp(secret).interval
+    now = time.time()
+    current = int(now // interval)
+    matched = None
+    for counter in range(current - window, current + window + 1):
+        if constant_time_compare(code, expected_code(secret, counter)):
+            matched = counter
+            break
+    if matched is None:
+        metrics.inc('mfa_verifications_total', (('result', 'invalid'),))
+        return False
+
+    # Kept until the code stops being accepted; add() is atomic, so of two
+    # concurrent uses of one code only the first succeeds
+    timeout = (matched + window + 1) * interval - now
+    if not used_codes().add(f'mfa-used:{user.pk}:{matched}', True, max(1, int(timeout) + 1)):
+        metrics.inc('mfa_verifications_total', (('result', 'replayed'),))
+        return False
+    metrics.inc('mfa_verifications_total', (('result', 'ok'),))
+    return True
@@ -47,14 +47,14 @@ class User(AbstractUser):
         if not self.mfa_secret:
             self.mfa_secret = pyotp.random_base32()
             self.is_mfa_enabled = True
-            self.save()
+            self.save(update_fields=['mfa_secret', 'is_mfa_enabled'])
         return self.mfa_secret
 
     def verify_mfa_token(self, token):
         if not self.is_mfa_enabled:
             return True
-        totp = pyotp.TOTP(self.mfa_secret)
-        return totp.verify(token)
+        from .mfa import verify_totp
+        return verify_totp(self, token)
 
     def get_mfa_uri(self):
         if self.mfa_secret:
@@ -0,0 +1,23 @@
+from django.apps import apps
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .authentication import invalidate_user, invalidate_user_tokens
+from .mfa import invalidate_secret
+
+@receiver([post_save, post_delete], sender=get_user_model())
+def invalidate_user_snapshot(sender, instance, **kwargs):
+    invalidate_user(instance.pk)
+    invalidate_secret(instance.pk)
+
+def invalidate_blacklisted_token(sender, instance, created, **kwargs):
+    # The user's cached access tokens, not the blacklisted token itself
+    if created and instance.token.user_id is not None:
+        invalidate_user_tokens(instance.token.user_id)
+        invalidate_user(instance.token.user_id)
+
+if apps.is_installed('rest_framework_simplejwt.token_blacklist'):
+    from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+    post_save.connect(invalidate_blacklisted_token, sender=BlacklistedToken)
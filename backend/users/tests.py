@@ -1,3 +1,171 @@
-from django.test import TestCase
+import threading
+import time
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import pyotp
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+from django.test import Client, TestCase, override_settings
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import AccessToken
+
+from files.management.commands.startup_check import Command as StartupCheck
+from files.tests import QueryBudgetMixin, bearer_client
+
+from . import mfa
+from .authentication import CachedJWTAuthentication
+from .hashers import PasswordHashingBusy, hashing_pool
+from .models import User
+from .signals import invalidate_blacklisted_token
+
+POOL = {'EXECUTOR': 'thread', 'WORKERS': 1, 'MAX_PENDING': 2, 'QUEUE_TIMEOUT': 5, 'RETRY_AFTER': 5, 'NICE': 0}
+
+release = threading.Event()
+
+class BlockingHasher:
+    """Stands in for a slow hash: holds its pool worker until released"""
+
+    def hash(self):
+        release.wait(5)
+        return True
+
+@override_settings(PASSWORD_HASHING=POOL)
+class HashingPoolTests(TestCase):
+    def tearDown(self):
+        release.set()
+        if hashing_pool.executor is not None:
+            hashing_pool.executor.shutdown()
+            hashing_pool.executor = None
+        hashing_pool.pending = 0
+        release.clear()
+
+    def test_hashes_beyond_max_pending_are_refused(self):
+        # One hash running and one queued, each holding its request thread
+        holders = [
+            threading.Thread(target=hashing_pool.run, args=('users.tests.BlockingHasher', 'hash'))
+            for _ in range(POOL['MAX_PENDING'])
+        ]
+        for holder in holders:
+            holder.start()
+        deadline = time.monotonic() + 5
+        while hashing_pool.pending < POOL['MAX_PENDING'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        with self.assertRaises(PasswordHashingBusy):
+            hashing_pool.run('users.tests.BlockingHasher', 'hash')
+        release.set()
+        for holder in holders:
+            holder.join()
+        self.assertEqual(hashing_pool.pending, 0)
+
+    def test_login_answers_429_when_the_pool_is_full(self):
+        User.objects.create_user(email='user@example.com', password='Test-password-1')
+        hashing_pool.pending = POOL['MAX_PENDING']
+        response = APIClient().post('/api/users/login/', {
+            'email': 'user@example.com', 'password': 'Test-password-1',
+        }, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '5')
+
+class UserQueryBudgetTests(QueryBudgetMixin, TestCase):
+    password = 'Test-password-1'
+
+    def setUp(self):
+        self.owner = User.objects.create_user(email='owner@example.com', password=self.password)
+
+    def test_account_actions(self):
+        anonymous = Client()
+        self.assertQueryBudget(2, anonymous, 'post', '/api/users/register/', 201, data={
+            'email': 'new@example.com', 'password': self.password, 'password2': self.password, 'role': 'user',
+        }, content_type='application/json')
+        response = self.assertQueryBudget(
+            1, anonymous, 'post', '/api/users/login/', 200,
+            data={'email': self.owner.email, 'password': self.password}, content_type='application/json',
+        )
+        self.assertQueryBudget(
+            0, anonymous, 'post', '/api/users/token/refresh/', 200,
+            data={'refresh': response.json()['refresh']}, content_type='application/json',
+        )
+
+    def test_profile_actions(self):
+        client = bearer_client(self.owner)
+        self.assertQueryBudget(0, client, 'get', '/api/users/profile/', 200)
+        self.assertQueryBudget(1, client, 'get', '/api/users/guest-users/', 200)
+        self.assertQueryBudget(2, client, 'post', '/api/users/enable-mfa/', 200)
+        # enable_mfa's save dropped the user's snapshot
+        client.get('/api/users/profile/')
+        # A wrong code still runs the whole verification
+        self.assertQueryBudget(
+            1, client, 'post', '/api/users/verify-mfa/', 400,
+            data={'token': '000000'}, content_type='application/json',
+        )
+
+class TokenCacheTests(TestCase):
+    def test_blacklisting_a_token_revalidates_all_of_its_users_tokens(self):
+        user = User.objects.create_user(email='user@example.com', password='Test-password-1')
+        other = User.objects.create_user(email='other@example.com', password='Test-password-1')
+        tokens = [str(AccessToken.for_user(u)).encode() for u in (user, user, other)]
+        auth = CachedJWTAuthentication()
+        validate = mock.patch.object(
+            JWTAuthentication, 'get_validated_token', autospec=True,
+            side_effect=JWTAuthentication.get_validated_token,
+        )
+        with validate as validated:
+            for token in tokens * 2:
+                auth.get_validated_token(token)
+            self.assertEqual(validated.call_count, 3)
+
+            # As post_save sends it for a new BlacklistedToken of a refresh token
+            refresh_token = SimpleNamespace(token='refresh', user_id=user.id)
+            invalidate_blacklisted_token(None, SimpleNamespace(token=refresh_token), created=True)
+            validated.reset_mock()
+            for token in tokens:
+                auth.get_validated_token(token)
+            self.assertEqual([call.args[1] for call in validated.call_args_list], tokens[:2])
+
+class MFAReplayTests(TestCase):
+    password = 'Test-password-1'
+
+    def setUp(self):
+        self.secret = pyotp.random_base32()
+        self.user = User.objects.create_user(email='mfa@example.com', password=self.password)
+        self.user.mfa_secret = self.secret
+        self.user.is_mfa_enabled = True
+        self.user.save()
+
+    def login(self, code):
+        return APIClient().post('/api/users/login/', {
+            'email': self.user.email, 'password': self.password, 'mfa_token': code,
+        }, format='json')
+
+    def test_code_is_refused_on_a_second_login(self):
+        code = pyotp.TOTP(self.secret).now()
+        self.assertEqual(self.login(code).status_code, 200)
+        self.assertEqual(self.login(code).status_code, 401)
+
+    @override_settings(MFA_VERIFICATION=dict(settings.MFA_VERIFICATION, VALID_WINDOW=1))
+    def test_used_code_is_kept_while_it_is_still_accepted(self):
+        totp = pyotp.TOTP(self.secret)
+        step_start = (int(time.time()) // totp.interval) * totp.interval
+        # Accepted until the end of the step after the current one
+        accepted_for = 2 * totp.interval
+        for now in (step_start, step_start + totp.interval - 0.5):
+            with self.subTest(now=now), mock.patch.object(mfa, 'used_codes') as used_codes, \
+                    mock.patch.object(mfa.time, 'time', return_value=now):
+                self.assertTrue(mfa.verify_totp(self.user, totp.at(now)))
+                key, _, timeout = used_codes.return_value.add.call_args.args
+                self.assertGreaterEqual(now + timeout, step_start + accepted_for)
+
+class StartupCheckTests(TestCase):
+    @override_settings(SERVER_PROCESSES=4, DEBUG=False)
+    def test_per_process_mfa_cache_fails_with_several_workers(self):
+        checker = StartupCheck()
+        self.assertIsInstance(mfa.used_codes(), LocMemCache)
+        with self.assertRaisesMessage(Exception, 'replayed'):
+            checker.check_mfa_replay_cache()
+        with override_settings(DEBUG=True):
+            self.assertIn('replayed', checker.check_mfa_replay_cache())
+        with override_settings(SERVER_PROCESSES=1):
+            self.assertIsNone(checker.check_mfa_replay_cache())
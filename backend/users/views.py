@@ -1,10 +1,12 @@
 from django.shortcuts import render
 from rest_framework import status, generics, filters
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.response import Response
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.contrib.auth import authenticate, get_user_model
+from files.throttling import LoginAccountThrottle, LoginIPThrottle, MFAAccountThrottle
+from .hashers import PasswordHashingUnavailable
 from .serializers import (
     UserRegistrationSerializer,
     UserSerializer,
@@ -17,6 +19,13 @@ User = get_user_model()
 
 # Create your views here.
 
+def hashing_unavailable(exc):
+    return Response(
+        {'error': 'Too many sign-ins right now, please try again shortly'},
+        status=exc.status_code,
+        headers={'Retry-After': str(exc.retry_after)},
+    )
+
 class RegisterView(generics.CreateAPIView):
     permission_classes = (AllowAny,)
     serializer_class = UserRegistrationSerializer
@@ -24,7 +33,10 @@ class RegisterView(generics.CreateAPIView):
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
-            user = serializer.save()
+            try:
+                user = serializer.save()
+            except PasswordHashingUnavailable as exc:
+                return hashing_unavailable(exc)
             refresh = RefreshToken.for_user(user)
             return Response({
                 'user': UserSerializer(user).data,
@@ -35,16 +47,20 @@ class RegisterView(generics.CreateAPIView):
 
 class LoginView(generics.GenericAPIView):
     permission_classes = (AllowAny,)
+    throttle_classes = (LoginIPThrottle, LoginAccountThrottle)
     serializer_class = LoginSerializer
 
     def post(self, request):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
         
-        user = authenticate(
-            email=serializer.validated_data['email'],
-            password=serializer.validated_data['password']
-        )
+        try:
+            user = authenticate(
+                email=serializer.validated_data['email'],
+                password=serializer.validated_data['password']
+            )
+        except PasswordHashingUnavailable as exc:
+            return hashing_unavailable(exc)
         
         if not user:
             return Response(
@@ -100,6 +116,7 @@ def enable_mfa(request):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@throttle_classes([MFAAccountThrottle])
 def verify_mfa(request):
     serializer = MFATokenSerializer(data=request.data)
     serializer.is_valid(raise_exception=True)
@@ -9,6 +9,12 @@ export interface FileMetadata {
   owner_id: string;
 }
 
+interface FilePage {
+  next: string | null;
+  previous: string | null;
+  results: FileMetadata[];
+}
+
 export class FileService {
   static async uploadFile(file: Blob, filename: string, encryptedKey: string): Promise<FileMetadata> {
     const formData = new FormData();
@@ -42,8 +48,15 @@ export class FileService {
 
   static async listFiles(): Promise<FileMetadata[]> {
     try {
-      const response = await api.get('/files/');
-      return Array.isArray(response.data) ? response.data : [];
+      // The list is cursor-paginated; follow `next` until the last page
+      const files: FileMetadata[] = [];
+      let url: string | null = '/files/';
+      while (url) {
+        const response: { data: FilePage } = await api.get<FilePage>(url);
+        files.push(...response.data.results);
+        url = response.data.next;
+      }
+      return files;
     } catch (error) {
       console.error('Error listing files:', error);
       throw error;